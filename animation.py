@@ -0,0 +1,171 @@
+"""
+Animation tables: named states with their frames, loaded once per process,
+and the shared clocks of animated tiles
+"""
+from assets import asset_manager
+from render import CULL_CHUNK_WIDTH, CULL_MARGIN
+
+
+class AnimationSet:
+    """
+    The frames of every animation state of a character.
+
+    ``table`` maps a state name to ``(frame names, mirrored)``; frame
+    ``name`` is the file ``{path}_{name}.png``. A mirrored state also gets
+    flipped copies for facing left, others look the same both ways.
+    ``frames[state][facing]`` is the list of textures of a state (facing
+    0 is right, 1 is left), ``textures`` every texture once, ``numbers``
+    the place of a texture in it by ``id()``. The hit box is the one of
+    the first frame of ``hit_box_state``.
+    """
+
+    def __init__(self, path, table, hit_box_state):
+        self.frames = {}
+        self.textures = []
+        for state, (names, mirrored) in table.items():
+            right = [asset_manager.texture(f"{path}_{name}.png") for name in names]
+            self.textures.extend(right)
+            left = right
+            if mirrored:
+                left = [asset_manager.texture(f"{path}_{name}.png", flipped_horizontally=True)
+                        for name in names]
+                self.textures.extend(left)
+            self.frames[state] = (right, left)
+        self.numbers = {id(texture): number for number, texture in enumerate(self.textures)}
+        self.hit_box = self.frames[hit_box_state][0][0].hit_box_points
+
+
+# path -> (table, hit box state, AnimationSet), one per character for the whole process
+_animation_sets = {}
+
+
+def animation_set(path, table, hit_box_state):
+    """
+    The AnimationSet of a character, built on first use and then shared.
+    Asking for the same path with another table or hit box state is an error.
+    """
+    entry = _animation_sets.get(path)
+    if entry is None:
+        entry = _animation_sets[path] = (table, hit_box_state,
+                                         AnimationSet(path, table, hit_box_state))
+    elif (entry[0] is not table and entry[0] != table) or entry[1] != hit_box_state:
+        raise ValueError(f"animations of '{path}' are already loaded with another table or hit box state")
+    return entry[2]
+
+
+class TileClock:
+    """
+    The timer of one tile animation (same frames, same durations). Every
+    tile using it shows the same frame, so one clock serves them all.
+    """
+
+    def __init__(self, frames):
+        self.textures = [frame.texture for frame in frames]
+        self.durations = [frame.duration / 1000.0 for frame in frames]
+        self.frame = 0
+        self.time = 0.0
+
+    def advance(self, delta_time):
+        # Как AnimatedTimeBasedSprite.update_animation, только один раз на все тайлы
+        self.time += delta_time
+        durations = self.durations
+        while self.time > durations[self.frame]:
+            self.time -= durations[self.frame]
+            self.frame += 1
+            if self.frame >= len(durations):
+                self.frame = 0
+
+
+class TileAnimator:
+    """
+    Animates the time-based tiles (sprites with ``frames``) of some layers.
+
+    Tiles share the clock of their animation and are kept in column chunks
+    by center, like ChunkedLayer. ``update()`` advances every clock once and
+    swaps textures only in the columns around the visible range, and there
+    only when the frame changed since the column was last shown. The cost
+    of a tick depends on the number of animations and of visible tiles,
+    not on how many animated tiles the level has. Tiles must not move, but
+    can be added and removed (chunks of a streamed level).
+    """
+
+    def __init__(self, sprite_lists, column_width=CULL_CHUNK_WIDTH, margin=CULL_MARGIN):
+        self.column_width = column_width
+        # (texture ids, durations) -> TileClock
+        self.clocks = {}
+        # column -> {clock: [sprite, ...]}
+        self.columns = {}
+        # column -> {clock: frame its tiles show}
+        self.shown = {}
+        # id(sprite) -> (clock, column)
+        self.tiles = {}
+        # Seconds the clocks have run, for drawing animated tiles on the GPU
+        self.time = 0.0
+
+        # Широкий тайл может торчать из своей колонки на половину ширины
+        self._base_margin = margin
+        self.margin = margin
+        for sprite_list in sprite_lists:
+            for sprite in sprite_list:
+                if getattr(sprite, "frames", None):
+                    self.add(sprite)
+
+    @property
+    def tile_count(self):
+        return len(self.tiles)
+
+    def add(self, sprite):
+        """Animate one more tile."""
+        key = tuple((id(frame.texture), frame.duration) for frame in sprite.frames)
+        clock = self.clocks.get(key)
+        if clock is None:
+            clock = self.clocks[key] = TileClock(sprite.frames)
+        index = int(sprite.center_x // self.column_width)
+        self.columns.setdefault(index, {}).setdefault(clock, []).append(sprite)
+        self.shown.setdefault(index, {})
+        self.tiles[id(sprite)] = clock, index
+        self.margin = max(self.margin, self._base_margin + sprite.width / 2)
+
+    def remove(self, sprite):
+        """Stop animating a tile."""
+        tile = self.tiles.pop(id(sprite), None)
+        if tile is None:
+            return
+        clock, index = tile
+        column = self.columns[index]
+        column[clock].remove(sprite)
+        if not column[clock]:
+            del column[clock]
+            self.shown[index].pop(clock, None)
+        if not column:
+            del self.columns[index]
+            del self.shown[index]
+
+    def refresh(self, sprite):
+        """Show the current frame on a tile that was out of its layers (a restored pickup)."""
+        tile = self.tiles.get(id(sprite))
+        if tile is not None:
+            clock, _index = tile
+            sprite.texture = clock.textures[clock.frame]
+
+    def update(self, delta_time, left, right):
+        """Advance the clocks, then bring the tiles between ``left`` and ``right`` up to date."""
+        self.time += delta_time
+        for clock in self.clocks.values():
+            clock.advance(delta_time)
+
+        first = int((left - self.margin) // self.column_width)
+        last = int((right + self.margin) // self.column_width)
+        for index in range(first, last + 1):
+            column = self.columns.get(index)
+            if column is None:
+                continue
+            shown = self.shown[index]
+            for clock, sprites in column.items():
+                frame = clock.frame
+                if shown.get(clock) == frame:
+                    continue
+                shown[clock] = frame
+                texture = clock.textures[frame]
+                for sprite in sprites:
+                    sprite.texture = texture
@@ -0,0 +1,305 @@
+"""
+Shared asset manager for textures and sounds, and the on-disk cache of
+texture hit boxes
+"""
+import atexit
+import json
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+import PIL.Image
+import arcade
+
+from hashing import FileHashes
+
+
+# Memory budget for decoded images and sounds, in bytes
+ASSET_MEMORY_BUDGET = 256 * 1024 * 1024
+
+# Used when a sound source does not report its format
+DEFAULT_SOUND_BYTES_PER_SECOND = 44100 * 2 * 2
+
+# Hit boxes computed from pixels are kept here between runs
+HIT_BOX_CACHE_PATH = Path(__file__).resolve().parent / "data" / ".hitboxes.json"
+HIT_BOX_CACHE_VERSION = 1
+
+# Hit box algorithm: the rectangle around the opaque pixels, for layers
+# that are only collided as boxes. Cheap, so it is not cached on disk.
+HIT_BOX_BOUNDS = "Bounds"
+
+
+class HitBoxCache:
+    """
+    Hit boxes of textures saved on disk, keyed by the content hash of the
+    image file, the rectangle cut from it, flipping and the algorithm.
+    Loaded on first use; save() writes it back if anything was added,
+    dropping the boxes of files that changed (a recompiled atlas page).
+    """
+
+    def __init__(self, path=HIT_BOX_CACHE_PATH):
+        self.path = Path(path)
+        self.hits = 0
+        self.misses = 0
+        self._files = None
+        self._boxes = None
+        self._dirty = False
+        self._lock = threading.Lock()
+
+    def _load(self):
+        try:
+            with open(self.path, encoding="utf-8") as file:
+                data = json.load(file)
+        except (OSError, ValueError):
+            data = None
+        if not data or data.get("version") != HIT_BOX_CACHE_VERSION:
+            data = {"files": {}, "boxes": {}}
+        self._files = FileHashes(data["files"])
+        self._boxes = data["boxes"]
+
+    def key(self, path, rect, flips, algorithm):
+        """Cache key of a texture, None if the file is gone."""
+        with self._lock:
+            if self._boxes is None:
+                self._load()
+            digest = self._files.digest(path)
+        if digest is None:
+            return None
+        return f"{digest}:{','.join(map(str, rect))}:{flips}:{algorithm}"
+
+    def get(self, key):
+        with self._lock:
+            points = self._boxes.get(key)
+            if points is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return tuple(tuple(point) for point in points)
+
+    def put(self, key, points):
+        with self._lock:
+            self._boxes[key] = [list(point) for point in points]
+            self._dirty = True
+
+    def save(self):
+        """Write the cache if it changed."""
+        with self._lock:
+            if self._boxes is None:
+                return
+            files = len(self._files.entries)
+            current = self._files.prune()
+            stale = [key for key in self._boxes if key.split(":", 1)[0] not in current]
+            for key in stale:
+                del self._boxes[key]
+            if not (self._dirty or stale or len(self._files.entries) != files):
+                return
+            data = {"version": HIT_BOX_CACHE_VERSION,
+                    "files": self._files.entries, "boxes": self._boxes}
+            temp = Path(f"{self.path}.tmp")
+            try:
+                with open(temp, "w", encoding="utf-8") as file:
+                    json.dump(data, file, separators=(",", ":"))
+                os.replace(temp, self.path)
+            except OSError as error:
+                print(f"Hit box cache not saved: {error}")
+                return
+            self._dirty = False
+
+
+class CachedTexture(arcade.Texture):
+    """Texture that takes its hit box from a HitBoxCache, computing it only on a miss."""
+
+    def __init__(self, name, image, hit_box_algorithm, cache, cache_key):
+        super().__init__(name, image, hit_box_algorithm=hit_box_algorithm)
+        self._cache = cache
+        self._cache_key = cache_key
+
+    @property
+    def hit_box_points(self):
+        if self._hit_box_points is None:
+            points = self._cache.get(self._cache_key)
+            if points is None:
+                points = arcade.Texture.hit_box_points.fget(self)
+                self._cache.put(self._cache_key, points)
+            self._hit_box_points = points
+        return self._hit_box_points
+
+
+class AssetManager:
+    """
+    Process-wide cache of decoded textures and sounds.
+
+    Assets are keyed by path and load parameters (crop rectangle, flipping,
+    hit box algorithm). When the estimated size of everything held goes over
+    the budget, the least recently used entries are dropped. Hit boxes of
+    textures come from ``hit_boxes`` when they were computed in an earlier run.
+
+    Safe to use from a loader thread: the cache itself is locked, decoding
+    is not, so two threads may rarely decode the same file twice.
+    """
+
+    def __init__(self, budget_bytes=ASSET_MEMORY_BUDGET, hit_boxes=None):
+        self.budget_bytes = budget_bytes
+        self.used_bytes = 0
+        self.hit_boxes = hit_boxes
+
+        # key -> (asset, size in bytes), oldest first
+        self._entries = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._lock = threading.Lock()
+
+    def _get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def _put(self, key, asset, size):
+        with self._lock:
+            # Другой поток мог успеть загрузить то же самое - оставляем его вариант
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry[0]
+            self._entries[key] = (asset, size)
+            self.used_bytes += size
+            self._evict()
+            return asset
+
+    def _evict(self):
+        # Последний добавленный элемент не выбрасываем, даже если он один больше бюджета
+        while self.used_bytes > self.budget_bytes and len(self._entries) > 1:
+            _key, (_asset, size) = self._entries.popitem(last=False)
+            self.used_bytes -= size
+            self.evictions += 1
+
+    def set_budget(self, budget_bytes):
+        """Change the memory budget, evicting entries if needed."""
+        with self._lock:
+            self.budget_bytes = budget_bytes
+            self._evict()
+
+    def image(self, path):
+        """Decoded RGBA image of a file."""
+        key = ("image", str(path))
+        image = self._get(key)
+        if image is None:
+            image = PIL.Image.open(path).convert("RGBA")
+            image = self._put(key, image, image.width * image.height * 4)
+        return image
+
+    def texture(self, path, x=0, y=0, width=0, height=0,
+                flipped_horizontally=False,
+                flipped_vertically=False,
+                flipped_diagonally=False,
+                hit_box_algorithm="Simple"):
+        """
+        Texture from a file, optionally a sub-rectangle of it and flipped.
+        The source image is decoded once and shared by all variants.
+        ``hit_box_algorithm`` may also be HIT_BOX_BOUNDS.
+        """
+        key = ("texture", str(path), x, y, width, height,
+               flipped_horizontally, flipped_vertically, flipped_diagonally,
+               hit_box_algorithm)
+        texture = self._get(key)
+        if texture is not None:
+            return texture
+
+        image = self.image(path)
+        if width or height:
+            image = image.crop((x, y, x + width, y + height))
+        if flipped_diagonally:
+            image = image.transpose(PIL.Image.TRANSPOSE)
+        if flipped_horizontally:
+            image = image.transpose(PIL.Image.FLIP_LEFT_RIGHT)
+        if flipped_vertically:
+            image = image.transpose(PIL.Image.FLIP_TOP_BOTTOM)
+
+        # Имя должно быть уникальным для каждого варианта - по нему текстура ищется в атласе
+        name = "-".join(str(part) for part in key[1:])
+        if hit_box_algorithm == HIT_BOX_BOUNDS:
+            texture = arcade.Texture(name, image, hit_box_algorithm="None")
+            texture._hit_box_points = bounds_hit_box(image)
+        elif self.hit_boxes is not None and hit_box_algorithm in ("Simple", "Detailed"):
+            flips = (flipped_horizontally, flipped_vertically, flipped_diagonally)
+            cache_key = self.hit_boxes.key(path, (x, y, width, height),
+                                           "".join("1" if flip else "0" for flip in flips),
+                                           hit_box_algorithm)
+            texture = CachedTexture(name, image, hit_box_algorithm, self.hit_boxes, cache_key)
+        else:
+            texture = arcade.Texture(name, image, hit_box_algorithm=hit_box_algorithm)
+        return self._put(key, texture, image.width * image.height * 4)
+
+    def texture_pair(self, path):
+        """A texture and its mirror image."""
+        return [
+            self.texture(path),
+            self.texture(path, flipped_horizontally=True),
+        ]
+
+    def sound(self, path):
+        """Decoded (non-streaming) sound."""
+        key = ("sound", str(path))
+        sound = self._get(key)
+        if sound is None:
+            sound = arcade.load_sound(path)
+            sound = self._put(key, sound, _sound_size(sound))
+        return sound
+
+    def clear(self):
+        """Drop every cached asset."""
+        with self._lock:
+            self._entries.clear()
+            self.used_bytes = 0
+
+    def stats(self):
+        """Counters for hits, misses, evictions and memory use."""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": len(self._entries),
+            "hit_box_hits": self.hit_boxes.hits if self.hit_boxes else 0,
+            "hit_box_misses": self.hit_boxes.misses if self.hit_boxes else 0,
+            "used_bytes": self.used_bytes,
+            "budget_bytes": self.budget_bytes,
+        }
+
+
+def bounds_hit_box(image):
+    """Rectangle around the opaque pixels, as hit box points around the image center."""
+    bbox = image.getchannel("A").getbbox()
+    if bbox is None:
+        bbox = (0, 0, image.width, image.height)
+    left, top, right, bottom = bbox
+    # Как в arcade: y вверх, начало координат в центре картинки
+    x0, y0 = image.width / 2, image.height / 2
+    return ((left - x0, y0 - bottom), (right - x0, y0 - bottom),
+            (right - x0, y0 - top), (left - x0, y0 - top))
+
+
+def _sound_size(sound):
+    """Estimated size of a decoded sound in bytes."""
+    source = getattr(sound, "source", None)
+    duration = getattr(source, "duration", None) or 0
+    audio_format = getattr(source, "audio_format", None)
+    if audio_format:
+        bytes_per_second = (audio_format.sample_rate * audio_format.channels
+                            * audio_format.sample_size // 8)
+    else:
+        bytes_per_second = DEFAULT_SOUND_BYTES_PER_SECOND
+    return int(duration * bytes_per_second)
+
+
+# Один менеджер на весь процесс
+asset_manager = AssetManager(hit_boxes=HitBoxCache())
+atexit.register(asset_manager.hit_boxes.save)
@@ -0,0 +1,119 @@
+"""
+Texture atlases of levels: only the tile images a level uses, packed into
+a few pages that are written next to its compiled bundle
+"""
+import os
+
+import PIL.Image
+
+
+# Largest side of an atlas page in pixels
+ATLAS_MAX_SIZE = 2048
+
+# Transparent gap between packed images, so filtering never mixes neighbours
+ATLAS_PADDING = 1
+
+
+def atlas_page_path(out, page):
+    """File of page ``page`` of the atlas of the bundle ``out``."""
+    return out.with_name(f"{out.stem}_atlas{page}.png")
+
+
+def _shelves(sizes, order, page_width, max_size, padding):
+    pages = []
+    places = [None] * len(sizes)
+    x = y = shelf_height = right = 0
+    for index in order:
+        width, height = sizes[index]
+        if x + width > page_width:
+            x = 0
+            y += shelf_height + padding
+            shelf_height = 0
+        if y + height > max_size:
+            pages.append((right, y - padding))
+            x = y = shelf_height = right = 0
+        places[index] = (len(pages), x, y)
+        x += width + padding
+        right = max(right, x - padding)
+        shelf_height = max(shelf_height, height)
+    pages.append((right, y + shelf_height))
+    return pages, places
+
+
+def pack(sizes, max_size=ATLAS_MAX_SIZE, padding=ATLAS_PADDING):
+    """
+    Shelf packing of (width, height) rectangles, tallest first, into pages
+    of at most ``max_size``. Every power of two width is tried, the one
+    with the least page area wins. Returns the (width, height) of each
+    page and (page, x, y) of each rectangle.
+    """
+    if not sizes:
+        return [], []
+    for width, height in sizes:
+        if width > max_size or height > max_size:
+            raise ValueError(f"Image of {width}x{height} does not fit into a {max_size} atlas")
+    order = sorted(range(len(sizes)), key=lambda i: (-sizes[i][1], -sizes[i][0]))
+    widest = max(width for width, _height in sizes)
+
+    best = None
+    page_width = 64
+    while True:
+        if page_width >= widest:
+            pages, places = _shelves(sizes, order, min(page_width, max_size), max_size, padding)
+            # Меньше страниц важнее, потом меньше площадь
+            cost = (len(pages), sum(width * height for width, height in pages))
+            if best is None or cost < best[0]:
+                best = cost, pages, places
+        if page_width >= max_size:
+            break
+        page_width *= 2
+    return best[1], best[2]
+
+
+class AtlasReport:
+    """Decoded texture memory of a level before and after its atlas was built."""
+
+    def __init__(self, images, image_bytes, pages, page_bytes, regions):
+        self.images = images
+        self.image_bytes = image_bytes
+        self.pages = pages
+        self.page_bytes = page_bytes
+        self.regions = regions
+
+    def __str__(self):
+        return (f"{self.regions} tile images: {self.images} files, {self.image_bytes / 1024:.0f} kB"
+                f" -> {self.pages} atlas pages, {self.page_bytes / 1024:.0f} kB")
+
+
+def build_atlas(regions, out):
+    """
+    Copy ``regions`` - (image file, x, y, width, height) - into atlas pages
+    for the bundle ``out``. Returns the page files, (page, x, y) of every
+    region and an AtlasReport.
+    """
+    regions = list(regions)
+    pages, places = pack([region[3:] for region in regions])
+
+    # Каждый лист тайлсета открываем один раз
+    sources = {}
+    for path, *_rect in regions:
+        if path not in sources:
+            sources[path] = PIL.Image.open(path).convert("RGBA")
+
+    images = [PIL.Image.new("RGBA", size, (0, 0, 0, 0)) for size in pages]
+    for (path, x, y, width, height), (page, page_x, page_y) in zip(regions, places):
+        images[page].paste(sources[path].crop((x, y, x + width, y + height)), (page_x, page_y))
+
+    paths = []
+    for page, image in enumerate(images):
+        path = atlas_page_path(out, page)
+        # Как и бандл: сначала во временный файл
+        temp = path.with_name(path.name + ".tmp")
+        image.save(temp, format="PNG")
+        os.replace(temp, path)
+        paths.append(path)
+
+    report = AtlasReport(
+        len(sources), sum(image.width * image.height * 4 for image in sources.values()),
+        len(images), sum(width * height * 4 for width, height in pages), len(regions))
+    return paths, places, report
@@ -0,0 +1,286 @@
+"""
+Benchmarks for every data/level_*.json: loading, simulation and drawing.
+
+    python bench.py                                  # run, print, write bench_results.json
+    python bench.py --save-baseline bench_baseline.json
+    python bench.py --baseline bench_baseline.json --threshold 0.15 --threshold render_p95_ms=0.3
+
+Each level is measured in its own process, so "cold" loads really start
+with empty texture caches. Drawing uses an offscreen context
+(ARCADE_HEADLESS=1, Mesa/EGL on build machines). With --baseline the
+exit code is 1 if any metric got worse by more than its threshold.
+"""
+import argparse
+import glob
+import json
+import os
+import re
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+
+# Metrics where more is better, the rest are times and sizes
+HIGHER_IS_BETTER = {"sim_ticks_per_s"}
+
+# Default allowed regression, as a fraction of the baseline value
+DEFAULT_THRESHOLD = 0.10
+
+BENCH_TICKS = 3600
+BENCH_FRAMES = 300
+WARM_REPEATS = 3
+
+
+class RenderUnavailable(Exception):
+    """No OpenGL context could be created (no display, no Mesa/EGL)."""
+
+
+def _timed(function):
+    start = time.perf_counter()
+    result = function()
+    return result, (time.perf_counter() - start) * 1000
+
+
+def bench_load(level):
+    """Cold and warm load times (tile map + Scene) from JSON and from the bundle."""
+    import arcade
+    from game import LAYER_OPTIONS, TILE_SCALING, level_map_name, load_scene
+    from level_bundle import load_json_tilemap
+
+    map_name = level_map_name(level)
+
+    def load_json():
+        tile_map = load_json_tilemap(map_name, TILE_SCALING, LAYER_OPTIONS)
+        return arcade.Scene.from_tilemap(tile_map)
+
+    def load_game():
+        steps = load_scene(level)
+        while True:
+            try:
+                next(steps)
+            except StopIteration as stop:
+                return stop.value
+
+    result = {}
+    tracemalloc.start()
+    _scene, result["load_json_cold_ms"] = _timed(load_json)
+    result["load_json_peak_kb"] = tracemalloc.get_traced_memory()[1] // 1024
+    tracemalloc.reset_peak()
+    _scene, result["load_game_cold_ms"] = _timed(load_game)
+    result["load_game_peak_kb"] = tracemalloc.get_traced_memory()[1] // 1024
+    tracemalloc.stop()
+
+    result["load_json_warm_ms"] = min(_timed(load_json)[1] for _ in range(WARM_REPEATS))
+    result["load_game_warm_ms"] = min(_timed(load_game)[1] for _ in range(WARM_REPEATS))
+    return result
+
+
+def bench_simulation(level, ticks):
+    """Ticks per second of the game logic with the scripted bot from headless.py."""
+    from game import GameSession
+    from headless import run
+
+    session = GameSession.load(level, heals=2)
+    ran, elapsed = _timed(lambda: run(session, ticks))
+    return {
+        "sim_ticks": ran,
+        "sim_ticks_per_s": ran / (elapsed / 1000),
+        "sim_queries_per_tick": session.physics_engine.queries / ran,
+        "rewind_kb": session.rewind.bytes_used / 1024,
+        "rewind_encode_us": session.rewind.encode_us,
+    }
+
+
+def bench_render(level, frames):
+    """Milliseconds per GameView.on_draw, offscreen, while the bot walks the level."""
+    import arcade
+    from game import STATE_PLAYING, GameView
+    from headless import run_right
+
+    try:
+        window = arcade.Window(800, 600, "bench", visible=False)
+    except Exception as error:
+        raise RenderUnavailable(str(error)) from error
+    view = GameView(level, 2, sound=False)
+    view.setup()
+    window.show_view(view)
+
+    samples = []
+    for frame in range(frames):
+        run_right(view.session, view.session.ticks)
+        view.on_update(view.timestep.step)
+        if view.session.state != STATE_PLAYING:
+            break
+        start = time.perf_counter()
+        view.on_draw()
+        # Ждём GPU, иначе меряем только постановку команд в очередь
+        window.ctx.finish()
+        samples.append((time.perf_counter() - start) * 1000)
+    window.close()
+
+    samples.sort()
+    return {
+        "render_frames": len(samples),
+        "render_mean_ms": sum(samples) / len(samples),
+        "render_p95_ms": samples[min(len(samples) - 1, int(len(samples) * 0.95))],
+        "render_draw_calls": view.scene_renderer.draw_calls,
+    }
+
+
+def bench_level(level, ticks, frames, render=True):
+    """Every benchmark of one level. Meant to run in a fresh process."""
+    result = {"level": level}
+    result.update(bench_load(level))
+    result.update(bench_simulation(level, ticks))
+    if render:
+        try:
+            result.update(bench_render(level, frames))
+        except RenderUnavailable as error:
+            # Нет OpenGL (нет Mesa/EGL) - остальные цифры всё равно нужны
+            result["render_error"] = str(error)
+        except Exception as error:
+            # А вот упавшая отрисовка - провал, а не пропуск
+            result["failed"] = True
+            result["error"] = f"render: {error!r}"
+    result["max_rss_kb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return result
+
+
+def run_levels(levels, ticks, frames, render=True):
+    results = []
+    for level in levels:
+        command = [sys.executable, os.path.abspath(__file__), "--worker", str(level),
+                   "--ticks", str(ticks), "--frames", str(frames)]
+        if not render:
+            command.append("--no-render")
+        env = dict(os.environ, ARCADE_HEADLESS="1")
+        output = subprocess.run(command, env=env, capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)))
+        try:
+            output.check_returncode()
+            # Последняя строка - результат, выше может быть вывод arcade
+            results.append(json.loads(output.stdout.strip().splitlines()[-1]))
+        except (subprocess.CalledProcessError, ValueError, IndexError) as error:
+            # Упавший уровень не должен терять результаты остальных
+            lines = output.stderr.strip().splitlines()
+            results.append({"level": level, "failed": True,
+                            "error": lines[-1] if lines else str(error)})
+            print(f"level {level} failed: {results[-1]['error']}")
+    return results
+
+
+def compare(results, baseline, thresholds, default_threshold):
+    """Lines describing every metric that got worse than allowed."""
+    old_levels = {row["level"]: row for row in baseline["levels"]}
+    regressions = []
+    for row in results:
+        old = old_levels.get(row["level"])
+        if row.get("failed"):
+            regressions.append(f"level {row['level']} failed: {row['error']}")
+        if old is None:
+            continue
+        # Метрика из базы, которой теперь нет, - тоже регрессия, иначе сломанная
+        # отрисовка просто пропадает из сравнения
+        for metric, old_value in old.items():
+            if metric == "level" or not _is_number(old_value) or _is_number(row.get(metric)):
+                continue
+            reason = "missing"
+            if metric.startswith("render_") and "render_error" in row:
+                reason = f"render_error: {row['render_error']}"
+            regressions.append(f"level {row['level']} {metric}: {old_value:.2f} -> {reason}")
+        for metric, value in row.items():
+            old_value = old.get(metric)
+            if metric == "level" or not _is_number(value) or not _is_number(old_value) or not old_value:
+                continue
+            threshold = thresholds.get(metric, default_threshold)
+            if metric in HIGHER_IS_BETTER:
+                change = (old_value - value) / old_value
+            else:
+                change = (value - old_value) / old_value
+            if change > threshold:
+                regressions.append(f"level {row['level']} {metric}: {old_value:.2f} -> {value:.2f} "
+                                   f"(worse by {change:.0%}, allowed {threshold:.0%})")
+    return regressions
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _print_table(results):
+    columns = ["level", "load_json_cold_ms", "load_json_warm_ms", "load_game_cold_ms",
+               "load_game_warm_ms", "load_json_peak_kb", "sim_ticks_per_s", "render_mean_ms",
+               "render_p95_ms"]
+    print(" ".join(f"{column:>18}" for column in columns))
+    for row in results:
+        cells = []
+        for column in columns:
+            value = row.get(column, "-")
+            cells.append(f"{value:18.1f}" if isinstance(value, float) else f"{value!s:>18}")
+        print(" ".join(cells))
+
+
+def _levels():
+    names = glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "level_[0-9]*.json"))
+    return sorted(int(re.search(r"level_(\d+)", name).group(1)) for name in names)
+
+
+def _threshold(text):
+    if "=" in text:
+        metric, value = text.split("=", 1)
+        return metric, float(value)
+    return None, float(text)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Level benchmarks")
+    parser.add_argument("levels", nargs="*", type=int, help="level numbers, all by default")
+    parser.add_argument("--ticks", type=int, default=BENCH_TICKS, help="simulation ticks per level")
+    parser.add_argument("--frames", type=int, default=BENCH_FRAMES, help="frames drawn per level")
+    parser.add_argument("--no-render", action="store_true", help="skip the drawing benchmark")
+    parser.add_argument("--output", default="bench_results.json", help="where to write the results")
+    parser.add_argument("--baseline", help="compare with this results file")
+    parser.add_argument("--save-baseline", metavar="FILE", help="also write the results here")
+    parser.add_argument("--threshold", action="append", type=_threshold, default=[],
+                        help="allowed regression: 0.1 for every metric or metric=0.3 for one")
+    parser.add_argument("--worker", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker is not None:
+        print(json.dumps(bench_level(args.worker, args.ticks, args.frames, not args.no_render)))
+        return 0
+
+    results = run_levels(args.levels or _levels(), args.ticks, args.frames, not args.no_render)
+    report = {
+        "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "ticks": args.ticks,
+        "frames": args.frames,
+        "levels": results,
+    }
+    _print_table(results)
+    for path in filter(None, (args.output, args.save_baseline)):
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as file:
+            baseline = json.load(file)
+        default_threshold = DEFAULT_THRESHOLD
+        thresholds = {}
+        for metric, value in args.threshold:
+            if metric is None:
+                default_threshold = value
+            else:
+                thresholds[metric] = value
+        regressions = compare(results, baseline, thresholds, default_threshold)
+        for line in regressions:
+            print("REGRESSION", line)
+        if regressions:
+            return 1
+        print(f"No regressions against {args.baseline}")
+    return 1 if any(row.get("failed") for row in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
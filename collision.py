@@ -0,0 +1,669 @@
+"""
+Collision with the tile layers through grids of map cells.
+
+Walls and ladders never move, so instead of a spatial hash of sprites each
+of them is kept as a grid with one byte per cell: 0 for an empty cell,
+otherwise the number of the cell's hit box in a small table of shapes.
+Pets, hearts, exits and hazards share one TriggerMap. A query looks only at
+the cells under the player, so its cost does not grow with the size of the
+map or the number of things on it.
+
+GridPhysicsEngine is arcade.PhysicsEnginePlatformer with the walls and
+ladders answered by grids. Moving platforms stay sprites and are checked
+the usual way.
+"""
+import math
+from array import array
+
+import arcade
+
+
+# GridPhysicsEngine повторяет внутренности PhysicsEnginePlatformer именно этой версии
+ARCADE_SERIES = "2.6."
+if not arcade.version.VERSION.startswith(ARCADE_SERIES):
+    raise ImportError(f"collision.py follows arcade {ARCADE_SERIES}x physics, "
+                      f"found arcade {arcade.version.VERSION}")
+
+# Kinds of triggers in a TriggerMap, bits of a cell's mask
+TRIGGER_PET = 1
+TRIGGER_EXIT = 2
+TRIGGER_HEAL = 4
+TRIGGER_DAMAGE = 8
+TRIGGER_CHECKPOINT = 16
+TRIGGER_ALL = (TRIGGER_PET | TRIGGER_EXIT | TRIGGER_HEAL | TRIGGER_DAMAGE
+               | TRIGGER_CHECKPOINT)
+
+
+def polygons_intersect(poly_a, poly_b):
+    """
+    Separating axis test, same arithmetic as arcade's
+    are_polygons_intersecting, so the answers match to the last bit.
+    Touching polygons do not intersect.
+    """
+    for polygon in (poly_a, poly_b):
+        x2, y2 = polygon[-1]
+        for x1, y1 in polygon:
+            # Нормаль к ребру (предыдущая точка -> текущая), как в arcade
+            normal_x = y1 - y2
+            normal_y = x2 - x1
+            x2, y2 = x1, y1
+
+            min_a = max_a = None
+            for x, y in poly_a:
+                projected = normal_x * x + normal_y * y
+                if min_a is None:
+                    min_a = max_a = projected
+                elif projected < min_a:
+                    min_a = projected
+                elif projected > max_a:
+                    max_a = projected
+
+            min_b = max_b = None
+            for x, y in poly_b:
+                projected = normal_x * x + normal_y * y
+                if min_b is None:
+                    min_b = max_b = projected
+                elif projected < min_b:
+                    min_b = projected
+                elif projected > max_b:
+                    max_b = projected
+
+            if max_a <= min_b or max_b <= min_a:
+                return False
+    return True
+
+
+def _bounds(points):
+    """Left, bottom, right and top of a polygon."""
+    left, bottom = right, top = points[0]
+    for x, y in points:
+        if x < left:
+            left = x
+        elif x > right:
+            right = x
+        if y < bottom:
+            bottom = y
+        elif y > top:
+            top = y
+    return left, bottom, right, top
+
+
+def _has_axis_edges(points):
+    """True if the polygon has both a vertical and a horizontal edge."""
+    vertical = horizontal = False
+    x2, y2 = points[-1]
+    for x1, y1 in points:
+        if x1 == x2 and y1 != y2:
+            vertical = True
+        elif y1 == y2 and x1 != x2:
+            horizontal = True
+        x2, y2 = x1, y1
+    return vertical and horizontal
+
+
+class _Shape:
+    """Hit box of a tile relative to the center of its cell."""
+
+    __slots__ = ("points", "left", "bottom", "right", "top", "boxed")
+
+    def __init__(self, points):
+        self.points = points
+        self.left = min(x for x, _y in points)
+        self.right = max(x for x, _y in points)
+        self.bottom = min(y for _x, y in points)
+        self.top = max(y for _x, y in points)
+        # С вертикальным и горизонтальным ребром проверка по осям среди
+        # осей SAT, и непересекающиеся рамки точно значат "нет столкновения"
+        self.boxed = _has_axis_edges(points)
+
+
+class CollisionBox:
+    """
+    Invisible rectangle: a wall made of several solid tiles merged into one,
+    or the area of a checkpoint. Stands in for sprites in hit lists and
+    trigger maps, so it looks like a static sprite.
+    """
+
+    __slots__ = ("left", "bottom", "right", "top", "points")
+
+    change_x = 0
+    change_y = 0
+
+    def __init__(self, left, bottom, right, top):
+        self.left = left
+        self.bottom = bottom
+        self.right = right
+        self.top = top
+        self.points = [(left, bottom), (right, bottom), (right, top), (left, top)]
+
+    def get_adjusted_hit_box(self):
+        return self.points
+
+
+class TileGrid:
+    """
+    Static sprites of one or more layers, indexed by grid cell.
+
+    A sprite that sits exactly in a cell, unrotated and with its hit box
+    inside the cell, is stored as a byte in ``cells``. The few that do not
+    fit (objects placed off the grid, tiles larger than a cell, a second
+    tile in the same cell) go to a sparse ``overflow`` dict of cells and
+    are checked as sprites.
+
+    With ``merge`` the tiles that fill their whole cell are merged into as
+    few rectangles (CollisionBox) as possible; their cells are marked BOX
+    and ``box_of`` has the number of the box.
+
+    A grid of a part of the map (a chunk of a streamed level) starts at
+    column ``first_column``; boxes, overflow and queries stay in map
+    coordinates.
+    """
+
+    MAX_SHAPES = 254
+    BOX = 255
+
+    def __init__(self, sprite_lists, columns, rows, cell_size, merge=False, first_column=0):
+        self.first_column = first_column
+        self.columns = columns
+        self.rows = rows
+        self.cell_size = cell_size
+        self.cells = bytearray(columns * rows)
+        # Номер 0 - пустая клетка
+        self.shapes = [None]
+        self._shape_numbers = {}
+        # Only for reporting what was hit, queries use cells and shapes
+        self.sprites = {}
+        self.overflow = {}
+        self.boxes = []
+        self.box_of = None
+        self._merged_tiles = 0
+        for sprite_list in sprite_lists:
+            for sprite in sprite_list:
+                self.add(sprite)
+        # Сколько было спрайтов до слияния, для отчёта
+        self.tile_count = len(self.sprites) + len({id(sprite) for sprites in self.overflow.values()
+                                                   for sprite in sprites})
+        if merge:
+            self._merge()
+
+    @property
+    def body_count(self):
+        """Tiles, boxes and overflow sprites the queries test against."""
+        return self.tile_count - self._merged_tiles + len(self.boxes)
+
+    def _is_full(self, shape):
+        """True if the shape is the whole cell, a square with maybe extra points on its sides."""
+        half = self.cell_size / 2
+        if (shape.left, shape.bottom, shape.right, shape.top) != (-half, -half, half, half):
+            return False
+        corners = {(-half, -half), (half, -half), (half, half), (-half, half)}
+        return (corners <= set(shape.points)
+                and all(abs(x) == half or abs(y) == half for x, y in shape.points))
+
+    def _merge(self):
+        """Greedy: take the lowest leftmost free solid cell, grow right, then up."""
+        columns, rows, size = self.columns, self.rows, self.cell_size
+        first_column = self.first_column
+        full_shapes = {number for number, shape in enumerate(self.shapes)
+                       if shape is not None and self._is_full(shape)}
+        cells = self.cells
+        solid = bytearray(1 if number in full_shapes else 0 for number in cells)
+        self.box_of = array("I", bytes(4 * len(cells)))
+
+        for row in range(rows):
+            column = 0
+            while column < columns:
+                if not solid[row * columns + column]:
+                    column += 1
+                    continue
+                end = column
+                while end + 1 < columns and solid[row * columns + end + 1]:
+                    end += 1
+                top = row
+                while top + 1 < rows and all(solid[(top + 1) * columns + column:(top + 1) * columns + end + 1]):
+                    top += 1
+
+                box = CollisionBox((first_column + column) * size, row * size,
+                                   (first_column + end + 1) * size, (top + 1) * size)
+                for box_row in range(row, top + 1):
+                    for index in range(box_row * columns + column, box_row * columns + end + 1):
+                        solid[index] = 0
+                        cells[index] = self.BOX
+                        self.box_of[index] = len(self.boxes)
+                        # Тайл остаётся только для рисования
+                        del self.sprites[index]
+                        self._merged_tiles += 1
+                self.boxes.append(box)
+                column = end + 1
+
+    def _shape_number(self, points):
+        number = self._shape_numbers.get(points)
+        if number is None:
+            if len(self.shapes) > self.MAX_SHAPES:
+                return None
+            number = len(self.shapes)
+            self.shapes.append(_Shape(points))
+            self._shape_numbers[points] = number
+        return number
+
+    def add(self, sprite):
+        size = self.cell_size
+        half = size / 2
+        column = int((sprite.center_x - half) // size) - self.first_column
+        row = int((sprite.center_y - half) // size)
+        # Точки как в Sprite.get_adjusted_hit_box: сначала масштаб, потом сдвиг
+        scale = sprite.scale
+        points = tuple((x * scale, y * scale) for x, y in sprite.get_hit_box())
+
+        number = None
+        if (not sprite.angle
+                and 0 <= column < self.columns and 0 <= row < self.rows
+                and sprite.center_x == (self.first_column + column) * size + half
+                and sprite.center_y == row * size + half
+                and all(-half <= x <= half and -half <= y <= half for x, y in points)
+                and not self.cells[row * self.columns + column]):
+            number = self._shape_number(points)
+
+        if number is None:
+            self._add_overflow(sprite)
+            return
+        index = row * self.columns + column
+        self.cells[index] = number
+        self.sprites[index] = sprite
+
+    def _add_overflow(self, sprite):
+        size = self.cell_size
+        left, bottom, right, top = _bounds(sprite.get_adjusted_hit_box())
+        for column in range(math.floor(left / size), math.floor(right / size) + 1):
+            for row in range(math.floor(bottom / size), math.floor(top / size) + 1):
+                self.overflow.setdefault((column, row), []).append(sprite)
+
+    def _query(self, sprite, first_only):
+        points = sprite.get_adjusted_hit_box()
+        left, bottom, right, top = _bounds(points)
+
+        size = self.cell_size
+        half = size / 2
+        first_column = math.floor(left / size)
+        last_column = math.floor(right / size)
+        first_row = math.floor(bottom / size)
+        last_row = math.floor(top / size)
+
+        hits = []
+        cells = self.cells
+        shapes = self.shapes
+        columns = self.columns
+        offset = self.first_column
+        boxes = self.boxes
+        box_of = self.box_of
+        box_number = self.BOX
+        seen_boxes = []
+        for row in range(max(first_row, 0), min(last_row, self.rows - 1) + 1):
+            center_y = row * size + half
+            base = row * columns
+            for column in range(max(first_column - offset, 0),
+                                min(last_column - offset, columns - 1) + 1):
+                number = cells[base + column]
+                if not number:
+                    continue
+                if number == box_number:
+                    box = boxes[box_of[base + column]]
+                    # Большой ящик лежит во многих клетках, проверяем один раз
+                    if box in seen_boxes:
+                        continue
+                    seen_boxes.append(box)
+                    if (box.right <= left or right <= box.left
+                            or box.top <= bottom or top <= box.bottom):
+                        continue
+                    if polygons_intersect(points, box.points):
+                        hits.append(box)
+                        if first_only:
+                            return hits
+                    continue
+                shape = shapes[number]
+                center_x = (offset + column) * size + half
+                if shape.boxed and (
+                        center_x + shape.right <= left or right <= center_x + shape.left
+                        or center_y + shape.top <= bottom or top <= center_y + shape.bottom):
+                    continue
+                tile = [(x + center_x, y + center_y) for x, y in shape.points]
+                if polygons_intersect(points, tile):
+                    hits.append(self.sprites[base + column])
+                    if first_only:
+                        return hits
+
+        if self.overflow:
+            for column in range(first_column, last_column + 1):
+                for row in range(first_row, last_row + 1):
+                    for other in self.overflow.get((column, row), ()):
+                        if other not in hits and arcade.check_for_collision(sprite, other):
+                            hits.append(other)
+                            if first_only:
+                                return hits
+        return hits
+
+    def hits(self, sprite):
+        """Sprites of the grid the sprite collides with."""
+        return self._query(sprite, first_only=False)
+
+    def collides(self, sprite):
+        """True if the sprite collides with anything in the grid."""
+        return bool(self._query(sprite, first_only=True))
+
+
+class TriggerMap:
+    """
+    Everything the player can touch without bumping into it (pets, hearts,
+    exits, hazards, checkpoints) in one grid. Each cell has a bitmask of the kinds of
+    triggers over it in ``cells`` and their handles in ``handles``, so all
+    contacts of a tick come from one look at the cells under the player.
+
+    A handle is the number of a trigger, ``sprites[handle]`` its sprite.
+    A removed trigger keeps its handle and sprite and can be put back with
+    ``restore``, ``active`` has a 1 for every trigger in the grid.
+
+    Like TileGrid, a map of a chunk starts at column ``first_column``.
+    """
+
+    def __init__(self, columns, rows, cell_size, first_column=0):
+        self.first_column = first_column
+        self.columns = columns
+        self.rows = rows
+        self.cell_size = cell_size
+        self.cells = bytearray(columns * rows)
+        self.handles = {}
+        self.sprites = []
+        self.kinds = []
+        self.active = bytearray()
+        self._cells_of = []
+
+    def _cell_range(self, left, bottom, right, top):
+        """Cells under a box. Anything outside the map counts as the edge cell."""
+        size = self.cell_size
+        offset = self.first_column
+        first_column = min(max(math.floor(left / size) - offset, 0), self.columns - 1)
+        last_column = min(max(math.floor(right / size) - offset, 0), self.columns - 1)
+        first_row = min(max(math.floor(bottom / size), 0), self.rows - 1)
+        last_row = min(max(math.floor(top / size), 0), self.rows - 1)
+        return [row * self.columns + column
+                for row in range(first_row, last_row + 1)
+                for column in range(first_column, last_column + 1)]
+
+    def add(self, sprite, kind):
+        """Add a trigger of one of the TRIGGER_* kinds. Returns its handle."""
+        handle = len(self.sprites)
+        cells = self._cell_range(*_bounds(sprite.get_adjusted_hit_box()))
+        self.sprites.append(sprite)
+        self.kinds.append(kind)
+        self.active.append(0)
+        self._cells_of.append(cells)
+        self.restore(handle)
+        return handle
+
+    def add_layer(self, sprite_list, kind):
+        for sprite in sprite_list:
+            self.add(sprite, kind)
+
+    def remove(self, handle):
+        """Take a trigger out of the grid (a pet or a heart that was picked up)."""
+        if not self.active[handle]:
+            return
+        kinds = self.kinds
+        for index in self._cells_of[handle]:
+            handles = self.handles[index]
+            handles.remove(handle)
+            mask = 0
+            for other in handles:
+                mask |= kinds[other]
+            self.cells[index] = mask
+        self.active[handle] = 0
+
+    def restore(self, handle):
+        """Put a removed trigger back into the grid."""
+        if self.active[handle]:
+            return
+        kind = self.kinds[handle]
+        for index in self._cells_of[handle]:
+            self.cells[index] |= kind
+            self.handles.setdefault(index, []).append(handle)
+        self.active[handle] = 1
+
+    def query(self, sprite, kinds=TRIGGER_ALL):
+        """Handles of the triggers the sprite touches, as {kind: [handle, ...]}."""
+        points = sprite.get_adjusted_hit_box()
+        contacts = {}
+        seen = set()
+        cells = self.cells
+        for index in self._cell_range(*_bounds(points)):
+            if not cells[index] & kinds:
+                continue
+            for handle in self.handles[index]:
+                kind = self.kinds[handle]
+                if not kind & kinds or handle in seen:
+                    continue
+                seen.add(handle)
+                if polygons_intersect(points, self.sprites[handle].get_adjusted_hit_box()):
+                    contacts.setdefault(kind, []).append(handle)
+        return contacts
+
+
+class ContactState:
+    """
+    What the player touches, asked of the physics engine at most once until
+    something moves: is it on a ladder, can it jump (is there ground within
+    ``y_distance`` under it).
+
+    Ladders never move, so the ladder answer only goes stale when the
+    player moves. The ground also goes stale when platforms move.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self._on_ladder = None
+        self._can_jump = {}
+
+    def invalidate(self):
+        """Call when the player moved: a tick, a respawn."""
+        self._on_ladder = None
+        self._can_jump.clear()
+
+    def platforms_moved(self):
+        self._can_jump.clear()
+
+    def is_on_ladder(self):
+        if self._on_ladder is None:
+            self._on_ladder = self.engine.is_on_ladder()
+        return self._on_ladder
+
+    def can_jump(self, y_distance=5):
+        hit = self._can_jump.get(y_distance)
+        if hit is None:
+            hit = self._can_jump[y_distance] = self.engine.can_jump(y_distance)
+        return hit
+
+
+class GridPhysicsEngine(arcade.PhysicsEnginePlatformer):
+    """
+    PhysicsEnginePlatformer whose walls and ladders are TileGrids.
+
+    The player is moved exactly as arcade moves it (same probes, same
+    ramp-up and push-out steps), only every probe is a grid lookup, so
+    levels play the same. The player sprite must not rotate.
+
+    With a ``platform_system`` (platforms.py) the platforms are moved by it
+    in one batch instead of sprite by sprite.
+    """
+
+    def __init__(self, player_sprite, walls, platforms=None, gravity_constant=0.5, ladders=None,
+                 platform_system=None):
+        super().__init__(player_sprite, platforms=platforms, gravity_constant=gravity_constant)
+        self.wall_grid = walls
+        self.ladder_grid = ladders
+        self.platform_system = platform_system
+        # Collision queries made so far (moves, ladder and ground checks)
+        self.queries = 0
+        # Ladder and ground answers for the current positions
+        self.contacts = ContactState(self)
+
+    def _hits(self):
+        self.queries += 1
+        player = self.player_sprite
+        hits = self.wall_grid.hits(player)
+        if self.platforms:
+            hits += arcade.check_for_collision_with_lists(player, self.platforms)
+        return hits
+
+    def _collides(self):
+        self.queries += 1
+        player = self.player_sprite
+        if self.wall_grid.collides(player):
+            return True
+        return bool(self.platforms and arcade.check_for_collision_with_lists(player, self.platforms))
+
+    def is_on_ladder(self):
+        """True if the player touches a ladder."""
+        self.queries += 1
+        return self.ladder_grid is not None and self.ladder_grid.collides(self.player_sprite)
+
+    def can_jump(self, y_distance=5):
+        """True if there is a wall or a platform right under the player."""
+        self.player_sprite.center_y -= y_distance
+        hit = self._collides()
+        self.player_sprite.center_y += y_distance
+
+        if hit:
+            self.jumps_since_ground = 0
+        return hit or self.allow_multi_jump and self.jumps_since_ground < self.allowed_jumps
+
+    def _circular_check(self):
+        """Move the player out of a wall it is stuck in, as arcade does."""
+        player = self.player_sprite
+        original_x = player.center_x
+        original_y = player.center_y
+        vary = 1
+        while True:
+            for dx, dy in ((0, 1), (0, -1), (1, 0), (-1, 0), (1, 1), (1, -1), (-1, 1), (-1, -1)):
+                player.center_x = original_x + dx * vary
+                player.center_y = original_y + dy * vary
+                if not self._collides():
+                    return
+            vary *= 2
+
+    def _move_player(self):
+        """arcade's _move_sprite with ramp_up, without the rotation part."""
+        player = self.player_sprite
+
+        if self._collides():
+            self._circular_check()
+
+        original_x = player.center_x
+        original_y = player.center_y
+
+        # --- Move in the y direction
+        player.center_y += player.change_y
+        hit_list = self._hits()
+        complete_hit_list = list(hit_list)
+        if hit_list:
+            if player.change_y > 0:
+                while self._collides():
+                    player.center_y -= 1
+            elif player.change_y < 0:
+                for item in hit_list:
+                    while polygons_intersect(player.get_adjusted_hit_box(), item.get_adjusted_hit_box()):
+                        player.center_y += 0.25
+                    if item.change_x != 0:
+                        player.center_x += item.change_x
+            player.change_y = min(0.0, hit_list[0].change_y)
+        player.center_y = round(player.center_y, 2)
+
+        # --- Move in the x direction
+        if player.change_x:
+            almost_original_y = player.center_y
+            direction = math.copysign(1, player.change_x)
+            cur_x_change = abs(player.change_x)
+            upper_bound = cur_x_change
+            lower_bound = 0
+            cur_y_change = 0
+
+            while True:
+                player.center_x = original_x + cur_x_change * direction
+                collision_check = self._hits()
+                for sprite in collision_check:
+                    if sprite not in complete_hit_list:
+                        complete_hit_list.append(sprite)
+
+                if collision_check:
+                    # Can we ramp up and not collide?
+                    cur_y_change = cur_x_change
+                    player.center_y = original_y + cur_y_change
+                    if self._collides():
+                        cur_y_change -= cur_x_change
+                    else:
+                        collided = False
+                        while not collided and cur_y_change > 0:
+                            cur_y_change -= 1
+                            player.center_y = almost_original_y + cur_y_change
+                            collided = self._collides()
+                        cur_y_change += 1
+                        break
+
+                    upper_bound = cur_x_change - 1
+                    if upper_bound - lower_bound <= 0:
+                        cur_x_change = lower_bound
+                        break
+                    cur_x_change = (upper_bound + lower_bound) // 2
+                else:
+                    lower_bound = cur_x_change
+                    if upper_bound - lower_bound <= 0:
+                        break
+                    cur_x_change = (upper_bound + lower_bound) // 2 + (upper_bound + lower_bound) % 2
+
+            player.center_x = original_x + cur_x_change * direction
+            player.center_y = almost_original_y + cur_y_change
+
+        return complete_hit_list
+
+    def _move_platforms(self):
+        """Move platforms between their boundaries, as arcade does."""
+        if self.platform_system is not None:
+            self.platform_system.move()
+            return
+        for platform_list in self.platforms:
+            for platform in platform_list:
+                if platform.change_x == 0 and platform.change_y == 0:
+                    continue
+
+                if platform.boundary_left and platform.left <= platform.boundary_left:
+                    platform.left = platform.boundary_left
+                    if platform.change_x < 0:
+                        platform.change_x *= -1
+
+                if platform.boundary_right and platform.right >= platform.boundary_right:
+                    platform.right = platform.boundary_right
+                    if platform.change_x > 0:
+                        platform.change_x *= -1
+
+                platform.center_x += platform.change_x
+
+                if platform.boundary_top is not None and platform.top >= platform.boundary_top:
+                    platform.top = platform.boundary_top
+                    if platform.change_y > 0:
+                        platform.change_y *= -1
+
+                if platform.boundary_bottom is not None and platform.bottom <= platform.boundary_bottom:
+                    platform.bottom = platform.boundary_bottom
+                    if platform.change_y < 0:
+                        platform.change_y *= -1
+
+                platform.center_y += platform.change_y
+
+    def update(self):
+        """Move the player and the platforms. Returns the sprites the player touched."""
+        # Игрок не двигался с прошлого тика, ответ про лестницу ещё верен
+        if not self.contacts.is_on_ladder():
+            self.player_sprite.change_y -= self.gravity_constant
+
+        hit_list = self._move_player()
+        self._move_platforms()
+        self.contacts.invalidate()
+        return hit_list
@@ -1,8 +1,27 @@
 """
 Platformer Template
 """
+import argparse
+import os
+import struct
+import time
+
 import arcade
 
+from animation import TileAnimator, animation_set
+from assets import HIT_BOX_BOUNDS, asset_manager
+from collision import (TRIGGER_CHECKPOINT, TRIGGER_DAMAGE, TRIGGER_EXIT, TRIGGER_HEAL,
+                       TRIGGER_PET, CollisionBox, GridPhysicsEngine, TileGrid, TriggerMap)
+from hud import Hud
+from level_bundle import load_tilemap, prepare_tilemap
+from platforms import PlatformSystem
+from prefetch import Prefetcher
+from profiler import FrameProfiler, ProfilerOverlay
+from render import SceneRenderer, StreamRenderer
+from replay import REPLAY_SUFFIX, InputRecorder, InputReplay
+from rewind import REWIND_BUDGET, REWIND_SECONDS, RewindBuffer, pack_bits, unpack_bits
+from streaming import LevelStream, StreamedGrid, StreamedTriggers
+from timestep import SIMULATION_RATE, FixedTimestep, Interpolation
 
 # --- Constants
 SCREEN_TITLE = "Приключения Алисы"
@@ -21,7 +40,18 @@ GRID_PIXEL_SIZE = SPRITE_PIXEL_SIZE * TILE_SCALING
 RIGHT_FACING = 0
 LEFT_FACING = 1
 
-# Movement speed of player, in pixels per frame
+# Кадры игрока: файлы {PLAYER_IMAGE_PATH}_{кадр}.png. Состояние: (кадры,
+# нужны ли зеркальные копии для взгляда влево). На лестнице - спиной к нам
+PLAYER_IMAGE_PATH = "./data/img/player/player"
+PLAYER_ANIMATIONS = {
+    "idle": (["idle"], True),
+    "walk": (["walk0", "walk1"], True),
+    "jump": (["jump"], True),
+    "fall": (["fall"], True),
+    "climb": (["climb0", "climb1"], False),
+}
+
+# Movement speed of player, in pixels per simulation tick (see timestep.py)
 PLAYER_MOVEMENT_SPEED = 3
 GRAVITY = 1
 PLAYER_JUMP_SPEED = 15
@@ -40,21 +70,239 @@ LAYER_NAME_BACKGROUND = "back"
 LAYER_NAME_DONT_TOUCH = "dont_touch"
 LAYER_NAME_LADDERS = "ladders"
 LAYER_NAME_PLAYER = "Player"
+LAYER_NAME_HEALS = "heals"
+LAYER_NAME_EXIT = "exit"
+# Необязательный слой объектов: точки или прямоугольники, где игрок возродится
+LAYER_NAME_CHECKPOINTS = "checkpoints"
+
+# A checkpoint given as a point is touched within this square around it
+CHECKPOINT_SIZE = GRID_PIXEL_SIZE * 2
+
+# Слои, которые меняются во время игры. Остальные видимые слои без анимации
+# один раз запекаются в текстуры при загрузке уровня
+LIVE_LAYERS = [
+    LAYER_NAME_COINS,
+    LAYER_NAME_HEALS,
+    LAYER_NAME_MOVING_PLATFORMS,
+    LAYER_NAME_PLAYER,
+]
+
+# Эти слои двигаются, их нельзя делить на колонки для отсечения
+MOVING_LAYERS = [
+    LAYER_NAME_MOVING_PLATFORMS,
+    LAYER_NAME_PLAYER,
+]
+
+# Tiled layer property: "animate": false keeps the tiles of a layer on their first frame.
+# Every other layer that is not moving gets its animated tiles run by a TileAnimator
+LAYER_PROPERTY_ANIMATE = "animate"
+
+# Платформы дальше этого от игрока (по x) замирают, пока он не подойдёт.
+# None - двигаются все: так уровни и старые записи ввода идут как раньше
+PLATFORM_SLEEP_DISTANCE = None
 
 #начальное значение жизней
 START_HEALS = 0
 
+MAX_SCORE = [3,4,3,3,3,1] #на первом уровне 3, на втором 4 и т.д.
+PETS_NAME = ['Кошки', 'Куры', 'Щенки', 'Еноты', 'Птицы', 'Медведь']
+PETS_SOUND_FILE = [
+    "./data/sounds/cat.mp3",
+    "./data/sounds/chiken.mp3",
+    "./data/sounds/dog.mp3",
+    "./data/sounds/cat.mp3",
+    "./data/sounds/beard.mp3",
+    "./data/sounds/bear.mp3"
+]
+
+# Состояния уровня в GameSession
+STATE_PLAYING = "playing"
+STATE_FINISHED = "finished"
+STATE_GAME_OVER = "game_over"
+STATES = [STATE_PLAYING, STATE_FINISHED, STATE_GAME_OVER]
+
+# Кадр перемотки: очки, жизни, состояние, игрок (x, y, скорость, взгляд,
+# кадр анимации, текстура, флаги, прыжки), точка возрождения, чекпоинт,
+# число триггеров. Дальше REWIND_PLATFORM на каждую платформу и битовая
+# маска триггеров
+REWIND_FRAME = struct.Struct("<hhBddddBBBBHddhI")
+# Moving platform: position and velocity
+REWIND_PLATFORM = struct.Struct("<dddd")
+
+# Куда записывать ввод игрока (python game.py --record DIR), None - не записывать
+record_dir = None
+
+# Куда сохранять замеры фаз кадра в конце уровня (python game.py --profile DIR)
+profile_dir = None
+
+# Рисовать статичные слои тайлов из сетки на GPU, а не запекать (python game.py --tile-grid)
+tile_grid_renderer = False
+
+# Строить уровень кусками по мере движения камеры (python game.py --stream)
+stream_levels = False
+
+# Ширина потокового уровня в колонках (--stream-width): None - как в файле
+# уровня, шире - колонки уровня повторяются, 0 - без конца
+stream_width = None
+
+# Сколько памяти отдать под перемотку, в байтах (python game.py --rewind-budget KB)
+rewind_budget = REWIND_BUDGET
+
+# Показать/скрыть замеры фаз кадра
+PROFILER_KEY = arcade.key.F3
+
+# Начать уровень заново (на экране Game Over - с последнего чекпоинта)
+RESTART_KEY = arcade.key.R
+
+# Пока нажата, игра идёт назад
+REWIND_KEY = arcade.key.BACKSPACE
+
 #нужно для джойстика, погрешность калибровки
 DEAD_ZONE = 0.05
 
-def load_texture_pair(filename):
+# Layer specific options are defined based on Layer names in a dictionary.
+# Walls, ladders, pickups and hazards are collided through the grids in
+# collision.py, so their sprites are only drawn and need no spatial hash.
+# Moving platforms are still checked as sprites. The grids only need the
+# box around a wall, ladder or exit tile, so those get HIT_BOX_BOUNDS
+# instead of a polygon traced from the pixels.
+LAYER_OPTIONS = {
+    "table": {
+        "use_spatial_hash": True,
+    },
+    "moving_platforms": {
+        "use_spatial_hash": True,
+    },
+    LAYER_NAME_PLATFORMS: {
+        "hit_box_algorithm": HIT_BOX_BOUNDS,
+    },
+    LAYER_NAME_LADDERS: {
+        "hit_box_algorithm": HIT_BOX_BOUNDS,
+    },
+    LAYER_NAME_EXIT: {
+        "hit_box_algorithm": HIT_BOX_BOUNDS,
+    },
+}
+
+
+def animated_layers(scene):
+    """The layers whose animated tiles a TileAnimator runs."""
+    return [sprite_list for name, sprite_list in scene.name_mapping.items()
+            if name not in MOVING_LAYERS
+            and (sprite_list.properties or {}).get(LAYER_PROPERTY_ANIMATE, True)]
+
+
+def level_map_name(level):
+    """Name of map file to load"""
+    return f"./data/level_{level}.json"
+
+
+def prepare_level(level, cancelled=None):
+    """Part of loading a level that can run on a worker thread (no GL)."""
+    return prepare_tilemap(level_map_name(level), TILE_SCALING, LAYER_OPTIONS, cancelled)
+
+
+def load_scene(level, tile_map=None):
+    """
+    Build the scene of a level, yielding between steps. Needs no window.
+    Returns (tile_map, scene). Without a prepared tile_map the level is
+    loaded here in one step.
+    """
+    if tile_map is None:
+        tile_map = load_tilemap(level_map_name(level), TILE_SCALING, LAYER_OPTIONS)
+    else:
+        for _layer in tile_map.build_steps():
+            yield
+
+    # Initialize Scene with our TileMap, this will automatically add all layers
+    # from the map as SpriteLists in the scene in the proper order.
+    scene = arcade.Scene.from_tilemap(tile_map)
+    scene.add_sprite_list_after(LAYER_NAME_PLAYER, LAYER_NAME_FOREGROUND)
+    return tile_map, scene
+
+
+def build_level(level, tile_map=None):
+    """
+    Build the scene of a level on the main thread and bake it, yielding
+    between steps. Returns (tile_map, scene, scene_renderer).
+    """
+    tile_map, scene = yield from load_scene(level, tile_map)
+    yield
+
+    # Bake the layers that never change into offscreen textures
+    # (with --tile-grid most of them are drawn from their tile grids instead)
+    scene_renderer = SceneRenderer(
+        scene,
+        tile_map.width * GRID_PIXEL_SIZE,
+        tile_map.height * GRID_PIXEL_SIZE,
+        live_layers=LIVE_LAYERS,
+        moving_layers=MOVING_LAYERS,
+        defer_bake=True,
+        tile_map=tile_map if tile_grid_renderer else None,
+    )
+    for _chunk in scene_renderer.bake_steps():
+        yield
+
+    return tile_map, scene, scene_renderer
+
+
+def load_stream(level, width=None):
+    """
+    Start a streamed level: only the object layers are built, the tiles
+    come chunk by chunk. ``width`` in columns as in ``stream_width``.
+    Needs no window. Returns (tile_map, scene, stream, layer names in
+    drawing order).
+    """
+    tile_map = prepare_level(level).build_objects()
+    scene = arcade.Scene.from_tilemap(tile_map)
+    scene.add_sprite_list(LAYER_NAME_PLAYER)
+    if width is None:
+        width = tile_map.width
+    stream = LevelStream(tile_map, width or None)
+
+    layer_names = tile_map.layer_names
+    layer_names.insert(layer_names.index(LAYER_NAME_FOREGROUND) + 1, LAYER_NAME_PLAYER)
+    return tile_map, scene, stream, layer_names
+
+
+def load_level(level):
+    """Load a level right away, on the main thread."""
+    steps = build_level(level)
+    while True:
+        try:
+            next(steps)
+        except StopIteration as stop:
+            return stop.value
+
+
+# Следующий уровень грузится в фоне, пока игрок смотрит на меню и диалоги
+level_prefetcher = Prefetcher(prepare_level, build_level)
+
+
+def prefetch_level(level):
+    """Start loading a level in the background, if there is such a level."""
+    # Потоковый уровень заранее целиком не строится
+    if os.path.exists(level_map_name(level)) and not stream_levels:
+        level_prefetcher.start(level)
+
+def checkpoint_box(shape, tile_map):
     """
-    Load a texture pair, with the second being a mirror image.
+    Area of a checkpoint object as a CollisionBox in scene coordinates.
+    A point gets a CHECKPOINT_SIZE square around it.
     """
-    return [
-        arcade.load_texture(filename),
-        arcade.load_texture(filename, flipped_horizontally=True),
-    ]
+    if not isinstance(shape[0], (list, tuple)):
+        x, y = shape
+        half = CHECKPOINT_SIZE / 2
+        return CollisionBox(x - half, y - half, x + half, y + half)
+
+    # Прямоугольники и многоугольники arcade оставляет в пикселях Tiled,
+    # а у прямоугольников y ещё и не перевёрнут (все y <= 0)
+    if all(y <= 0 for _x, y in shape):
+        map_height = tile_map.height * tile_map.tile_height
+        shape = [(x, map_height + y) for x, y in shape]
+    xs = [x * TILE_SCALING for x, _y in shape]
+    ys = [y * TILE_SCALING for _x, y in shape]
+    return CollisionBox(min(xs), min(ys), max(xs), max(ys))
 
 
 class PlayerCharacter(arcade.Sprite):
@@ -77,376 +325,393 @@ class PlayerCharacter(arcade.Sprite):
         self.climbing = False
         self.is_on_ladder = False
 
-        # --- Load Textures ---
-
-        main_path = "./data/img/player/player"
-
-        # Load textures for idle standing
-        self.idle_texture_pair = load_texture_pair(f"{main_path}_idle.png")
-        self.jump_texture_pair = load_texture_pair(f"{main_path}_jump.png")
-        self.fall_texture_pair = load_texture_pair(f"{main_path}_fall.png")
-
-        # Load textures for walking
-        self.walk_textures = []
-        texture = load_texture_pair(f"{main_path}_walk0.png")
-        self.walk_textures.append(texture)
-        texture = load_texture_pair(f"{main_path}_walk1.png")
-        self.walk_textures.append(texture)
-
+        # Textures and hit box are loaded once per process, every player shares them
+        self.animations = animation_set(PLAYER_IMAGE_PATH, PLAYER_ANIMATIONS, "idle")
 
-        # Load textures for climbing
-        self.climbing_textures = []
-        texture = arcade.load_texture(f"{main_path}_climb0.png")
-        self.climbing_textures.append(texture)
-        texture = arcade.load_texture(f"{main_path}_climb1.png")
-        self.climbing_textures.append(texture)
+        # Every texture the player shows, rewind frames store its number here
+        self.textures = self.animations.textures
 
         # Set the initial texture
-        self.texture = self.idle_texture_pair[0]
-
-        # Hit box will be set based on the first image used. If you want to specify
-        # a different hit box, you can do it like the code below.
-        # set_hit_box = [[-22, -64], [22, -64], [22, 28], [-22, 28]]
-        self.hit_box = self.texture.hit_box_points
-
-       
+        self.texture = self.animations.frames["idle"][RIGHT_FACING][0]
+        self.hit_box = self.animations.hit_box
 
+    def animation_state(self):
+        """Name of the animation to show, a key of PLAYER_ANIMATIONS."""
+        if self.climbing:
+            return "climb"
+        if self.change_y > 0:
+            return "jump"
+        if self.change_y < 0:
+            return "fall"
+        if self.change_x == 0:
+            return "idle"
+        return "walk"
 
     def update_animation(self, delta_time: float = 1 / 60):
 
-       
         # Figure out if we need to flip face left or right
         if self.change_x < 0 and self.character_face_direction == RIGHT_FACING:
             self.character_face_direction = LEFT_FACING
         elif self.change_x > 0 and self.character_face_direction == LEFT_FACING:
             self.character_face_direction = RIGHT_FACING
 
-        # Climbing animation
-        if self.is_on_ladder:
-            self.climbing = True
-        if not self.is_on_ladder and self.climbing:
-            self.climbing = False
-        if self.climbing and abs(self.change_y) > 1:
+        self.climbing = self.is_on_ladder
+        state = self.animation_state()
+        frames = self.animations.frames[state][self.character_face_direction]
+
+        # Шаги сменяются каждый тик, на лестнице - только пока игрок лезет
+        if state == "walk" or (state == "climb" and abs(self.change_y) > 1):
             self.cur_texture += 1
-            if self.cur_texture > 1:
+            if self.cur_texture >= len(frames):
                 self.cur_texture = 0
-        if self.climbing:
-            self.texture = self.climbing_textures[self.cur_texture]
-            return
-
-        # Jumping animation
-        if self.change_y > 0 and not self.is_on_ladder:
-            self.texture = self.jump_texture_pair[self.character_face_direction]
-            return
-        elif self.change_y < 0 and not self.is_on_ladder:
-            self.texture = self.fall_texture_pair[self.character_face_direction]
-            return
-
-        # Idle animation
-        if self.change_x == 0:
-            self.texture = self.idle_texture_pair[self.character_face_direction]
-            return
-
-        # Walking animation
-        self.cur_texture += 1
-        if self.cur_texture > 1:
-            self.cur_texture = 0
-        self.texture = self.walk_textures[self.cur_texture][
-            self.character_face_direction
-        ]
-        
+        self.texture = frames[self.cur_texture % len(frames)]
 
 
-
-class GameView(arcade.View):
+class LevelSnapshot:
     """
-    Main application class.
+    Everything about a level that changes while it is played: score, lives,
+    the player, moving platforms, which pets and hearts are still there and
+    the last checkpoint. Only numbers and references to existing sprites,
+    so GameSession.restore() puts it back without disk or new sprites.
     """
 
-    def __init__(self, level, heals):
+    def __init__(self, session):
+        player = session.player_sprite
+        self.score = session.score
+        self.heals = session.heals
+        self.state = session.state
+        self.player = (player.position, player.change_x, player.change_y,
+                       player.character_face_direction, player.cur_texture, player.texture,
+                       player.jumping, player.climbing, player.is_on_ladder)
+        self.jumps_since_ground = session.physics_engine.jumps_since_ground
+        self.platforms = [(sprite, sprite.position, sprite.change_x, sprite.change_y)
+                          for sprite in session.scene[LAYER_NAME_MOVING_PLATFORMS]]
+        # 1 - триггер на месте, 0 - подобран
+        self.triggers = bytes(session.triggers.active)
+        self.respawn_point = session.respawn_point
+        self.checkpoint = session.checkpoint
+
+    def pack(self, session):
+        """
+        The snapshot as a rewind frame, bytes of the same length for every
+        tick of a level (a streamed level makes them longer as it finds triggers).
+        """
+        (x, y), change_x, change_y, face, cur_texture, texture, jumping, climbing, on_ladder = self.player
+        flags = jumping | climbing << 1 | on_ladder << 2
+        checkpoint = -1 if self.checkpoint is None else self.checkpoint
+        parts = [REWIND_FRAME.pack(self.score, self.heals, STATES.index(self.state),
+                                   x, y, change_x, change_y, face, cur_texture,
+                                   session.player_sprite.animations.numbers[id(texture)], flags,
+                                   self.jumps_since_ground, *self.respawn_point, checkpoint,
+                                   len(self.triggers))]
+        for _sprite, (x, y), change_x, change_y in self.platforms:
+            parts.append(REWIND_PLATFORM.pack(x, y, change_x, change_y))
+        parts.append(pack_bits(self.triggers))
+        return b"".join(parts)
+
+    @classmethod
+    def unpack(cls, session, frame):
+        """A snapshot from a rewind frame made by ``pack``."""
+        snapshot = cls.__new__(cls)
+        (snapshot.score, snapshot.heals, state, x, y, change_x, change_y, face, cur_texture,
+         texture, flags, snapshot.jumps_since_ground, respawn_x, respawn_y,
+         checkpoint, triggers) = REWIND_FRAME.unpack_from(frame, 0)
+        snapshot.state = STATES[state]
+        snapshot.player = ((x, y), change_x, change_y, face, cur_texture,
+                           session.player_sprite.textures[texture],
+                           bool(flags & 1), bool(flags & 2), bool(flags & 4))
+        snapshot.respawn_point = (respawn_x, respawn_y)
+        snapshot.checkpoint = None if checkpoint < 0 else checkpoint
+
+        offset = REWIND_FRAME.size
+        snapshot.platforms = []
+        for sprite in session.scene[LAYER_NAME_MOVING_PLATFORMS]:
+            x, y, change_x, change_y = REWIND_PLATFORM.unpack_from(frame, offset)
+            snapshot.platforms.append((sprite, (x, y), change_x, change_y))
+            offset += REWIND_PLATFORM.size
+        snapshot.triggers = unpack_bits(frame[offset:], triggers)
+        return snapshot
+
+
+class GameSession:
+    """
+    The game logic of one level: map, player, physics, pickups, lives and
+    the exit. Needs no window, sound or GPU, so it can also run headless
+    (see headless.py). GameView draws it and plays its sounds.
 
-        # Call the parent class and set up the window
-        #super().__init__(SCREEN_WIDTH, SCREEN_HEIGHT,SCREEN_TITLE, resizable=True)
-        #super().__init__(SCREEN_WIDTH, SCREEN_HEIGHT, SCREEN_TITLE, fullscreen=True)        
-        super().__init__()
-    
-        #arcade.set_viewport(0, self.window.width, 0, self.window.height)
+    With a ``stream`` (see load_stream) the tile layers are not in the
+    scene: their chunks are built around the view every tick, and the
+    collision grids, triggers and animated tiles cover only those.
+    """
+
+    def __init__(self, level, heals, tile_map, scene, play_sound=None, profiler=None,
+                 sprite_restored=None, stream=None):
 
         # Track the current state of what key is pressed
-        self.window.set_mouse_visible(False)
         self.left_pressed = False
         self.right_pressed = False
         self.up_pressed = False
         self.down_pressed = False
         self.jump_needs_reset = False
-        
-        
-        # Our TileMap Object
-        self.tile_map = None
-
-        # Our Scene Object
-        self.scene = None
 
-        # Separate variable that holds the player sprite
-        self.player_sprite = None
-
-        # Our physics engine
-        self.physics_engine = None
+        # Our TileMap Object
+        self.tile_map = tile_map
 
-        # A Camera that can be used for scrolling the screen
-        self.camera_sprites = None
+        # Chunks of a streamed level, None when the whole level is built
+        self.stream = stream
 
-        # A non-scrolling camera that can be used to draw GUI elements
-        self.camera_gui = None
+        # Our Scene Object
+        self.scene = scene
 
         # Keep track of the score
         self.score = 0
-        
-        self.max_score = [3,4,3,3,3,1] #на первом уровне 3, на втором 4 и т.д.
-        self.pets_name = ['Кошки', 'Куры', 'Щенки', 'Еноты', 'Птицы', 'Медведь']
-        
-        pets_sound_file = [
-        "./data/sounds/cat.mp3",
-        "./data/sounds/chiken.mp3",
-        "./data/sounds/dog.mp3",
-        "./data/sounds/cat.mp3",
-        "./data/sounds/beard.mp3",
-        "./data/sounds/bear.mp3"
-        ]
+
+        self.max_score = MAX_SCORE[level - 1]
 
         # What key is pressed down?
         self.left_key_down = False
         self.right_key_down = False
-        
-        # Where is the right edge of the map?
-        self.end_of_map = 0
 
         # Level
         self.level = level
-        self.reset_score = True
-
         self.heals = heals
 
-        self.heals_count_list = None
+        # playing, finished or game_over
+        self.state = STATE_PLAYING
 
-        # Load sounds
-        pet_sound_file_now = pets_sound_file[self.level - 1]
-        self.pet_sound = arcade.load_sound(pet_sound_file_now)
+        # Number of ticks run so far
+        self.ticks = 0
 
-        self.jump_sound = arcade.load_sound("./data/sounds/jump.mp3")
-        self.game_over_sound = arcade.load_sound("./data/sounds/gameover.mp3")
-        self.heals_sound = arcade.load_sound("./data/sounds/heals.mp3")
-        self.level_end_sound = arcade.load_sound("./data/sounds/level_end.mp3")
+        # Times the phases of update(), off unless GameView turns it on
+        self.profiler = profiler or FrameProfiler()
 
+        # Called with a sound name ("pet", "jump", ...), None to play nothing
+        self.play_sound = play_sound or (lambda name: None)
 
+        # Called with (sprite_list, sprite) when a restore puts a picked up
+        # pet or heart back, so GameView can draw it again
+        self.sprite_restored = sprite_restored or (lambda sprite_list, sprite: None)
 
-        #---------------------------джойстик (от сюда)------------------------
-        # Get list of game controllers that are available
-        joysticks = arcade.get_joysticks()
-        # If we have any...
-        if joysticks:
-            # Grab the first one in  the list
-            self.joystick = joysticks[0]
-            # Open it for input
-            self.joystick.open()
-            # Push this object as a handler for joystick events.
-            # Required for the on_joy* events to be called.
-            self.joystick.push_handlers(self)
-        else:
-            # Handle if there are no joysticks.
-            ##print("Не вижу джойстик, подключи джойстик и попробуй снова")
-            self.joystick = None
-
-    # noinspection PyMethodMayBeStatic
-    def on_joybutton_press(self, _joystick, button):
-        """ Handle button-down event for the joystick """
-        if button == 0:
-            self.up_pressed = True
-        elif button == 2:
-            self.down_pressed = True
-        else:
-            self.up_pressed = False
-            self.down_pressed = False
-        self.process_keychange()    
-        #print("Button {} down (press)".format(button))
-
-    # noinspection PyMethodMayBeStatic
-    def on_joybutton_release(self, _joystick, button):
-        """ Handle button-up event for the joystick """
-        if button == 0:
-            self.up_pressed = False
-            self.jump_needs_reset = False
-        elif button == 2:
-            self.down_pressed = False
-        else:
-            pass
-        #print("Button {} up(release)".format(button))
-        self.process_keychange()
-    
-    def on_joyaxis_motion(self, _joystick, axis, value):
-        #print("Axis {}, value {}".format(axis, value))
-        
-        if axis == 'x':
-            if value >= DEAD_ZONE:
-                self.right_pressed = True
-            elif value <= -DEAD_ZONE:
-                self.left_pressed = True
-            else:
-                self.right_pressed = False
-                self.left_pressed = False
-        if axis == 'y':
-            if value >= DEAD_ZONE:
-                self.down_pressed = True
-            elif value <= -DEAD_ZONE:
-                self.up_pressed = True
-            else:
-                self.up_pressed = False
-                self.down_pressed = False
-                self.jump_needs_reset = False
-        else:
-            '''
-            self.right_pressed = False
-            self.left_pressed = False
-            self.up_pressed = False
-            self.down_pressed = False
-            self.jump_needs_reset = False
-            '''
-        self.process_keychange()
-
-    # noinspection PyMethodMayBeStatic
-    def on_joyhat_motion(self, _joystick, hat_x, hat_y):
-        """ Handle hat events """
-        #print("Hat ({}, {})".format(hat_x, hat_y))
-    #---------------------------джойстик (до сюда)------------------------
-
-
+        # Set up the player, specifically placing it at these coordinates.
+        self.player_sprite = PlayerCharacter()
+        self.player_sprite.center_x = PLAYER_START_X
+        self.player_sprite.center_y = PLAYER_START_Y
+        self.scene.add_sprite(LAYER_NAME_PLAYER, self.player_sprite)
 
-    def setup(self):
-        """Set up the game here. Call this function to restart the game."""
+        # Where the player comes back after a fall or a hazard: the start,
+        # then the last checkpoint touched (its trigger handle in checkpoint)
+        self.respawn_point = (PLAYER_START_X, PLAYER_START_Y)
+        self.checkpoint = None
 
-        # Setup the Cameras
-        self.camera_sprites = arcade.Camera(self.window.width, self.window.height)#когда приложение было на основе окна а не представления, было без window
-        self.camera_gui = arcade.Camera(self.window.width, self.window.height)
+        # (left, right) of what GameView shows, None headless (then a screen around the player)
+        self.view = None
 
-        # Name of map file to load
-        map_name = f"./data/level_{self.level}.json"
-
-        # Layer specific options are defined based on Layer names in a dictionary
-        # Doing this will make the SpriteList for the platforms layer
-        # use spatial hashing for detection.
-        layer_options = {
-            "hard": {
-                "use_spatial_hash": True,
-            },
-            "pets": {
-                "use_spatial_hash": True,
-            },
-            "table": {
-                "use_spatial_hash": True,
-            },
-            "moving_platforms": {
-                "use_spatial_hash": True,
-            },
-            "ladder": {
-                "use_spatial_hash": True,
-            },
-            "exit": {
-                "use_spatial_hash": True,
-            },
-            "heals": {
-                "use_spatial_hash": True,
-            },
-        }
-
-        # Read in the tiled map
-        self.tile_map = arcade.load_tilemap(map_name, TILE_SCALING, layer_options)
-
-        # Initialize Scene with our TileMap, this will automatically add all layers
-        # from the map as SpriteLists in the scene in the proper order.
-        self.scene = arcade.Scene.from_tilemap(self.tile_map)
+        if stream is None:
+            # Calculate the right edge of the my_map in pixels
+            self.end_of_map = self.tile_map.width * GRID_PIXEL_SIZE
 
-        # Set the background color
-        if self.tile_map.background_color:
-            arcade.set_background_color(self.tile_map.background_color)
+            # Static layers as occupancy grids, queries look only at the cells
+            # around the player (see collision.py)
+            self.wall_grid = self.tile_grid(LAYER_NAME_PLATFORMS, merge=True)
+            self.ladder_grid = self.tile_grid(LAYER_NAME_LADDERS)
 
-        # Keep track of the score
-        if self.reset_score:
-            self.score = 0
-        self.reset_score = True
+            # Pets, hearts, exits and hazards: one lookup per tick finds them all
+            self.triggers = TriggerMap(self.tile_map.width, self.tile_map.height, GRID_PIXEL_SIZE)
+            self.triggers.add_layer(self.scene[LAYER_NAME_COINS], TRIGGER_PET)
+            self.triggers.add_layer(self.scene[LAYER_NAME_EXIT], TRIGGER_EXIT)
+            self.triggers.add_layer(self.scene[LAYER_NAME_HEALS], TRIGGER_HEAL)
+            self.triggers.add_layer(self.scene[LAYER_NAME_DONT_TOUCH], TRIGGER_DAMAGE)
 
-        self.scene.add_sprite_list_after("Player", LAYER_NAME_FOREGROUND)
+            # Animated tiles: one clock per animation, textures change only near the camera
+            self.tile_animator = TileAnimator(animated_layers(self.scene))
+        else:
+            # Бесконечный уровень: камера упирается только в левый край
+            self.end_of_map = stream.pixel_width
+
+            # The same grids and triggers, a piece per built chunk
+            self.wall_grid = StreamedGrid(stream, [LAYER_NAME_PLATFORMS], merge=True)
+            self.ladder_grid = StreamedGrid(stream, [LAYER_NAME_LADDERS])
+            self.triggers = StreamedTriggers(stream, {
+                LAYER_NAME_COINS: TRIGGER_PET,
+                LAYER_NAME_EXIT: TRIGGER_EXIT,
+                LAYER_NAME_HEALS: TRIGGER_HEAL,
+                LAYER_NAME_DONT_TOUCH: TRIGGER_DAMAGE,
+            })
+            self.tile_animator = TileAnimator(())
+            # chunk index -> its animated tiles
+            self.animated_tiles = {}
+            stream.listen(self.chunk_loaded, self.chunk_unloaded)
+            self.update_stream()
+
+        for checkpoint in self.tile_map.object_lists.get(LAYER_NAME_CHECKPOINTS, ()):
+            self.triggers.add(checkpoint_box(checkpoint.shape, self.tile_map), TRIGGER_CHECKPOINT)
+        # В таком порядке, как раньше шли проверки столкновений
+        self.trigger_handlers = [
+            (TRIGGER_PET, self.pick_up_pet),
+            (TRIGGER_EXIT, self.reach_exit),
+            (TRIGGER_HEAL, self.pick_up_heal),
+            (TRIGGER_CHECKPOINT, self.reach_checkpoint),
+        ]
+        # Layers of the triggers that are picked up, a restore can bring them back
+        # (у потокового уровня они свои у каждого куска, см. pickup_list)
+        if stream is None:
+            self.pickup_lists = {
+                TRIGGER_PET: self.scene[LAYER_NAME_COINS],
+                TRIGGER_HEAL: self.scene[LAYER_NAME_HEALS],
+            }
+        else:
+            self.pickup_lists = dict.fromkeys((TRIGGER_PET, TRIGGER_HEAL))
 
-        # Set up the player, specifically placing it at these coordinates.
-        self.player_sprite = PlayerCharacter()
-        self.player_sprite.center_x = PLAYER_START_X
-        self.player_sprite.center_y = PLAYER_START_Y
-        self.scene.add_sprite(LAYER_NAME_PLAYER, self.player_sprite)
+        # Moving platforms are advanced in one batch from flat arrays
+        self.platform_system = PlatformSystem(self.scene[LAYER_NAME_MOVING_PLATFORMS])
 
-     
-        
-        # Calculate the right edge of the my_map in pixels
-        self.end_of_map = self.tile_map.width * GRID_PIXEL_SIZE
-        
         # --- Other stuff
         # Create the 'physics engine'
-        self.physics_engine = arcade.PhysicsEnginePlatformer(
+        self.physics_engine = GridPhysicsEngine(
             self.player_sprite,
+            walls=self.wall_grid,
             platforms=self.scene[LAYER_NAME_MOVING_PLATFORMS],
             gravity_constant=GRAVITY,
-            ladders=self.scene[LAYER_NAME_LADDERS],
-            walls=self.scene[LAYER_NAME_PLATFORMS],
+            ladders=self.ladder_grid,
+            platform_system=self.platform_system,
             )
 
+        # "Restart level" and game over go back to these instead of loading the level again
+        self.start_snapshot = self.snapshot()
+        self.checkpoint_snapshot = None
+
+        # The last REWIND_SECONDS of the level, a frame per tick
+        self.rewind = RewindBuffer(REWIND_SECONDS * SIMULATION_RATE, rewind_budget)
+        self.rewind.push(self.start_snapshot.pack(self))
+        self.rewinding = False
+
+    @classmethod
+    def load(cls, level, heals=START_HEALS, play_sound=None, profiler=None, streamed=False,
+             stream_width=None):
+        """Load a level without a window and start a session on it."""
+        if streamed:
+            tile_map, scene, stream, _layer_names = load_stream(level, stream_width)
+            return cls(level, heals, tile_map, scene, play_sound, profiler, stream=stream)
+        steps = load_scene(level)
+        while True:
+            try:
+                next(steps)
+            except StopIteration as stop:
+                tile_map, scene = stop.value
+                return cls(level, heals, tile_map, scene, play_sound, profiler)
+
+    def snapshot(self):
+        return LevelSnapshot(self)
+
+    def restore(self, snapshot):
+        """Put the level back the way it was when ``snapshot`` was taken."""
+        self.score = snapshot.score
+        self.heals = snapshot.heals
+        self.state = snapshot.state
+        self.respawn_point = snapshot.respawn_point
+        self.checkpoint = snapshot.checkpoint
+
+        player = self.player_sprite
+        (player.position, player.change_x, player.change_y,
+         player.character_face_direction, player.cur_texture, player.texture,
+         player.jumping, player.climbing, player.is_on_ladder) = snapshot.player
+        self.physics_engine.jumps_since_ground = snapshot.jumps_since_ground
+
+        for sprite, position, change_x, change_y in snapshot.platforms:
+            sprite.position = position
+            sprite.change_x = change_x
+            sprite.change_y = change_y
+        self.platform_system.sync()
+
+        # Подобранное возвращаем на место, не подобранное тогда - убираем
+        triggers = self.triggers
+        states = snapshot.triggers
+        for handle, kind in enumerate(triggers.kinds):
+            # Триггеры, найденные после снимка (куски потокового уровня), тогда были на месте
+            state = states[handle] if handle < len(states) else 1
+            if kind not in self.pickup_lists or triggers.active[handle] == state:
+                continue
+            sprite = triggers.sprites[handle]
+            if state:
+                triggers.restore(handle)
+                # Кусок потокового уровня может быть не построен, тогда тайл
+                # вернётся вместе с ним
+                sprite_list = self.pickup_list(handle)
+                if sprite_list is not None:
+                    sprite_list.append(sprite)
+                    self.tile_animator.refresh(sprite)
+                    self.sprite_restored(sprite_list, sprite)
+            else:
+                if sprite is not None:
+                    sprite.remove_from_sprite_lists()
+                triggers.remove(handle)
+
+        self.physics_engine.contacts.invalidate()
+
+        if self.stream is not None:
+            # Игрок мог оказаться далеко: куски вокруг него нужны уже сейчас
+            self.view = None
+            self.update_stream()
+
+    def pickup_list(self, handle):
+        """The SpriteList a picked up pet or heart goes back to, None if its chunk is not built."""
+        if self.stream is not None:
+            return self.triggers.sprite_list(handle)
+        return self.pickup_lists[self.triggers.kinds[handle]]
+
+    def view_range(self):
+        """Left and right of what is seen: GameView's camera, or a screen around the player."""
+        if self.view is not None:
+            return self.view
+        left = self.player_sprite.center_x - SCREEN_WIDTH / 2
+        return left, left + SCREEN_WIDTH
+
+    def update_stream(self):
+        """Build the chunks of a streamed level around the view, drop the ones far behind."""
+        self.stream.update(*self.view_range())
+
+    def chunk_loaded(self, chunk):
+        """Animate the animated tiles of a chunk that was just built, from the current frame."""
+        animated = []
+        for name, sprite_list in chunk.sprite_lists.items():
+            if (sprite_list.properties or {}).get(LAYER_PROPERTY_ANIMATE, True):
+                animated.extend(sprite for sprite in sprite_list if getattr(sprite, "frames", None))
+        for sprite in animated:
+            self.tile_animator.add(sprite)
+            self.tile_animator.refresh(sprite)
+        self.animated_tiles[chunk.index] = animated
+
+    def chunk_unloaded(self, chunk):
+        for sprite in self.animated_tiles.pop(chunk.index):
+            self.tile_animator.remove(sprite)
+
+    def restart(self, from_checkpoint=False):
+        """Start the level over, or from the last checkpoint if there was one."""
+        if from_checkpoint and self.checkpoint_snapshot is not None:
+            self.restore(self.checkpoint_snapshot)
+            # Игрок появляется в точке чекпоинта, а не там, где он её задел
+            self.player_sprite.change_x = 0
+            self.player_sprite.change_y = 0
+            self.player_sprite.position = self.respawn_point
+            self.physics_engine.contacts.invalidate()
+        else:
+            self.restore(self.start_snapshot)
+            self.checkpoint_snapshot = None
 
+    def release_keys(self):
+        """Forget the keys held down, their releases went to another view."""
+        self.left_pressed = False
+        self.right_pressed = False
+        self.up_pressed = False
+        self.down_pressed = False
+        self.jump_needs_reset = False
+        self.rewinding = False
+        self.process_keychange()
 
-
-        self.heals_count_list = arcade.SpriteList()
-        '''
-        hhh = arcade.Sprite("./data/img/heals.png",1)
-        hhh.center_x = 750 * 2
-        hhh.center_y = 550 * 2          
-        self.heals_count_list.append(hhh)        
-        '''
-            
-
-    def on_draw(self):
-        """Render the screen."""
-
-        # Clear the screen to the background color
-        self.clear()
-
-        # Activate the game camera
-        self.camera_sprites.use()
-
-        # Draw our Scene
-        # Note, if you a want pixelated look, add pixelated=True to the parameters
-        self.scene.draw()
-
-        # Activate the GUI camera before drawing GUI elements
-        self.camera_gui.use()
-
-        # Draw our score on the screen, scrolling it with the viewport
-        max_score_now = self.max_score[self.level - 1]
-        pets_name_now = self.pets_name[self.level - 1]
-        
-        score_text = f"{pets_name_now}: {self.score} из {max_score_now}"
-        #heals_text = f"Жизней = {self.heals}"
-
-        arcade.draw_text(score_text,
-                         start_x=10,
-                         start_y=10,
-                         color=arcade.csscolor.WHITE,
-                         font_size=18)
-        '''                 
-        arcade.draw_text(heals_text,
-                         start_x=10,
-                         start_y=550,
-                         color=arcade.csscolor.WHITE,
-                         font_size=18)
-        '''              
-                       
-        self.heals_count_list.draw()
-
+    def tile_grid(self, layer_name, merge=False):
+        """Occupancy grid of a static layer of the scene."""
+        return TileGrid([self.scene[layer_name]], self.tile_map.width, self.tile_map.height,
+                        GRID_PIXEL_SIZE, merge)
 
     def update_player_speed(self):
 
@@ -464,23 +729,25 @@ class GameView(arcade.View):
         """
         Called when we change a key up/down or we move on/off a ladder.
         """
+        contacts = self.physics_engine.contacts
+
         # Process up/down
         if (self.up_pressed and not self.down_pressed):
-            if self.physics_engine.is_on_ladder():
+            if contacts.is_on_ladder():
                 self.player_sprite.change_y = PLAYER_MOVEMENT_SPEED
             elif (
-                self.physics_engine.can_jump(y_distance=10)
+                contacts.can_jump(y_distance=10)
                 and not self.jump_needs_reset
             ):
                 self.player_sprite.change_y = PLAYER_JUMP_SPEED
                 self.jump_needs_reset = True
-                arcade.play_sound(self.jump_sound)
+                self.play_sound("jump")
         elif self.down_pressed and not self.up_pressed:
-            if self.physics_engine.is_on_ladder():
+            if contacts.is_on_ladder():
                 self.player_sprite.change_y = -PLAYER_MOVEMENT_SPEED
 
         # Process up/down when on a ladder and no movement
-        if self.physics_engine.is_on_ladder():
+        if contacts.is_on_ladder():
             if not self.up_pressed and not self.down_pressed:
                 self.player_sprite.change_y = 0
             elif self.up_pressed and self.down_pressed:
@@ -496,7 +763,7 @@ class GameView(arcade.View):
 
 
     
-    def on_key_press(self, key, modifiers):
+    def key_press(self, key):
         """Called whenever a key is pressed."""
 
         if key == arcade.key.UP or key == arcade.key.W:
@@ -507,12 +774,16 @@ class GameView(arcade.View):
             self.left_pressed = True
         elif key == arcade.key.RIGHT or key == arcade.key.D:
             self.right_pressed = True
+        elif key == RESTART_KEY:
+            self.restart()
+        elif key == REWIND_KEY:
+            self.rewinding = True
         
         self.process_keychange()
 
 
         
-    def on_key_release(self, key, modifiers):
+    def key_release(self, key):
         """Called when the user releases a key."""
 
         if key == arcade.key.UP or key == arcade.key.W:
@@ -524,152 +795,461 @@ class GameView(arcade.View):
             self.left_pressed = False
         elif key == arcade.key.RIGHT or key == arcade.key.D:
             self.right_pressed = False
+        elif key == REWIND_KEY:
+            self.rewinding = False
 
         self.process_keychange()
 
-    def center_camera_to_player(self):
-        # Find where player is, then calculate lower left corner from that
-        screen_center_x = self.player_sprite.center_x - (self.camera_sprites.viewport_width / 2)
-        screen_center_y = self.player_sprite.center_y - (self.camera_sprites.viewport_height / 2)
+    def joybutton_press(self, button):
+        """ Handle button-down event for the joystick """
+        if button == 0:
+            self.up_pressed = True
+        elif button == 2:
+            self.down_pressed = True
+        else:
+            self.up_pressed = False
+            self.down_pressed = False
+        self.process_keychange()    
+        #print("Button {} down (press)".format(button))
 
-        # Set some limits on how far we scroll
-        if screen_center_x < 0:
-            screen_center_x = 0
-        if screen_center_y < 0:
-            screen_center_y = 0
-        if screen_center_x > self.end_of_map - 800:
-            screen_center_x = self.end_of_map - 800
+    def joybutton_release(self, button):
+        """ Handle button-up event for the joystick """
+        if button == 0:
+            self.up_pressed = False
+            self.jump_needs_reset = False
+        elif button == 2:
+            self.down_pressed = False
+        else:
+            pass
+        #print("Button {} up(release)".format(button))
+        self.process_keychange()
+    
+    def joyaxis_motion(self, axis, value):
+        #print("Axis {}, value {}".format(axis, value))
         
-        # Here's our center, move to it
-        player_centered = screen_center_x, screen_center_y
-        self.camera_sprites.move_to(player_centered)
+        if axis == 'x':
+            if value >= DEAD_ZONE:
+                self.right_pressed = True
+            elif value <= -DEAD_ZONE:
+                self.left_pressed = True
+            else:
+                self.right_pressed = False
+                self.left_pressed = False
+        if axis == 'y':
+            if value >= DEAD_ZONE:
+                self.down_pressed = True
+            elif value <= -DEAD_ZONE:
+                self.up_pressed = True
+            else:
+                self.up_pressed = False
+                self.down_pressed = False
+                self.jump_needs_reset = False
+        else:
+            '''
+            self.right_pressed = False
+            self.left_pressed = False
+            self.up_pressed = False
+            self.down_pressed = False
+            self.jump_needs_reset = False
+            '''
+        self.process_keychange()
 
-    def on_update(self, delta_time):
-        """Movement and game logic"""
+    def pick_up_pet(self, handle):
+        self.triggers.sprites[handle].remove_from_sprite_lists()
+        self.triggers.remove(handle)
+        # Add one to the score
+        self.score += 1
+        self.play_sound("pet")
+
+    def reach_exit(self, handle):
+        if self.score == self.max_score:
+            # Уровень пройден, диалог покажет GameView
+            self.play_sound("level_end")
+            self.state = STATE_FINISHED
+
+    def pick_up_heal(self, handle):
+        self.triggers.sprites[handle].remove_from_sprite_lists()
+        self.triggers.remove(handle)
+        self.heals += 1
+        self.play_sound("heals")
+
+    def reach_checkpoint(self, handle):
+        if handle == self.checkpoint:
+            return
+        box = self.triggers.sprites[handle]
+        self.checkpoint = handle
+        self.respawn_point = ((box.left + box.right) / 2, (box.bottom + box.top) / 2)
+        self.checkpoint_snapshot = self.snapshot()
+
+    def take_damage(self):
+        if self.heals >= 1:
+            self.play_sound("game_over")
+            self.heals -= 1
+            self.player_sprite.change_x = 0
+            self.player_sprite.change_y = 0
+            self.player_sprite.position = self.respawn_point
+            self.physics_engine.contacts.invalidate()
+        else:
+            self.state = STATE_GAME_OVER
+
+    def update(self, delta_time):
+        """Movement and game logic, one simulation tick"""
+
+        profiler = self.profiler
+
+        # Назад во времени: вместо шага симуляции - предыдущий кадр
+        if self.rewinding:
+            with profiler.phase("rewind"):
+                frame = self.rewind.step_back()
+                if frame is not None:
+                    self.restore(LevelSnapshot.unpack(self, frame))
+            self.ticks += 1
+            return
+
+        # Куски вокруг камеры строятся до физики: она видит только построенное
+        if self.stream is not None:
+            with profiler.phase("streaming"):
+                self.update_stream()
+
+        if PLATFORM_SLEEP_DISTANCE is not None:
+            self.platform_system.wake_near(self.player_sprite.center_x, PLATFORM_SLEEP_DISTANCE)
 
         # Move the player with the physics engine
-        self.physics_engine.update()
+        with profiler.phase("physics"):
+            self.physics_engine.update()
 
         # Update animations
-        if self.physics_engine.can_jump():
-            self.player_sprite.can_jump = False
-        else:
-            self.player_sprite.can_jump = True
+        # Ladder and ground are asked once, then every read comes from contacts
+        contacts = self.physics_engine.contacts
+        with profiler.phase("ladder_and_jump"):
+            if contacts.can_jump():
+                self.player_sprite.can_jump = False
+            else:
+                self.player_sprite.can_jump = True
 
-        if self.physics_engine.is_on_ladder() and not self.physics_engine.can_jump():
-            self.player_sprite.is_on_ladder = True
-            self.process_keychange()
-        else:
-            self.player_sprite.is_on_ladder = False
-            self.process_keychange()
+            if contacts.is_on_ladder() and not contacts.can_jump():
+                self.player_sprite.is_on_ladder = True
+                self.process_keychange()
+            else:
+                self.player_sprite.is_on_ladder = False
+                self.process_keychange()
 
         # Update Animations
-        self.scene.update_animation(
-            delta_time, [LAYER_NAME_COINS, LAYER_NAME_BACKGROUND, LAYER_NAME_PLAYER]
-        )
+        with profiler.phase("animation"):
+            self.player_sprite.update_animation(delta_time)
+            left, right = self.view_range()
+            self.tile_animator.update(delta_time, left, right)
 
 
-        self.scene.update([LAYER_NAME_MOVING_PLATFORMS])
+        with profiler.phase("moving_platforms"):
+            self.platform_system.update()
+        contacts.platforms_moved()
 
-        # See if we hit any coins
-        coin_hit_list = arcade.check_for_collision_with_list(
-            self.player_sprite, self.scene["pets"]
-        )
-        
-        exit_hit_list = arcade.check_for_collision_with_list(
-            self.player_sprite, self.scene["exit"]
-        )
-        
-        heals_hit_list = arcade.check_for_collision_with_list(
-            self.player_sprite, self.scene["heals"]
-        )
-        
-        
-        '''
-        if self.score == 1:
-            self.scene["end_ladder"].visible = True
-            view = GameOverView()
-            self.window.show_view(view)
-        '''
-        # Loop through each coin we hit (if any) and remove it
-        for coin in coin_hit_list:
-            # Remove the coin
-            coin.remove_from_sprite_lists()
-            # Add one to the score
-            self.score += 1
-            arcade.play_sound(self.pet_sound)
+        # Everything the player touches this tick, in one lookup
+        with profiler.phase("triggers"):
+            touched = self.triggers.query(self.player_sprite)
+
+        for kind, handler in self.trigger_handlers:
+            for handle in touched.get(kind, ()):
+                handler(handle)
 
-        
-        max_score_now = self.max_score[self.level - 1]
-        for i in exit_hit_list:
-            if self.score == max_score_now:
-              
-                # Advance to the next level
-                #self.level += 1
-                # Make sure to keep the score from this level when setting up the next level
-                #self.reset_score = True
-
-                # Load the next level
-                
-                arcade.play_sound(self.level_end_sound)
-                current_level = self.level
-                current_heals = self.heals
-                finish_level_view = View_dialog_level_finish(current_level,current_heals)
-                #game_view.setup()
-                self.window.show_view(finish_level_view)
-                
-        for i in heals_hit_list:
-            # Remove the coin
-            i.remove_from_sprite_lists()
-            # Add one to the score
-            self.heals += 1
-            arcade.play_sound(self.heals_sound)
-            self.heals_count_list.update()
-            self.heals_count_list.draw()
-            
-        self.heals_count_list = arcade.SpriteList()
-        for a in range(self.heals):
-            hhh = arcade.Sprite("./data/img/heals.png",2)
-            hhh.center_x = 770 - (24 * a)
-            hhh.center_y = 570          
-            self.heals_count_list.append(hhh)     
-            
-        
         # Did the player fall off the map?
         if self.player_sprite.center_y < -100:
-            self.player_sprite.center_x = PLAYER_START_X
-            self.player_sprite.center_y = PLAYER_START_Y
+            self.player_sprite.position = self.respawn_point
+            contacts.invalidate()
 
-            arcade.play_sound(self.game_over_sound)
+            self.play_sound("game_over")
+
+            # Опасности проверяются уже на месте возрождения; отдельная фаза,
+            # чтобы у "triggers" был ровно один замер на тик
+            with profiler.phase("respawn_triggers"):
+                touched = self.triggers.query(self.player_sprite, TRIGGER_DAMAGE)
 
         # Did the player touch something they should not?
+        if TRIGGER_DAMAGE in touched:
+            self.take_damage()
+
+        with profiler.phase("rewind"):
+            self.rewind.push(self.snapshot().pack(self))
+
+        self.ticks += 1
 
-        if arcade.check_for_collision_with_list(
-            self.player_sprite, self.scene[LAYER_NAME_DONT_TOUCH]
-        ):
-            if self.heals >= 1:
-                arcade.play_sound(self.game_over_sound)
-                self.heals -= 1
-                self.heals_count_list.update()
-                self.heals_count_list.draw()
-                self.player_sprite.change_x = 0
-                self.player_sprite.change_y = 0
-                self.player_sprite.center_x = PLAYER_START_X
-                self.player_sprite.center_y = PLAYER_START_Y
-            else:
-                #game_over_view = GameOverView()
-                self.window.show_view(GameOverView())                
 
+class GameView(arcade.View):
+    """
+    Main application class.
+    """
+
+    def __init__(self, level, heals, tick_rate=SIMULATION_RATE, replay=None, sound=True):
+
+        # Call the parent class and set up the window
+        #super().__init__(SCREEN_WIDTH, SCREEN_HEIGHT,SCREEN_TITLE, resizable=True)
+        #super().__init__(SCREEN_WIDTH, SCREEN_HEIGHT, SCREEN_TITLE, fullscreen=True)        
+        super().__init__()
+    
+        #arcade.set_viewport(0, self.window.width, 0, self.window.height)
+
+        self.window.set_mouse_visible(False)
+
+        # The game logic of the level, created in setup()
+        self.session = None
+
+        # Draws the scene, static layers are baked once in setup()
+        self.scene_renderer = None
+
+        # Game logic runs in fixed ticks, drawing interpolates between them
+        self.tick_rate = tick_rate
+        self.timestep = FixedTimestep(tick_rate)
+        self.interpolation = Interpolation()
+
+        # Where input goes: the session itself, or an InputRecorder in front
+        # of it. None while an InputReplay plays the level
+        self.controls = None
+        self.recorder = None
+        self.replay = replay
+
+        # Timing of the frame phases, shown with F3
+        self.profiler = FrameProfiler(enabled=profile_dir is not None)
+        self.profiler_overlay = ProfilerOverlay(self.profiler)
+
+        # A Camera that can be used for scrolling the screen
+        self.camera_sprites = None
+
+        # A non-scrolling camera that can be used to draw GUI elements
+        self.camera_gui = None
+
+        # Level
+        self.level = level
+        self.heals = heals
+
+        # Score and lives display
+        self.hud = None
+
+        # Load sounds (not needed for benchmarks on machines without audio)
+        self.sounds = {}
+        if sound:
+            self.sounds = {
+                "pet": asset_manager.sound(PETS_SOUND_FILE[self.level - 1]),
+                "jump": asset_manager.sound("./data/sounds/jump.mp3"),
+                "game_over": asset_manager.sound("./data/sounds/gameover.mp3"),
+                "heals": asset_manager.sound("./data/sounds/heals.mp3"),
+                "level_end": asset_manager.sound("./data/sounds/level_end.mp3"),
+            }
+
+
+
+        #---------------------------джойстик (от сюда)------------------------
+        # Get list of game controllers that are available
+        # (arcade has none in headless mode, ARCADE_HEADLESS=1)
+        joysticks = arcade.get_joysticks() if hasattr(arcade, "get_joysticks") else []
+        # If we have any...
+        if joysticks:
+            # Grab the first one in  the list
+            self.joystick = joysticks[0]
+            # Open it for input
+            self.joystick.open()
+            # Push this object as a handler for joystick events.
+            # Required for the on_joy* events to be called.
+            self.joystick.push_handlers(self)
+        else:
+            # Handle if there are no joysticks.
+            ##print("Не вижу джойстик, подключи джойстик и попробуй снова")
+            self.joystick = None
+
+    # noinspection PyMethodMayBeStatic
+    def on_joybutton_press(self, _joystick, button):
+        """ Handle button-down event for the joystick """
+        if self.controls is not None:
+            self.controls.joybutton_press(button)
+
+    # noinspection PyMethodMayBeStatic
+    def on_joybutton_release(self, _joystick, button):
+        """ Handle button-up event for the joystick """
+        if self.controls is not None:
+            self.controls.joybutton_release(button)
+    
+    def on_joyaxis_motion(self, _joystick, axis, value):
+        if self.controls is not None:
+            self.controls.joyaxis_motion(axis, value)
+
+    # noinspection PyMethodMayBeStatic
+    def on_joyhat_motion(self, _joystick, hat_x, hat_y):
+        """ Handle hat events """
+        #print("Hat ({}, {})".format(hat_x, hat_y))
+    #---------------------------джойстик (до сюда)------------------------
+
+
+
+    def setup(self, prepared=None):
+        """
+        Set up the game here. Call this function to restart the game.
+        ``prepared`` is a level from level_prefetcher, if it has one.
+        """
+
+        # Setup the Cameras
+        self.camera_sprites = arcade.Camera(self.window.width, self.window.height)#когда приложение было на основе окна а не представления, было без window
+        self.camera_gui = arcade.Camera(self.window.width, self.window.height)
+
+        # Read in the tiled map (from the compiled .lvl bundle if it is up to date)
+        # and build the scene, unless the prefetcher already did it.
+        # A streamed level builds its tiles chunk by chunk as the camera moves
+        stream = None
+        if stream_levels:
+            tile_map, scene, stream, layer_names = load_stream(self.level, stream_width)
+            self.scene_renderer = StreamRenderer(stream, scene, layer_names)
+        else:
+            if prepared is None:
+                prepared = load_level(self.level)
+            tile_map, scene, self.scene_renderer = prepared
+
+        self.session = GameSession(self.level, self.heals, tile_map, scene,
+                                   play_sound=self.play_sound, profiler=self.profiler,
+                                   sprite_restored=self.sprite_restored, stream=stream)
+
+        if self.replay is None:
+            self.controls = self.session
+            if record_dir:
+                self.recorder = self.controls = InputRecorder(self.session, self.tick_rate)
+
+        # Set the background color
+        if tile_map.background_color:
+            arcade.set_background_color(tile_map.background_color)
+
+        # Эти спрайты двигаются, их рисуем между предыдущим и текущим тиком
+        self.interpolation = Interpolation(
+            [self.session.player_sprite, *scene[LAYER_NAME_MOVING_PLATFORMS]]
+        )
+
+        self.hud = Hud(PETS_NAME[self.level - 1], self.session.max_score)
+        self.hud.update(self.session.score, self.session.heals)
             
 
-   
-        
-        # Position the camera
-        self.center_camera_to_player()
+    def play_sound(self, name):
+        if name in self.sounds:
+            arcade.play_sound(self.sounds[name])
+
+    def sprite_restored(self, sprite_list, sprite):
+        """A pet or a heart is back after a restart, its column chunk must draw it again."""
+        chunks = self.scene_renderer.chunked_layer(sprite_list)
+        if chunks is not None:
+            chunks.add(sprite)
+
+    def continue_level(self):
+        """Back into the level after a game over, from the last checkpoint."""
+        self.session.release_keys()
+        self.session.restart(from_checkpoint=True)
+        # Запись ввода уже сохранена в on_hide_view, дальше ввод идёт прямо в сессию
+        if self.replay is None:
+            self.controls = self.session
+
+    def on_draw(self):
+        """Render the screen."""
+
+        # Clear the screen to the background color
+        self.clear()
+
+        profiler = self.profiler
+
+        # Moving sprites are drawn where they are between the last two ticks
+        with self.interpolation.blend(self.timestep.alpha):
+            # Position the camera
+            with profiler.phase("camera"):
+                self.center_camera_to_player()
+
+                # Activate the game camera
+                self.camera_sprites.use()
+
+            # Draw our Scene
+            with profiler.phase("draw_scene"):
+                self.scene_renderer.draw(self.camera_sprites, self.session.tile_animator.time)
 
+        # Activate the GUI camera before drawing GUI elements
+        self.camera_gui.use()
+
+        # Draw our score and lives on the screen
+        with profiler.phase("draw_hud"):
+            self.hud.draw()
+
+        self.profiler_overlay.update()
+        self.profiler_overlay.draw()
 
 
+    def on_key_press(self, key, modifiers):
+        """Called whenever a key is pressed."""
+        if key == PROFILER_KEY:
+            self.profiler_overlay.toggle()
+        elif self.controls is not None:
+            self.controls.key_press(key)
+
+    def on_key_release(self, key, modifiers):
+        """Called when the user releases a key."""
+        if self.controls is not None:
+            self.controls.key_release(key)
 
+    def center_camera_to_player(self):
+        # Find where player is, then calculate lower left corner from that
+        player_sprite = self.session.player_sprite
+        screen_center_x = player_sprite.center_x - (self.camera_sprites.viewport_width / 2)
+        screen_center_y = player_sprite.center_y - (self.camera_sprites.viewport_height / 2)
+
+        # Set some limits on how far we scroll
+        if screen_center_x < 0:
+            screen_center_x = 0
+        if screen_center_y < 0:
+            screen_center_y = 0
+        if screen_center_x > self.session.end_of_map - 800:
+            screen_center_x = self.session.end_of_map - 800
+        # На целых пикселях сетка тайлов на GPU рисует то же, что и спрайты, до пикселя
+        if tile_grid_renderer:
+            screen_center_x = round(screen_center_x)
+            screen_center_y = round(screen_center_y)
+        
+        # Here's our center, move to it
+        player_centered = screen_center_x, screen_center_y
+        self.camera_sprites.move_to(player_centered)
+        camera = self.camera_sprites
+        self.session.view = screen_center_x, screen_center_x + camera.viewport_width * camera.scale
+
+    def on_update(self, delta_time):
+        """Run as many fixed ticks as the elapsed time calls for"""
+        for _tick in range(self.timestep.advance(delta_time)):
+            self.interpolation.save()
+            if self.replay is not None:
+                self.replay(self.session)
+            with self.profiler.phase("tick"):
+                self.session.update(self.timestep.step)
+            # Уровень закончился или игра окончена - дальше тики не нужны
+            if self.session.state != STATE_PLAYING:
+                break
+
+        if self.session.state == STATE_FINISHED:
+            # Load the next level
+            finish_level_view = View_dialog_level_finish(self.level, self.session.heals)
+            self.window.show_view(finish_level_view)
+        elif self.session.state == STATE_GAME_OVER:
+            self.window.show_view(GameOverView(self))
+
+        # HUD перестраивается только если изменились очки или жизни
+        with self.profiler.phase("hud"):
+            self.hud.update(self.session.score, self.session.heals)
+
+
+
+
+
+    def on_hide_view(self):
+        """ Save the recorded input and the frame timings when the level is left """
+        name = f"level_{self.level}_{time.strftime('%Y%m%d_%H%M%S')}"
+        if self.recorder is not None:
+            os.makedirs(record_dir, exist_ok=True)
+            self.recorder.save(os.path.join(record_dir, name + REPLAY_SUFFIX))
+            self.recorder = None
+        if profile_dir is not None and self.profiler.phases:
+            os.makedirs(profile_dir, exist_ok=True)
+            for suffix in (".csv", ".json"):
+                self.profiler.export(os.path.join(profile_dir, name + suffix),
+                                     level=self.level, ticks=self.session.ticks)
+            self.profiler.reset()
 
     def on_resize(self, width, height):
         """ Resize window """
@@ -696,6 +1276,10 @@ class StartView(arcade.View):
         self.y2 = 200
         self.w2 = 235
         self.h2 = 77
+
+        self.texture = asset_manager.texture("./data/img/views/start.jpg")
+        self.texture2 = asset_manager.texture("./data/img/views/startmenu1.png")
+        self.texture3 = asset_manager.texture("./data/img/views/startmenu2.png")
     '''
 #---------------------------джойстик (от сюда)------------------------
         # Get list of game controllers that are available
@@ -733,12 +1317,9 @@ class StartView(arcade.View):
     def on_draw(self):
         """ Draw this view """
         self.clear()
-        self.texture = arcade.load_texture("./data/img/views/start.jpg")
         #self.texture.draw_sized(SCREEN_WIDTH / 2, SCREEN_HEIGHT / 2, SCREEN_WIDTH, SCREEN_HEIGHT)
         self.texture.draw_sized(self.window.width / 2, self.window.height / 2, SCREEN_WIDTH, SCREEN_HEIGHT)
-        self.texture2 = arcade.load_texture("./data/img/views/startmenu1.png")
         self.texture2.draw_sized(self.x1, self.y1, self.w1, self.h1) #координаты по ширине и высоте, размеры ширина и высота
-        self.texture3 = arcade.load_texture("./data/img/views/startmenu2.png")
         self.texture3.draw_sized(self.x2, self.y2, self.w2, self.h2)
     '''    
     def on_key_press(self, key, modifiers):
@@ -801,6 +1382,11 @@ class View_map(arcade.View):#карта вход в уровень 1
         self.h1 = 58
         self.next_level = next_level
         self.heals = heals
+
+        self.texture = asset_manager.texture(f"./data/img/views/map_{self.next_level}.jpg")
+        self.texture2 = asset_manager.texture("./data/img/views/next.png")
+
+        prefetch_level(self.next_level)
     '''
                 #---------------------------джойстик (от сюда)------------------------
         # Get list of game controllers that are available
@@ -835,13 +1421,15 @@ class View_map(arcade.View):#карта вход в уровень 1
         # Reset the viewport, necessary if we have a scrolling game and we need
         # to reset the viewport back to the start so we can see what we draw.
         arcade.set_viewport(0, self.window.width, 0, self.window.height)
+    def on_update(self, delta_time):
+        """ Finish loading the next level a little every frame """
+        level_prefetcher.step()
+
     def on_draw(self):
         """ Draw this view """
         self.clear()
-        self.texture = arcade.load_texture(f"./data/img/views/map_{self.next_level}.jpg")
         #self.texture.draw_sized(SCREEN_WIDTH / 2, SCREEN_HEIGHT / 2, SCREEN_WIDTH, SCREEN_HEIGHT)
         self.texture.draw_sized(self.window.width / 2, self.window.height / 2, SCREEN_WIDTH, SCREEN_HEIGHT)
-        self.texture2 = arcade.load_texture("./data/img/views/next.png")
         self.texture2.draw_sized(self.x1, self.y1, self.w1, self.h1) #координаты по ширине и высоте, размеры ширина и высота
 
 
@@ -874,6 +1462,11 @@ class View_dialog_level_start(arcade.View):
         self.y1 = 50
         self.w1 = 247
         self.h1 = 58
+
+        self.texture = asset_manager.texture(f"./data/img/views/level_{self.level}_start.jpg")
+        self.texture2 = asset_manager.texture("./data/img/views/next.png")
+
+        prefetch_level(self.level)
     '''
                 #---------------------------джойстик (от сюда)------------------------
         # Get list of game controllers that are available
@@ -900,7 +1493,7 @@ class View_dialog_level_start(arcade.View):
                 self.window.show_view(game_finish_view)                
             else:
                 game_view = GameView(self.level, self.heals)
-                game_view.setup()
+                game_view.setup(level_prefetcher.take(self.level))
                 self.window.show_view(game_view)
         #print("Button {} down (press)".format(button))
                 #---------------------------джойстик (до сюда)------------------------ 
@@ -912,13 +1505,15 @@ class View_dialog_level_start(arcade.View):
         # Reset the viewport, necessary if we have a scrolling game and we need
         # to reset the viewport back to the start so we can see what we draw.
         arcade.set_viewport(0, self.window.width, 0, self.window.height)
+    def on_update(self, delta_time):
+        """ Finish loading the next level a little every frame """
+        level_prefetcher.step()
+
     def on_draw(self):
         """ Draw this view """
         self.clear()
-        self.texture = arcade.load_texture(f"./data/img/views/level_{self.level}_start.jpg")
         #self.texture.draw_sized(SCREEN_WIDTH / 2, SCREEN_HEIGHT / 2, SCREEN_WIDTH, SCREEN_HEIGHT)
         self.texture.draw_sized(self.window.width / 2, self.window.height / 2, SCREEN_WIDTH, SCREEN_HEIGHT)
-        self.texture2 = arcade.load_texture("./data/img/views/next.png")
         self.texture2.draw_sized(self.x1, self.y1, self.w1, self.h1) #координаты по ширине и высоте, размеры ширина и высота
 
 
@@ -939,7 +1534,7 @@ class View_dialog_level_start(arcade.View):
                 self.window.show_view(game_finish_view)                
             else:
                 game_view = GameView(self.level, self.heals)
-                game_view.setup()
+                game_view.setup(level_prefetcher.take(self.level))
                 self.window.show_view(game_view)
 
 class View_dialog_level_finish(arcade.View):
@@ -956,6 +1551,12 @@ class View_dialog_level_finish(arcade.View):
         self.h1 = 58
         self.current_level = current_level
         self.current_heals = current_heals
+
+        self.texture = asset_manager.texture(f"./data/img/views/level_{self.current_level}_finish.jpg")
+        self.texture2 = asset_manager.texture("./data/img/views/next.png")
+
+        # Пока игрок читает диалог, следующий уровень уже грузится
+        prefetch_level(self.current_level + 1)
     '''
                 #---------------------------джойстик (от сюда)------------------------
         # Get list of game controllers that are available
@@ -991,14 +1592,16 @@ class View_dialog_level_finish(arcade.View):
         # Reset the viewport, necessary if we have a scrolling game and we need
         # to reset the viewport back to the start so we can see what we draw.
         arcade.set_viewport(0, self.window.width, 0, self.window.height)
+    def on_update(self, delta_time):
+        """ Finish loading the next level a little every frame """
+        level_prefetcher.step()
+
     def on_draw(self):
         """ Draw this view """
         self.clear()
         
-        self.texture = arcade.load_texture(f"./data/img/views/level_{self.current_level}_finish.jpg")
         #self.texture.draw_sized(SCREEN_WIDTH / 2, SCREEN_HEIGHT / 2, SCREEN_WIDTH, SCREEN_HEIGHT)
         self.texture.draw_sized(self.window.width / 2, self.window.height / 2, SCREEN_WIDTH, SCREEN_HEIGHT)
-        self.texture2 = arcade.load_texture("./data/img/views/next.png")
         self.texture2.draw_sized(self.x1, self.y1, self.w1, self.h1) #координаты по ширине и высоте, размеры ширина и высота
 
 
@@ -1024,10 +1627,13 @@ class View_dialog_level_finish(arcade.View):
 class GameOverView(arcade.View):
     """ View to show when game is over """
 
-    def __init__(self):
+    def __init__(self, game_view=None):
         """ This is run once when we switch to this view """
         super().__init__()
-        self.texture = arcade.load_texture("./data/img/views/gameover.jpg")
+        self.texture = asset_manager.texture("./data/img/views/gameover.jpg")
+
+        # Уровень, в который можно вернуться клавишей RESTART_KEY или Enter
+        self.game_view = game_view
         
 
         # Reset the viewport, necessary if we have a scrolling game and we need
@@ -1065,6 +1671,12 @@ class GameOverView(arcade.View):
         self.clear()
         self.texture.draw_sized(self.window.width / 2, self.window.height / 2, SCREEN_WIDTH, SCREEN_HEIGHT)
 
+    def on_key_press(self, key, modifiers):
+        """ Continue the level from the last checkpoint, it is still loaded """
+        if self.game_view is not None and key in (RESTART_KEY, arcade.key.ENTER):
+            self.game_view.continue_level()
+            self.window.show_view(self.game_view)
+
     def on_mouse_press(self, _x, _y, _button, _modifiers):
         """ If the user presses the mouse button, re-start the game. """
         start_view = StartView()
@@ -1077,7 +1689,7 @@ class GameFinishView(arcade.View):
     def __init__(self):
         """ This is run once when we switch to this view """
         super().__init__()
-        self.texture = arcade.load_texture("./data/img/views/success.jpg")
+        self.texture = asset_manager.texture("./data/img/views/success.jpg")
         
 
         # Reset the viewport, necessary if we have a scrolling game and we need
@@ -1125,12 +1737,40 @@ class GameFinishView(arcade.View):
 
 def main():
     """ Main function """
+    global record_dir, profile_dir, rewind_budget, tile_grid_renderer, stream_levels, stream_width
+
+    parser = argparse.ArgumentParser(description=SCREEN_TITLE)
+    parser.add_argument("--record", metavar="DIR", help="записывать ввод игрока в эту папку")
+    parser.add_argument("--replay", metavar="FILE", help="показать записанный уровень")
+    parser.add_argument("--profile", metavar="DIR", help="сохранять замеры фаз кадра в эту папку")
+    parser.add_argument("--rewind-budget", metavar="KB", type=int,
+                        help="память под перемотку, по умолчанию %d КБ" % (REWIND_BUDGET // 1024))
+    parser.add_argument("--tile-grid", action="store_true",
+                        help="рисовать слои тайлов из сетки на GPU, без запекания")
+    parser.add_argument("--stream", action="store_true",
+                        help="строить уровень кусками по мере движения камеры")
+    parser.add_argument("--stream-width", metavar="COLUMNS", type=int,
+                        help="ширина потокового уровня в колонках, 0 - без конца")
+    args = parser.parse_args()
+    tile_grid_renderer = args.tile_grid
+    stream_levels = args.stream or args.stream_width is not None
+    stream_width = args.stream_width
+    record_dir = args.record
+    profile_dir = args.profile
+    if args.rewind_budget is not None:
+        rewind_budget = args.rewind_budget * 1024
 
     #window = arcade.Window(SCREEN_WIDTH, SCREEN_HEIGHT, SCREEN_TITLE, fullscreen=True)
     #window = arcade.Window(SCREEN_WIDTH, SCREEN_HEIGHT, SCREEN_TITLE, resizable=True)
     window = arcade.Window(SCREEN_WIDTH, SCREEN_HEIGHT, SCREEN_TITLE)
-    start_view = StartView()
-    window.show_view(start_view)
+    if args.replay:
+        replay = InputReplay(args.replay)
+        game_view = GameView(replay.level, replay.heals, replay.tick_rate, replay=replay)
+        game_view.setup()
+        window.show_view(game_view)
+    else:
+        start_view = StartView()
+        window.show_view(start_view)
     arcade.run()
 
 
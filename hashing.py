@@ -0,0 +1,54 @@
+"""
+Content hashes of files, kept between runs by the caches that use them
+(the preprocessing manifest, the hit box cache)
+"""
+import hashlib
+import os
+
+
+_HASH_BLOCK = 1 << 20
+
+
+class FileHashes:
+    """
+    Content hashes of files, remembered with their size and mtime.
+    ``entries`` is the saved part: path -> [size, mtime_ns, sha256].
+    """
+
+    def __init__(self, entries=None):
+        self.entries = {} if entries is None else entries
+
+    def digest(self, path):
+        """sha256 of the file, or None if there is none."""
+        path = str(path)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        entry = self.entries.get(path)
+        if entry is not None and entry[0] == stat.st_size and entry[1] == stat.st_mtime_ns:
+            return entry[2]
+        sha = hashlib.sha256()
+        with open(path, "rb") as file:
+            for block in iter(lambda: file.read(_HASH_BLOCK), b""):
+                sha.update(block)
+        digest = sha.hexdigest()
+        self.entries[path] = [stat.st_size, stat.st_mtime_ns, digest]
+        return digest
+
+    def prune(self):
+        """
+        Forget the files that are gone or changed since they were hashed.
+        Returns the digests still current.
+        """
+        current = set()
+        for path, (size, mtime_ns, digest) in list(self.entries.items()):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                stat = None
+            if stat is None or stat.st_size != size or stat.st_mtime_ns != mtime_ns:
+                del self.entries[path]
+            else:
+                current.add(digest)
+        return current
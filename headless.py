@@ -0,0 +1,181 @@
+"""
+Run levels without a window, sound or GPU.
+
+    python headless.py                  # every level, 3600 ticks each
+    python headless.py 3 5 --ticks 10000
+    python headless.py --trace before.txt   # before a refactor of the game logic
+    python headless.py --check before.txt   # after it: must play out the same
+
+The default bot holds "right" and jumps now and then, which is enough to
+walk through most of a level and to measure how fast the game logic runs.
+
+A trace runs that bot and a few seeded random ones on every level and
+keeps a hash of the player state after each tick. ``--check`` replays the
+same runs and lists the ones that went differently; with ``--stream`` the
+levels are streamed, to compare them with whole-level sessions.
+"""
+import argparse
+import glob
+import hashlib
+import random
+import re
+import sys
+import time
+
+import arcade
+
+from game import STATE_PLAYING, GameSession
+from profiler import FrameProfiler
+from timestep import SIMULATION_RATE
+
+
+def run_right(session, tick):
+    """Bot: hold right, jump every 40 ticks."""
+    if tick == 0:
+        session.key_press(arcade.key.RIGHT)
+    if tick % 40 == 0:
+        session.key_press(arcade.key.UP)
+    elif tick % 40 == 5:
+        session.key_release(arcade.key.UP)
+
+
+def random_bot(seed):
+    """Bot: hold right, then press or release a random arrow key every 7 ticks."""
+    rng = random.Random(seed)
+    keys = [arcade.key.LEFT, arcade.key.RIGHT, arcade.key.UP, arcade.key.DOWN]
+    plan = {}
+
+    def bot(session, tick):
+        if tick == 0:
+            session.key_press(arcade.key.RIGHT)
+        # План растёт по ходу игры, но от тиков зависит так же, как заранее составленный
+        while len(plan) * 7 <= tick:
+            plan[len(plan) * 7] = (rng.choice(keys), rng.random() < 0.6)
+        step = plan.get(tick)
+        if step is not None:
+            key, press = step
+            (session.key_press if press else session.key_release)(key)
+
+    return bot
+
+
+# Bots of a trace by name
+TRACE_BOTS = {"right": lambda: run_right, "random1": lambda: random_bot(1),
+              "random2": lambda: random_bot(2), "random3": lambda: random_bot(3)}
+
+
+def trace(level, bot_name, ticks, streamed=False):
+    """
+    Run a bot on a level and hash the player state after every tick.
+    Returns the trace line: level, bot, ticks run, score, lives, state and hash.
+    """
+    sounds = []
+    session = GameSession.load(level, 1, play_sound=sounds.append, streamed=streamed)
+    bot = TRACE_BOTS[bot_name]()
+    digest = hashlib.sha1()
+    step = 1 / SIMULATION_RATE
+    ran = ticks
+    for tick in range(ticks):
+        bot(session, tick)
+        session.update(step)
+        player = session.player_sprite
+        digest.update(repr((player.position, player.change_y, session.score, session.heals,
+                            session.state, len(sounds))).encode())
+        if session.state != STATE_PLAYING:
+            ran = tick + 1
+            break
+    return (f"{level} {bot_name} {ran} {session.score} {session.heals} {session.state} "
+            f"{digest.hexdigest()[:16]}")
+
+
+def write_trace(path, levels, ticks, streamed=False):
+    with open(path, "w", encoding="utf-8") as file:
+        file.write(f"ticks {ticks}\n")
+        for level in levels:
+            for bot_name in TRACE_BOTS:
+                line = trace(level, bot_name, ticks, streamed)
+                print(line)
+                file.write(line + "\n")
+    return 0
+
+
+def check_trace(path, streamed=False):
+    """Run the traces of a file again. Returns the number of runs that differ."""
+    with open(path, encoding="utf-8") as file:
+        ticks = int(file.readline().split()[1])
+        expected = [line.strip() for line in file if line.strip()]
+    differ = 0
+    for line in expected:
+        level, bot_name = line.split()[:2]
+        actual = trace(int(level), bot_name, ticks, streamed)
+        if actual != line:
+            differ += 1
+            print(f"DIFFERS  expected {line}\n         got      {actual}")
+    print(f"{len(expected) - differ} of {len(expected)} runs the same")
+    return differ
+
+
+def run(session, ticks, bot=run_right, tick_rate=SIMULATION_RATE):
+    """
+    Step a session until ``ticks`` ticks passed or the level ended.
+    ``bot(session, tick)`` is called before every tick. Returns the number of ticks run.
+    """
+    step = 1 / tick_rate
+    for tick in range(ticks):
+        if bot is not None:
+            bot(session, tick)
+        session.update(step)
+        if session.state != STATE_PLAYING:
+            return tick + 1
+    return ticks
+
+
+def _levels():
+    names = glob.glob("./data/level_[0-9]*.json")
+    return sorted(int(re.search(r"level_(\d+)", name).group(1)) for name in names)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run levels without a window")
+    parser.add_argument("levels", nargs="*", type=int, help="level numbers, all by default")
+    parser.add_argument("--ticks", type=int, default=3600, help="ticks per level")
+    parser.add_argument("--heals", type=int, default=2, help="lives at the start")
+    parser.add_argument("--profile", action="store_true", help="print the time of each phase of a tick")
+    parser.add_argument("--trace", metavar="FILE", help="write a trace of every level to FILE")
+    parser.add_argument("--check", metavar="FILE", help="run a trace FILE again and report differences")
+    parser.add_argument("--stream", action="store_true", help="trace or check streamed levels")
+    args = parser.parse_args()
+
+    if args.trace:
+        return write_trace(args.trace, args.levels or _levels(), args.ticks, args.stream)
+    if args.check:
+        return 1 if check_trace(args.check, args.stream) else 0
+
+    print(f"{'level':>5} {'load ms':>8} {'ticks':>6} {'ticks/s':>8} {'score':>5} {'heals':>5}  state     position")
+    for level in args.levels or _levels():
+        start = time.perf_counter()
+        profiler = FrameProfiler(enabled=args.profile)
+        session = GameSession.load(level, args.heals, profiler=profiler)
+        load_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        ticks = run(session, args.ticks)
+        run_time = time.perf_counter() - start
+
+        x, y = session.player_sprite.position
+        print(f"{level:5} {load_time * 1000:8.1f} {ticks:6} {ticks / run_time:8.0f} "
+              f"{session.score:5} {session.heals:5}  {session.state:9} ({x:.0f}, {y:.0f})")
+        if args.profile:
+            walls = session.wall_grid
+            print(f"      walls: {walls.tile_count} tiles -> {walls.body_count} collision bodies")
+            print(f"      collision queries per tick: {session.physics_engine.queries / ticks:.2f}")
+            rewind = session.rewind
+            print(f"      rewind: {rewind.frames} frames ({rewind.frames / SIMULATION_RATE:.1f} s) "
+                  f"in {rewind.bytes_used / 1024:.1f} kB, encode {rewind.encode_us:.1f} us per tick")
+            for line in profiler.table():
+                print("      " + line)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
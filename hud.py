@@ -0,0 +1,92 @@
+"""
+Heads-up display: score text and lives
+"""
+import time
+from collections import deque
+
+import arcade
+
+from assets import asset_manager
+
+
+HEART_IMAGE = "./data/img/heals.png"
+HEART_SCALING = 2
+HEART_X = 770
+HEART_Y = 570
+HEART_STEP = 24
+
+
+class Hud:
+    """
+    Score text and a row of hearts, one per life.
+
+    Nothing is allocated per frame: heart sprites come from a pool that only
+    grows, the text object is reused, and both are touched only when the
+    score or the number of lives actually changes.
+    """
+
+    def __init__(self, pets_name, max_score):
+        self.pets_name = pets_name
+        self.max_score = max_score
+
+        self.heart_texture = asset_manager.texture(HEART_IMAGE)
+        self.hearts = arcade.SpriteList()
+        self._heart_pool = []
+
+        self.score_text = arcade.Text("",
+                                      start_x=10,
+                                      start_y=10,
+                                      color=arcade.csscolor.WHITE,
+                                      font_size=18)
+
+        self._score = None
+        self._heals = None
+
+        # Сколько раз HUD перестраивался, и когда (для подсчёта в секунду)
+        self.rebuilds = 0
+        self._rebuild_times = deque()
+
+    def _heart(self, index):
+        while len(self._heart_pool) <= index:
+            heart = arcade.Sprite(texture=self.heart_texture, scale=HEART_SCALING)
+            heart.center_x = HEART_X - (HEART_STEP * len(self._heart_pool))
+            heart.center_y = HEART_Y
+            self._heart_pool.append(heart)
+        return self._heart_pool[index]
+
+    def update(self, score, heals):
+        """Rebuild the parts of the HUD whose values changed."""
+        if score == self._score and heals == self._heals:
+            return
+
+        if score != self._score:
+            self.score_text.text = f"{self.pets_name}: {score} из {self.max_score}"
+            self._score = score
+
+        if heals != self._heals:
+            while len(self.hearts) > heals:
+                self.hearts.pop()
+            while len(self.hearts) < heals:
+                self.hearts.append(self._heart(len(self.hearts)))
+            self._heals = heals
+
+        self.rebuilds += 1
+        now = time.perf_counter()
+        self._rebuild_times.append(now)
+        # Чистим и здесь: статистику могут вообще не читать
+        self._forget_before(now - 1)
+
+    def _forget_before(self, moment):
+        times = self._rebuild_times
+        while times and times[0] < moment:
+            times.popleft()
+
+    @property
+    def rebuilds_per_second(self):
+        """Number of rebuilds during the last second."""
+        self._forget_before(time.perf_counter() - 1)
+        return len(self._rebuild_times)
+
+    def draw(self):
+        self.score_text.draw()
+        self.hearts.draw()
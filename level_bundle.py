@@ -0,0 +1,849 @@
+"""
+Precompiled binary level bundles.
+
+A Tiled JSON level is compiled offline into a ``.lvl`` file next to it:
+a table of resolved tiles (image, rectangle, flipping, animation), one
+uint16/uint32 array of tile indices per tile layer and fixed-size records
+for object layers such as ``moving_platforms``. At run time the file is
+memory-mapped and the sprite lists are built straight from it, without
+JSON or tileset parsing.
+
+The tile images the level uses (animation frames included) are copied
+into a few atlas pages next to the bundle, and the tile table points into
+them, so a level decodes a few small images instead of whole tilesets.
+
+    python level_bundle.py compile data/level_*.json
+    python level_bundle.py compile --no-atlas data/level_1.json
+    python level_bundle.py bench
+
+preprocess.py compiles the whole level pack in parallel, skipping levels
+whose inputs did not change.
+"""
+import glob
+import math
+import mmap
+import os
+import struct
+import sys
+import time
+from array import array
+from collections import OrderedDict
+from pathlib import Path
+
+import arcade
+from arcade.arcade_types import TiledObject
+
+from assets import HIT_BOX_BOUNDS, asset_manager, bounds_hit_box
+from atlas import build_atlas
+
+
+BUNDLE_MAGIC = b"LVLB"
+BUNDLE_VERSION = 2
+BUNDLE_SUFFIX = ".lvl"
+
+_FLIPPED_HORIZONTALLY_FLAG = 0x80000000
+_FLIPPED_VERTICALLY_FLAG = 0x40000000
+_FLIPPED_DIAGONALLY_FLAG = 0x20000000
+_GID_MASK = 0x1FFFFFFF
+
+# Флаги тайла в таблице тайлов
+TILE_FLIPPED_HORIZONTALLY = 1
+TILE_FLIPPED_VERTICALLY = 2
+TILE_FLIPPED_DIAGONALLY = 4
+
+LAYER_TILES = 0
+LAYER_OBJECTS = 1
+
+OBJECT_TILE = 0
+OBJECT_POINT = 1
+OBJECT_SHAPE = 2
+
+PROPERTY_STR = 0
+PROPERTY_INT = 1
+PROPERTY_FLOAT = 2
+PROPERTY_BOOL = 3
+
+NO_STRING = 0xFFFFFFFF
+
+# magic, version, flags, width, height, tile width, tile height, background rgba,
+# counts of tiles, frames, layers, objects, points, properties,
+# string table offset and size
+HEADER = struct.Struct("<4sHHIIHH4BIIIIIIII")
+# image, x, y, width, height, flags, first property, property count, first frame, frame count
+TILE = struct.Struct("<IHHHHBxxxIIII")
+# tile index, duration in milliseconds
+FRAME = struct.Struct("<II")
+# name, kind, visible, index size, has tint, opacity, tint rgba,
+# first property, property count, data offset, first object, object count
+LAYER = struct.Struct("<IBBBBf4BIIIII")
+# kind, tile index, x, y, width, height, rotation, name, class,
+# first property, property count, first point, point count
+OBJECT = struct.Struct("<IIddfffIIIIII")
+POINT = struct.Struct("<dd")
+# key, type, number, string
+PROPERTY = struct.Struct("<IB7xdI4x")
+
+
+def bundle_path(map_name):
+    """Where the compiled bundle of a Tiled JSON level lives."""
+    return Path(map_name).with_suffix(BUNDLE_SUFFIX)
+
+
+def bundle_is_fresh(map_name):
+    """True if there is a bundle of this version that is newer than the source JSON."""
+    path = bundle_path(map_name)
+    if not path.exists() or os.path.getmtime(path) < os.path.getmtime(map_name):
+        return False
+    with open(path, "rb") as file:
+        header = file.read(6)
+    return header == BUNDLE_MAGIC + struct.pack("<H", BUNDLE_VERSION)
+
+
+# --- Compiler
+
+
+class _Strings:
+    def __init__(self):
+        self.data = bytearray()
+        self.offsets = {}
+
+    def add(self, text):
+        if text is None:
+            return NO_STRING
+        text = str(text)
+        offset = self.offsets.get(text)
+        if offset is None:
+            offset = len(self.data)
+            self.offsets[text] = offset
+            self.data += text.encode("utf-8") + b"\0"
+        return offset
+
+
+class _Compiler:
+    """Collects the tables of one level while walking the parsed map."""
+
+    def __init__(self, tiled_map, out_dir):
+        self.tiled_map = tiled_map
+        self.map_dir = Path(tiled_map.map_file).parent
+        self.out_dir = out_dir
+        self.strings = _Strings()
+        # Image of a tile is kept as a path until write(), the atlas may replace it
+        self.tiles = []
+        self.tile_index = {}
+        self.frames = []
+        self.layers = []
+        self.objects = []
+        self.points = []
+        self.properties = []
+        self.layer_data = []
+
+    def add_properties(self, properties):
+        first = len(self.properties)
+        for key, value in (properties or {}).items():
+            if isinstance(value, bool):
+                record = (PROPERTY_BOOL, float(value), NO_STRING)
+            elif isinstance(value, int):
+                record = (PROPERTY_INT, float(value), NO_STRING)
+            elif isinstance(value, float):
+                record = (PROPERTY_FLOAT, value, NO_STRING)
+            else:
+                record = (PROPERTY_STR, 0.0, self.strings.add(value))
+            self.properties.append((self.strings.add(key),) + record)
+        return first, len(self.properties) - first
+
+    def image_path(self, image):
+        """Image path relative to the bundle, the way arcade finds it."""
+        image = Path(image)
+        if not image.exists():
+            image = self.map_dir / image
+        return os.path.relpath(image, self.out_dir)
+
+    def find_tile(self, gid):
+        """Tileset and tile description for a gid without flip flags."""
+        for first_gid, tileset in self.tiled_map.tilesets.items():
+            if gid < first_gid:
+                continue
+            if tileset.image is not None and first_gid <= gid < first_gid + tileset.tile_count:
+                tile = tileset.tiles.get(gid - first_gid) if tileset.tiles else None
+                return tileset, gid - first_gid, tile
+            if tileset.tiles and (gid - first_gid) in tileset.tiles:
+                return tileset, gid - first_gid, tileset.tiles[gid - first_gid]
+        return None, None, None
+
+    @staticmethod
+    def tile_rect(tileset, tile_id, tile):
+        if tile is not None and tile.image is not None:
+            return 0, 0, tile.width, tile.height
+        margin = tileset.margin or 0
+        spacing = tileset.spacing or 0
+        x = margin + (tile_id % tileset.columns) * (tileset.tile_width + spacing)
+        y = margin + (tile_id // tileset.columns) * (tileset.tile_height + spacing)
+        return x, y, tileset.tile_width, tileset.tile_height
+
+    def add_tile(self, gid):
+        """Index of a tile (with flip flags) in the tile table, 1-based."""
+        index = self.tile_index.get(gid)
+        if index is not None:
+            return index
+
+        tileset, tile_id, tile = self.find_tile(gid & _GID_MASK)
+        if tileset is None:
+            raise ValueError(f"Couldn't find tile for gid {gid} in '{self.tiled_map.map_file}'")
+
+        flags = 0
+        if gid & _FLIPPED_HORIZONTALLY_FLAG:
+            flags |= TILE_FLIPPED_HORIZONTALLY
+        if gid & _FLIPPED_VERTICALLY_FLAG:
+            flags |= TILE_FLIPPED_VERTICALLY
+        if gid & _FLIPPED_DIAGONALLY_FLAG:
+            flags |= TILE_FLIPPED_DIAGONALLY
+
+        image = tile.image if tile is not None and tile.image is not None else tileset.image
+        x, y, width, height = self.tile_rect(tileset, tile_id, tile)
+
+        properties = dict(tile.properties or {}) if tile is not None else {}
+        if tile is not None and tile.class_:
+            properties["type"] = tile.class_
+        properties["tile_id"] = tile_id
+        first_property, property_count = self.add_properties(properties)
+
+        index = len(self.tiles) + 1
+        self.tile_index[gid] = index
+        record = [self.image_path(image), x, y, width, height, flags,
+                  first_property, property_count, 0, 0]
+        self.tiles.append(record)
+
+        if tile is not None and tile.animation:
+            frames = []
+            for frame in tile.animation:
+                frame_tile = tileset.tiles.get(frame.tile_id) if tileset.tiles else None
+                if frame_tile is None and tileset.image is None:
+                    continue
+                frame_gid = frame.tile_id + next(
+                    first for first, other in self.tiled_map.tilesets.items() if other is tileset)
+                frames.append((self.add_tile(frame_gid), frame.duration))
+            record[8] = len(self.frames)
+            record[9] = len(frames)
+            self.frames.extend(frames)
+        return index
+
+    def add_tile_layer(self, layer):
+        indices = array("I")
+        for row in layer.data:
+            for gid in row:
+                indices.append(self.add_tile(gid) if gid else 0)
+        first_property, property_count = self.add_properties(layer.properties)
+        self.layers.append([self.strings.add(layer.name), LAYER_TILES, int(layer.visible), 0,
+                            layer.tint_color is not None, layer.opacity or 0.0,
+                            tuple(layer.tint_color or (0, 0, 0, 0))[:4],
+                            first_property, property_count, 0, 0, 0])
+        self.layer_data.append(indices)
+
+    def add_object_layer(self, layer):
+        import pytiled_parser
+
+        first_object = len(self.objects)
+        map_height = self.tiled_map.map_size.height * self.tiled_map.tile_size.height
+        for tiled_object in layer.tiled_objects:
+            x = tiled_object.coordinates.x
+            y = tiled_object.coordinates.y
+            width = height = 0.0
+            tile = 0
+            points = []
+            if isinstance(tiled_object, pytiled_parser.tiled_object.Tile):
+                kind = OBJECT_TILE
+                tile = self.add_tile(tiled_object.gid)
+                width, height = tiled_object.size
+            elif isinstance(tiled_object, pytiled_parser.tiled_object.Point) or (
+                    isinstance(tiled_object, pytiled_parser.tiled_object.Rectangle)
+                    and tiled_object.size.width == 0 and tiled_object.size.height == 0):
+                kind = OBJECT_POINT
+                points = [(x, map_height - y)]
+            elif isinstance(tiled_object, pytiled_parser.tiled_object.Rectangle):
+                kind = OBJECT_SHAPE
+                ex = x + tiled_object.size.width
+                ey = y + tiled_object.size.height
+                points = [(x, -y), (ex, -y), (ex, -ey), (x, -ey)]
+            elif isinstance(tiled_object, (pytiled_parser.tiled_object.Polygon,
+                                           pytiled_parser.tiled_object.Polyline)):
+                kind = OBJECT_SHAPE
+                points = [(point.x + x, map_height - (point.y + y)) for point in tiled_object.points]
+                if points[0] == points[-1]:
+                    points.pop()
+            elif isinstance(tiled_object, pytiled_parser.tiled_object.Ellipse):
+                kind = OBJECT_SHAPE
+                hw = tiled_object.size.width / 2
+                hh = tiled_object.size.height / 2
+                for step in range(8):
+                    angle = step / 8 * 2 * math.pi
+                    points.append((hw * math.cos(angle) + x + hw, -(hh * math.sin(angle) + y + hh)))
+            else:
+                continue
+
+            first_property, property_count = self.add_properties(tiled_object.properties)
+            self.objects.append((kind, tile, x, y, width, height, tiled_object.rotation or 0.0,
+                                 self.strings.add(tiled_object.name),
+                                 self.strings.add(tiled_object.class_),
+                                 first_property, property_count, len(self.points), len(points)))
+            self.points.extend(points)
+
+        first_property, property_count = self.add_properties(layer.properties)
+        self.layers.append([self.strings.add(layer.name), LAYER_OBJECTS, int(layer.visible), 0,
+                            layer.tint_color is not None, layer.opacity or 0.0,
+                            tuple(layer.tint_color or (0, 0, 0, 0))[:4],
+                            first_property, property_count, 0,
+                            first_object, len(self.objects) - first_object])
+        self.layer_data.append(None)
+
+    def add_layers(self, layers):
+        import pytiled_parser
+
+        for layer in layers:
+            if isinstance(layer, pytiled_parser.TileLayer):
+                self.add_tile_layer(layer)
+            elif isinstance(layer, pytiled_parser.ObjectLayer):
+                self.add_object_layer(layer)
+            elif isinstance(layer, pytiled_parser.LayerGroup):
+                self.add_layers(layer.layers)
+            else:
+                print(f"Warning: layer '{layer.name}' of type {type(layer).__name__} is not compiled")
+
+    def pack_atlas(self, out):
+        """Move the tile images into atlas pages of the bundle ``out``. Returns an AtlasReport."""
+        # Отражённые варианты одного тайла берут из атласа один и тот же кусок
+        regions = list(dict.fromkeys((tile[0], *tile[1:5]) for tile in self.tiles))
+        pages, places, report = build_atlas(
+            [(self.out_dir / path, *rect) for path, *rect in regions], out)
+        places = dict(zip(regions, places))
+        for tile in self.tiles:
+            page, x, y = places[(tile[0], *tile[1:5])]
+            tile[0:3] = os.path.relpath(pages[page], self.out_dir), x, y
+        return report
+
+    def write(self, out):
+        index_size = 2 if len(self.tiles) < 0xFFFF else 4
+        sections = [
+            b"".join(TILE.pack(self.strings.add(tile[0]), *tile[1:]) for tile in self.tiles),
+            b"".join(FRAME.pack(*frame) for frame in self.frames),
+            None,  # слои пишутся после того, как известны смещения массивов
+            b"".join(OBJECT.pack(*record) for record in self.objects),
+            b"".join(POINT.pack(*point) for point in self.points),
+            b"".join(PROPERTY.pack(*record) for record in self.properties),
+        ]
+        offset = HEADER.size + sum(len(section) for section in sections if section)
+        offset += LAYER.size * len(self.layers)
+        strings_offset = offset
+        offset += len(self.strings.data)
+
+        blobs = []
+        for layer, data in zip(self.layers, self.layer_data):
+            if data is None:
+                continue
+            offset += -offset % 4
+            layer[3] = index_size
+            layer[9] = offset
+            blob = array("H" if index_size == 2 else "I", data).tobytes()
+            blobs.append((offset, blob))
+            offset += len(blob)
+        sections[2] = b"".join(
+            LAYER.pack(*layer[:6], *layer[6], *layer[7:]) for layer in self.layers)
+
+        background = self.tiled_map.background_color
+        flags = 1 if background else 0
+        background = tuple(background or (0, 0, 0, 0))
+        if len(background) == 3:
+            background += (255,)
+
+        header = HEADER.pack(
+            BUNDLE_MAGIC, BUNDLE_VERSION, flags,
+            self.tiled_map.map_size.width, self.tiled_map.map_size.height,
+            self.tiled_map.tile_size.width, self.tiled_map.tile_size.height,
+            *background,
+            len(self.tiles), len(self.frames), len(self.layers), len(self.objects),
+            len(self.points), len(self.properties), strings_offset, len(self.strings.data))
+
+        # Пишем во временный файл, чтобы недописанный бандл никогда не считался свежим
+        temp = Path(f"{out}.tmp")
+        with open(temp, "wb") as file:
+            file.write(header)
+            for section in sections:
+                file.write(section)
+            file.write(self.strings.data)
+            for blob_offset, blob in blobs:
+                file.write(b"\0" * (blob_offset - file.tell()))
+                file.write(blob)
+        os.replace(temp, out)
+
+
+def _compile(map_name, out, atlas):
+    import pytiled_parser
+
+    tiled_map = pytiled_parser.parse_map(map_name)
+    if tiled_map.infinite:
+        raise AttributeError("Infinite maps can't be compiled")
+
+    compiler = _Compiler(tiled_map, out.parent.resolve())
+    compiler.add_layers(tiled_map.layers)
+    report = compiler.pack_atlas(out) if atlas else None
+    compiler.write(out)
+    return report
+
+
+def compile_level(map_name, out=None, atlas=True):
+    """
+    Compile a Tiled JSON level into a binary bundle, with its tile images
+    in atlas pages unless ``atlas`` is false. Returns the bundle path.
+    """
+    map_name = Path(map_name)
+    out = Path(out) if out else bundle_path(map_name)
+    _compile(map_name, out, atlas)
+    return out
+
+
+# --- Loader
+
+
+class LevelBundle:
+    """
+    A memory-mapped level bundle. Tables are small and read eagerly,
+    layer index arrays are views into the mapped file.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.directory = self.path.parent
+        self._file = open(self.path, "rb")
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        # data offset -> view of a layer's indices
+        self._views = {}
+
+        (magic, version, flags, self.width, self.height, self.tile_width, self.tile_height,
+         r, g, b, a, tile_count, frame_count, layer_count, object_count, point_count,
+         property_count, strings_offset, strings_size) = HEADER.unpack_from(self._mmap, 0)
+        if magic != BUNDLE_MAGIC or version != BUNDLE_VERSION:
+            self.close()
+            raise ValueError(f"'{path}' is not a level bundle of version {BUNDLE_VERSION}")
+        self.background_color = (r, g, b, a) if flags & 1 else None
+
+        offset = HEADER.size
+        self.tiles, offset = self._read(TILE, tile_count, offset)
+        self.frames, offset = self._read(FRAME, frame_count, offset)
+        self.layers, offset = self._read(LAYER, layer_count, offset)
+        self.objects, offset = self._read(OBJECT, object_count, offset)
+        self.points, offset = self._read(POINT, point_count, offset)
+        properties, offset = self._read(PROPERTY, property_count, offset)
+        self._strings = self._mmap[strings_offset:strings_offset + strings_size]
+        self.properties = [(self.string(key), self._property_value(kind, number, text))
+                           for key, kind, number, text in properties]
+
+    def _read(self, record, count, offset):
+        rows = [record.unpack_from(self._mmap, offset + record.size * i) for i in range(count)]
+        return rows, offset + record.size * count
+
+    def string(self, offset):
+        if offset == NO_STRING:
+            return None
+        end = self._strings.index(b"\0", offset)
+        return self._strings[offset:end].decode("utf-8")
+
+    def _property_value(self, kind, number, text):
+        if kind == PROPERTY_STR:
+            return self.string(text)
+        if kind == PROPERTY_INT:
+            return int(number)
+        if kind == PROPERTY_BOOL:
+            return bool(number)
+        return number
+
+    def property_dict(self, first, count):
+        return dict(self.properties[first:first + count])
+
+    def layer_indices(self, layer):
+        """Tile indices of a tile layer, row by row from the top."""
+        index_size, data_offset = layer[3], layer[12]
+        view = self._views.get(data_offset)
+        if view is None:
+            view = memoryview(self._mmap)[data_offset:data_offset + index_size * self.width * self.height]
+            view = view.cast("H" if index_size == 2 else "I")
+            self._views[data_offset] = view
+        return view
+
+    def close(self):
+        for view in self._views.values():
+            view.release()
+        self._views = {}
+        self._mmap.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class BundleTileMap:
+    """
+    Sprite lists built from a LevelBundle. Has the attributes of
+    arcade.TileMap that GameView and Scene.from_tilemap use.
+
+    The tile data stays available after the build for drawing tile layers
+    on the GPU (render.TileGridLayer): ``tile_grids`` has the tile indices
+    of every tile layer by name, row by row from the top, ``tiles`` the
+    tile table with the image as a path and ``frames`` the animation frames.
+
+    A streamed level (streaming.py) is not built whole: ``build_objects()``
+    builds the object layers and keeps the bundle open, then
+    ``tile_columns()`` builds the tiles of a few columns at a time.
+    """
+
+    def __init__(self, bundle, scaling=1.0, layer_options=None,
+                 use_spatial_hash=None, hit_box_algorithm="Simple"):
+        self.width = bundle.width
+        self.height = bundle.height
+        self.tile_width = bundle.tile_width
+        self.tile_height = bundle.tile_height
+        self.background_color = bundle.background_color
+        self.scaling = scaling
+        self.properties = None
+        self.sprite_lists = OrderedDict()
+        self.object_lists = OrderedDict()
+
+        self._bundle = bundle
+        self._layer_options = layer_options or {}
+        self._defaults = {"use_spatial_hash": use_spatial_hash,
+                          "hit_box_algorithm": hit_box_algorithm,
+                          "scaling": scaling}
+        self._textures = {}
+
+        self.tile_grids = OrderedDict()
+        self.tiles = [(bundle.directory / bundle.string(tile[0]),) + tuple(tile[1:])
+                      for tile in bundle.tiles]
+        self.frames = list(bundle.frames)
+
+    def build(self):
+        """Build every layer."""
+        for _name in self.build_steps():
+            pass
+        return self
+
+    def build_steps(self):
+        """
+        Build the layers one at a time, yielding each layer name when it is done.
+        The bundle is closed at the end, or when the generator is closed early.
+        """
+        try:
+            for layer in self._bundle.layers:
+                name = self._bundle.string(layer[0])
+                yield self._build_layer(name, layer, **self._options(name))
+        finally:
+            self._bundle.close()
+
+    @property
+    def layer_names(self):
+        """Names of every layer, in drawing order."""
+        return [self._bundle.string(layer[0]) for layer in self._bundle.layers]
+
+    @property
+    def tile_layer_names(self):
+        return [self._bundle.string(layer[0]) for layer in self._bundle.layers
+                if layer[1] == LAYER_TILES]
+
+    def build_objects(self):
+        """Build only the object layers, the bundle stays open for tile_columns()."""
+        for layer in self._bundle.layers:
+            if layer[1] != LAYER_TILES:
+                name = self._bundle.string(layer[0])
+                self._build_layer(name, layer, **self._options(name))
+        return self
+
+    def tile_columns(self, name, columns):
+        """
+        SpriteList of the tiles of layer ``name`` in ``columns``, pairs of
+        (column on the map, column in the bundle).
+        """
+        for layer in self._bundle.layers:
+            if layer[1] == LAYER_TILES and self._bundle.string(layer[0]) == name:
+                return self._tile_layer(layer, columns=columns, **self._options(name))
+        raise KeyError(name)
+
+    def _options(self, name):
+        options = dict(self._defaults)
+        options.update(self._layer_options.get(name, {}))
+        return options
+
+    def _build_layer(self, name, layer, **options):
+        if layer[1] == LAYER_TILES:
+            self.sprite_lists[name] = self._tile_layer(layer, **options)
+            # Копия: отображение файла закрывается после сборки
+            indices = self._bundle.layer_indices(layer)
+            self.tile_grids[name] = array(indices.format, indices)
+        else:
+            self._object_layer(name, layer, **options)
+        return name
+
+    def preload_textures(self, cancelled=None):
+        """
+        Decode the textures the layers use and their hit boxes. Touches no GL state, so
+        it can run on a loader thread before build_steps(). Stops early if
+        the ``cancelled`` event gets set.
+        """
+        for index, algorithm in sorted(self._used_textures()):
+            if cancelled is not None and cancelled.is_set():
+                return False
+            self._texture(index, algorithm).hit_box_points
+        return True
+
+    def _used_textures(self):
+        """(tile index, hit box algorithm) of every texture the layers are built from."""
+        used = set()
+        bundle = self._bundle
+        for layer in bundle.layers:
+            algorithm = self._options(bundle.string(layer[0]))["hit_box_algorithm"]
+            if layer[1] == LAYER_TILES:
+                indices = set(bundle.layer_indices(layer))
+            else:
+                first, count = layer[13], layer[14]
+                indices = {record[1] for record in bundle.objects[first:first + count]
+                           if record[0] == OBJECT_TILE}
+            indices.discard(0)
+            for index in indices:
+                used.add((index, algorithm))
+                # Кадры анимации строятся с алгоритмом слоя своего тайла
+                first_frame, frame_count = bundle.tiles[index - 1][8:10]
+                for frame_index, _duration in bundle.frames[first_frame:first_frame + frame_count]:
+                    used.add((frame_index, algorithm))
+        return used
+
+    def close(self):
+        """Release the bundle without building (it is closed after a build anyway)."""
+        self._bundle.close()
+
+    def _texture(self, index, hit_box_algorithm):
+        key = (index, hit_box_algorithm)
+        texture = self._textures.get(key)
+        if texture is None:
+            path, x, y, width, height, flags = self._bundle.tiles[index - 1][:6]
+            texture = asset_manager.texture(
+                self._bundle.directory / self._bundle.string(path), x, y, width, height,
+                flipped_horizontally=bool(flags & TILE_FLIPPED_HORIZONTALLY),
+                flipped_vertically=bool(flags & TILE_FLIPPED_VERTICALLY),
+                flipped_diagonally=bool(flags & TILE_FLIPPED_DIAGONALLY),
+                hit_box_algorithm=hit_box_algorithm)
+            self._textures[key] = texture
+        return texture
+
+    def _sprite(self, index, scaling, hit_box_algorithm):
+        tile = self._bundle.tiles[index - 1]
+        first_frame, frame_count = tile[8], tile[9]
+        texture = self._texture(index, hit_box_algorithm)
+        if frame_count:
+            sprite = arcade.AnimatedTimeBasedSprite(scale=scaling)
+            sprite.frames = [
+                arcade.AnimationKeyframe(frame_index - 1, duration,
+                                         self._texture(frame_index, hit_box_algorithm))
+                for frame_index, duration in self._bundle.frames[first_frame:first_frame + frame_count]
+            ]
+            sprite.texture = sprite.frames[0].texture
+            sprite.hit_box = sprite.texture.hit_box_points
+        else:
+            # Хит-бокс берётся у текстуры, алгоритм уже учтён в ней
+            sprite = arcade.Sprite(texture=texture, scale=scaling)
+        sprite.properties.update(self._bundle.property_dict(tile[6], tile[7]))
+        return sprite
+
+    @staticmethod
+    def _apply_layer_style(sprite, layer):
+        has_tint, opacity = layer[4], layer[5]
+        if has_tint:
+            sprite.color = layer[6:10]
+        if opacity:
+            sprite.alpha = int(opacity * 255)
+
+    def _tile_layer(self, layer, scaling, use_spatial_hash, hit_box_algorithm, columns=None):
+        """
+        SpriteList of a tile layer. ``columns`` - (column, column in the
+        bundle) pairs - builds only those columns, the tiles of the bundle
+        column are put into the given one.
+        """
+        sprite_list = arcade.SpriteList(use_spatial_hash=use_spatial_hash)
+        tile_width = self.tile_width * scaling
+        tile_height = self.tile_height * scaling
+        indices = self._bundle.layer_indices(layer)
+        width = self.width
+        if columns is None:
+            columns = [(column, column) for column in range(width)]
+        # Ряд за рядом, как и при сборке всего слоя
+        for row in range(self.height):
+            base = row * width
+            for column, source_column in columns:
+                index = indices[base + source_column]
+                if not index:
+                    continue
+                sprite = self._sprite(index, scaling, hit_box_algorithm)
+                sprite.center_x = column * tile_width + sprite.width / 2
+                sprite.center_y = (self.height - row - 1) * tile_height + sprite.height / 2
+                self._apply_layer_style(sprite, layer)
+                sprite_list.append(sprite)
+        if len(sprite_list):
+            sprite_list.visible = bool(layer[2])
+        properties = self._bundle.property_dict(layer[10], layer[11])
+        if properties:
+            sprite_list.properties = properties
+        return sprite_list
+
+    def _object_layer(self, name, layer, scaling, use_spatial_hash, hit_box_algorithm):
+        sprite_list = None
+        objects = []
+        map_height = self.height * self.tile_height
+        first, count = layer[13], layer[14]
+        for record in self._bundle.objects[first:first + count]:
+            (kind, tile, x, y, width, height, rotation, name_offset, class_offset,
+             first_property, property_count, first_point, point_count) = record
+            properties = self._bundle.property_dict(first_property, property_count)
+            object_name = self._bundle.string(name_offset)
+            object_class = self._bundle.string(class_offset)
+
+            if kind != OBJECT_TILE:
+                points = [list(point) for point in
+                          self._bundle.points[first_point:first_point + point_count]]
+                shape = points[0] if kind == OBJECT_POINT else points
+                if kind == OBJECT_POINT:
+                    shape = [shape[0] * scaling, shape[1] * scaling]
+                objects.append(TiledObject(shape, properties, object_name, object_class))
+                continue
+
+            if sprite_list is None:
+                sprite_list = arcade.SpriteList(use_spatial_hash=use_spatial_hash)
+            sprite = self._sprite(tile, scaling, hit_box_algorithm)
+            sprite.width = width * scaling
+            sprite.height = height * scaling
+            angle = -rotation
+            center_x, center_y = arcade.rotate_point(sprite.width / 2, sprite.height / 2, 0, 0, angle)
+            sprite.position = (x * scaling + center_x, (map_height - y) * scaling + center_y)
+            sprite.angle = angle
+            self._apply_layer_style(sprite, layer)
+
+            for key in ("change_x", "change_y", "boundary_bottom", "boundary_top",
+                        "boundary_left", "boundary_right"):
+                if key in properties:
+                    setattr(sprite, key, float(properties[key]))
+            sprite.properties.update(properties)
+            if object_class:
+                sprite.properties["type"] = object_class
+            if object_name:
+                sprite.properties["name"] = object_name
+
+            sprite_list.visible = bool(layer[2])
+            sprite_list.append(sprite)
+
+        if sprite_list:
+            self.sprite_lists[name] = sprite_list
+        if objects:
+            self.object_lists[name] = objects
+
+
+def load_bundle(path, scaling=1.0, layer_options=None, use_spatial_hash=None,
+                hit_box_algorithm="Simple"):
+    """Build a BundleTileMap from a compiled bundle."""
+    return BundleTileMap(LevelBundle(path), scaling, layer_options,
+                         use_spatial_hash, hit_box_algorithm).build()
+
+
+def prepare_tilemap(map_name, scaling=1.0, layer_options=None, cancelled=None):
+    """
+    The part of loading a level that needs no window: compiles the bundle
+    if it is stale, maps it and decodes the tile textures. Can run on a
+    worker thread. Returns a BundleTileMap that still has to be built on
+    the main thread with build() or build_steps().
+    """
+    if not bundle_is_fresh(map_name):
+        compile_level(map_name)
+    tile_map = BundleTileMap(LevelBundle(bundle_path(map_name)), scaling, layer_options)
+    tile_map.preload_textures(cancelled)
+    asset_manager.hit_boxes.save()
+    return tile_map
+
+
+def load_tilemap(map_name, scaling=1.0, layer_options=None):
+    """
+    Load a level, from its compiled bundle if that is newer than the JSON,
+    otherwise with arcade.load_tilemap.
+    """
+    if bundle_is_fresh(map_name):
+        tile_map = load_bundle(bundle_path(map_name), scaling, layer_options)
+        asset_manager.hit_boxes.save()
+        return tile_map
+    return load_json_tilemap(map_name, scaling, layer_options)
+
+
+def load_json_tilemap(map_name, scaling=1.0, layer_options=None):
+    """
+    Load a level straight from its JSON with arcade.load_tilemap. Layers
+    with HIT_BOX_BOUNDS get the same hit boxes as from a bundle, so a
+    level collides the same whether it was compiled or not.
+    """
+    layer_options = layer_options or {}
+    bounds = [name for name, options in layer_options.items()
+              if options.get("hit_box_algorithm") == HIT_BOX_BOUNDS]
+    # arcade не знает HIT_BOX_BOUNDS: грузим с рамкой текстуры и ставим свою
+    layer_options = {name: {key: "None" if value == HIT_BOX_BOUNDS else value
+                            for key, value in options.items()}
+                     for name, options in layer_options.items()}
+    tile_map = arcade.load_tilemap(map_name, scaling, layer_options)
+    for name in bounds:
+        for sprite in tile_map.sprite_lists.get(name, ()):
+            sprite.hit_box = bounds_hit_box(sprite.texture.image)
+    return tile_map
+
+
+# --- Command line
+
+
+def _levels(args):
+    return args or sorted(glob.glob("./data/level_[0-9]*.json"))
+
+
+def _bench(levels, repeat=5):
+    """Time loading every level from JSON and from its bundle."""
+    from game import TILE_SCALING
+
+    print(f"{'level':24} {'json first':>10} {'json best':>10} {'lvl first':>10} {'lvl best':>10}  ms")
+    for map_name in levels:
+        if not bundle_is_fresh(map_name):
+            compile_level(map_name)
+        timings = {}
+        for kind, load in (("json", lambda: arcade.load_tilemap(map_name, TILE_SCALING)),
+                           ("lvl", lambda: load_bundle(bundle_path(map_name), TILE_SCALING))):
+            samples = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                load()
+                samples.append((time.perf_counter() - start) * 1000)
+            timings[kind] = samples
+        print(f"{os.path.basename(map_name):24} "
+              f"{timings['json'][0]:10.1f} {min(timings['json']):10.1f} "
+              f"{timings['lvl'][0]:10.1f} {min(timings['lvl']):10.1f}")
+
+
+def main(argv):
+    if len(argv) < 2 or argv[1] not in ("compile", "bench"):
+        print(__doc__)
+        return 1
+    args = argv[2:]
+    atlas = "--no-atlas" not in args
+    levels = _levels([arg for arg in args if arg != "--no-atlas"])
+    if argv[1] == "compile":
+        for map_name in levels:
+            out = bundle_path(map_name)
+            report = _compile(Path(map_name), out, atlas)
+            print(f"{map_name} -> {out} ({os.path.getsize(out)} bytes)")
+            if report is not None:
+                print(f"    {report}")
+    else:
+        _bench(levels)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
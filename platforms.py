@@ -0,0 +1,220 @@
+"""
+Moving platforms advanced all at once from flat arrays
+"""
+import math
+
+import arcade
+
+try:
+    import numpy
+except ImportError:
+    # numpy не обязателен: без него тот же шаг делает простой цикл
+    numpy = None
+
+
+# With fewer platforms a plain loop is faster than numpy's per-call overhead
+NUMPY_MIN_PLATFORMS = 64
+
+# A missing boundary. Every comparison with NaN is false, so it is never hit
+NO_BOUNDARY = math.nan
+
+
+def _edges(sprite):
+    """Left, right, bottom and top of the sprite's hit box, relative to its center."""
+    points = sprite.hit_box
+    if not points:
+        return 0.0, 0.0, 0.0, 0.0
+    if sprite.angle:
+        points = [arcade.rotate_point(x, y, 0, 0, sprite.angle) for x, y in points]
+    # Так же, как Sprite.get_adjusted_hit_box: точка * масштаб, потом + центр
+    xs = [x * sprite.scale for x, _y in points]
+    ys = [y * sprite.scale for _x, y in points]
+    return min(xs), max(xs), min(ys), max(ys)
+
+
+class PlatformSystem:
+    """
+    Positions, velocities, boundaries and hit box edges of the sprites of a
+    moving platform layer, kept in flat arrays: numpy arrays when numpy is
+    installed and there are at least NUMPY_MIN_PLATFORMS platforms, lists
+    otherwise.
+
+    ``move()`` is the step PhysicsEnginePlatformer makes after moving the
+    player: bounce off the boundaries, then move. ``update()`` is what
+    ``scene.update()`` did to the layer: move once more by the velocity.
+    Both repeat the float arithmetic of the sprite properties, so platforms
+    end up exactly where arcade would put them; only the sprites that moved
+    are written back.
+
+    The sprites must not be rotated or scaled afterwards. When their
+    position or velocity is set from outside (a restore), call ``sync()``.
+    Platforms put to sleep by ``wake_near()`` stand still.
+    """
+
+    def __init__(self, sprite_list):
+        self.sprites = list(sprite_list)
+        self.count = len(self.sprites)
+        self.vectorized = numpy is not None and self.count >= NUMPY_MIN_PLATFORMS
+
+        edges = [_edges(sprite) for sprite in self.sprites]
+        left_edge, right_edge, bottom_edge, top_edge = zip(*edges) if edges else ((), (), (), ())
+        # Как в arcade: левая и правая границы 0 считаются отсутствующими
+        boundary_left = [sprite.boundary_left or NO_BOUNDARY for sprite in self.sprites]
+        boundary_right = [sprite.boundary_right or NO_BOUNDARY for sprite in self.sprites]
+        boundary_bottom = [NO_BOUNDARY if sprite.boundary_bottom is None else sprite.boundary_bottom
+                           for sprite in self.sprites]
+        boundary_top = [NO_BOUNDARY if sprite.boundary_top is None else sprite.boundary_top
+                        for sprite in self.sprites]
+
+        self.left_edge = self._array(left_edge)
+        self.right_edge = self._array(right_edge)
+        self.bottom_edge = self._array(bottom_edge)
+        self.top_edge = self._array(top_edge)
+        self.boundary_left = self._array(boundary_left)
+        self.boundary_right = self._array(boundary_right)
+        self.boundary_bottom = self._array(boundary_bottom)
+        self.boundary_top = self._array(boundary_top)
+        self.awake = self._array([True] * self.count, bool)
+        self.sync()
+
+    def _array(self, values, kind=float):
+        if self.vectorized:
+            return numpy.array(values, dtype=kind)
+        return [kind(value) for value in values]
+
+    def sync(self):
+        """Read positions and velocities from the sprites."""
+        self.x = self._array([sprite.center_x for sprite in self.sprites])
+        self.y = self._array([sprite.center_y for sprite in self.sprites])
+        self.change_x = self._array([sprite.change_x for sprite in self.sprites])
+        self.change_y = self._array([sprite.change_y for sprite in self.sprites])
+
+    def wake_near(self, x, distance):
+        """Let the platforms further than ``distance`` from ``x`` sleep, wake the rest."""
+        if self.vectorized:
+            self.awake = numpy.abs(self.x - x) <= distance
+        else:
+            self.awake = [abs(center_x - x) <= distance for center_x in self.x]
+
+    def move(self):
+        """Bounce off the boundaries and move, as PhysicsEnginePlatformer does."""
+        if self.vectorized:
+            self._write(*self._move_vectorized())
+        else:
+            self._write(*self._move_loop())
+
+    def _move_loop(self):
+        xs, ys = self.x, self.y
+        change_xs, change_ys = self.change_x, self.change_y
+        moved = []
+        turned = []
+        for index in range(self.count):
+            change_x = change_xs[index]
+            change_y = change_ys[index]
+            if (change_x == 0 and change_y == 0) or not self.awake[index]:
+                continue
+            x = xs[index]
+            y = ys[index]
+
+            left = self.left_edge[index] + x
+            boundary = self.boundary_left[index]
+            if left <= boundary:
+                x += boundary - left
+                if change_x < 0:
+                    change_x *= -1
+            right = self.right_edge[index] + x
+            boundary = self.boundary_right[index]
+            if right >= boundary:
+                x -= right - boundary
+                if change_x > 0:
+                    change_x *= -1
+            x += change_x
+
+            top = self.top_edge[index] + y
+            boundary = self.boundary_top[index]
+            if top >= boundary:
+                y -= top - boundary
+                if change_y > 0:
+                    change_y *= -1
+            bottom = self.bottom_edge[index] + y
+            boundary = self.boundary_bottom[index]
+            if bottom <= boundary:
+                y -= bottom - boundary
+                if change_y < 0:
+                    change_y *= -1
+            y += change_y
+
+            xs[index] = x
+            ys[index] = y
+            moved.append(index)
+            if change_x != change_xs[index] or change_y != change_ys[index]:
+                change_xs[index] = change_x
+                change_ys[index] = change_y
+                turned.append(index)
+        return moved, turned
+
+    def _move_vectorized(self):
+        x, y = self.x, self.y
+        change_x, change_y = self.change_x, self.change_y
+        active = self.awake & ((change_x != 0) | (change_y != 0))
+
+        left = self.left_edge + x
+        hit = active & (left <= self.boundary_left)
+        x = numpy.where(hit, x + (self.boundary_left - left), x)
+        new_change_x = numpy.where(hit & (change_x < 0), -change_x, change_x)
+        right = self.right_edge + x
+        hit = active & (right >= self.boundary_right)
+        x = numpy.where(hit, x - (right - self.boundary_right), x)
+        new_change_x = numpy.where(hit & (new_change_x > 0), -new_change_x, new_change_x)
+        x = numpy.where(active, x + new_change_x, x)
+
+        top = self.top_edge + y
+        hit = active & (top >= self.boundary_top)
+        y = numpy.where(hit, y - (top - self.boundary_top), y)
+        new_change_y = numpy.where(hit & (change_y > 0), -change_y, change_y)
+        bottom = self.bottom_edge + y
+        hit = active & (bottom <= self.boundary_bottom)
+        y = numpy.where(hit, y - (bottom - self.boundary_bottom), y)
+        new_change_y = numpy.where(hit & (new_change_y < 0), -new_change_y, new_change_y)
+        y = numpy.where(active, y + new_change_y, y)
+
+        turned = numpy.flatnonzero((new_change_x != change_x) | (new_change_y != change_y))
+        self.x, self.y = x, y
+        self.change_x, self.change_y = new_change_x, new_change_y
+        return numpy.flatnonzero(active).tolist(), turned.tolist()
+
+    def update(self):
+        """Move every awake platform by its velocity once more, as Sprite.update() does."""
+        if self.vectorized:
+            active = self.awake & ((self.change_x != 0) | (self.change_y != 0))
+            self.x = numpy.where(active, self.x + self.change_x, self.x)
+            self.y = numpy.where(active, self.y + self.change_y, self.y)
+            self._write(numpy.flatnonzero(active).tolist(), ())
+            return
+
+        moved = []
+        for index in range(self.count):
+            change_x = self.change_x[index]
+            change_y = self.change_y[index]
+            if (change_x == 0 and change_y == 0) or not self.awake[index]:
+                continue
+            self.x[index] += change_x
+            self.y[index] += change_y
+            moved.append(index)
+        self._write(moved, ())
+
+    def _write(self, moved, turned):
+        """Put the new positions and velocities into the sprites."""
+        if self.vectorized:
+            xs, ys = self.x.tolist(), self.y.tolist()
+            change_xs, change_ys = self.change_x.tolist(), self.change_y.tolist()
+        else:
+            xs, ys = self.x, self.y
+            change_xs, change_ys = self.change_x, self.change_y
+        sprites = self.sprites
+        for index in moved:
+            sprites[index].position = (xs[index], ys[index])
+        for index in turned:
+            sprite = sprites[index]
+            sprite.change_x = change_xs[index]
+            sprite.change_y = change_ys[index]
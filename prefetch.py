@@ -0,0 +1,140 @@
+"""
+Loading the next level in the background while menus are shown
+"""
+import threading
+import time
+import traceback
+
+
+# How long the main thread may spend on finishing a prefetch per frame, in seconds
+PREFETCH_STEP_BUDGET = 0.008
+
+
+class Prefetch:
+    """
+    One level being loaded.
+
+    ``background(key, cancelled)`` runs on a worker thread and must not touch
+    GL. ``foreground(key, result)`` is a generator run on the main thread a
+    few steps per frame; the value it returns is the loaded level.
+    """
+
+    def __init__(self, key, background, foreground):
+        self.key = key
+        self.cancelled = threading.Event()
+        self.result = None
+        self.error = None
+        self.done = False
+
+        self._background = background
+        self._foreground = foreground
+        self._loaded = None
+        self._steps = None
+        self._thread = threading.Thread(target=self._run, name=f"prefetch-{key}", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        try:
+            self._loaded = self._background(self.key, self.cancelled)
+        except Exception as error:
+            self.error = error
+            traceback.print_exc()
+
+    @property
+    def loaded(self):
+        """True once the worker thread is finished."""
+        return not self._thread.is_alive()
+
+    def step(self, budget):
+        """Run main thread steps for at most ``budget`` seconds (at least one step)."""
+        if self.done or self.error or self.cancelled.is_set():
+            return
+        if self._steps is None:
+            self._steps = self._foreground(self.key, self._loaded)
+        deadline = time.perf_counter() + budget
+        try:
+            while True:
+                next(self._steps)
+                if time.perf_counter() >= deadline:
+                    return
+        except StopIteration as stop:
+            self.result = stop.value
+            self.done = True
+        except Exception as error:
+            self.error = error
+            traceback.print_exc()
+
+    def finish(self):
+        """Wait for the worker and run the remaining steps. Returns the level or None."""
+        self._thread.join()
+        while not (self.done or self.error or self.cancelled.is_set()):
+            self.step(float("inf"))
+        return self.result if self.done else None
+
+    def cancel(self):
+        """Stop the worker as soon as it checks ``cancelled`` and drop what was loaded."""
+        self.cancelled.set()
+        if self._steps is not None:
+            self._steps.close()
+        elif self.loaded:
+            _close(self._loaded)
+        else:
+            # Поток ещё работает - результат закроется, когда он закончит
+            threading.Thread(target=self._close_when_loaded, daemon=True).start()
+        self.result = None
+
+    def _close_when_loaded(self):
+        self._thread.join()
+        _close(self._loaded)
+
+
+def _close(result):
+    close = getattr(result, "close", None)
+    if close is not None:
+        close()
+
+
+class Prefetcher:
+    """
+    Keeps at most one level prefetch going.
+
+    Menu views call ``start(level)`` when they appear and ``step()`` every
+    frame. The view that starts the game calls ``take(level)``, which hands
+    over the prefetched level, or returns None if it is for another level or
+    failed, in which case the caller loads the level itself.
+    """
+
+    def __init__(self, background, foreground, step_budget=PREFETCH_STEP_BUDGET):
+        self.background = background
+        self.foreground = foreground
+        self.step_budget = step_budget
+        self.current = None
+
+    def start(self, key):
+        """Start loading ``key``, unless it is already being loaded."""
+        if self.current is not None:
+            if self.current.key == key and not self.current.error:
+                return
+            self.cancel()
+        self.current = Prefetch(key, self.background, self.foreground)
+
+    def step(self):
+        """Advance the main thread part within the per-frame budget."""
+        if self.current is not None and self.current.loaded:
+            self.current.step(self.step_budget)
+
+    def take(self, key):
+        """The prefetched level for ``key``, or None."""
+        prefetch = self.current
+        self.current = None
+        if prefetch is None:
+            return None
+        if prefetch.key != key:
+            prefetch.cancel()
+            return None
+        return prefetch.finish()
+
+    def cancel(self):
+        if self.current is not None:
+            self.current.cancel()
+            self.current = None
@@ -0,0 +1,206 @@
+"""
+Preprocessing of the whole level pack: the compiled bundle and atlas
+pages of every level, built in parallel and only where the inputs changed.
+
+The inputs of a level are its JSON, the .tsx tilesets it references, their
+images and the compiler itself. Their content hashes are kept in a
+manifest next to the levels; a file whose size and mtime did not change
+is not read again, so a build with nothing to do only stats files.
+
+    python preprocess.py
+    python preprocess.py --jobs 4 data/level_1.json data/level_2.json
+    python preprocess.py --force --no-atlas
+"""
+import glob
+import hashlib
+import json
+import os
+import sys
+import time
+import xml.etree.ElementTree as ElementTree
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+from hashing import FileHashes
+
+
+MANIFEST_NAME = ".preprocess.json"
+MANIFEST_VERSION = 1
+
+# Исходники компилятора тоже входы: поменялся формат - пересобираем всё
+COMPILER_FILES = ("level_bundle.py", "atlas.py")
+
+
+def _layer_images(layers, folder):
+    for layer in layers:
+        if layer.get("image"):
+            yield folder / layer["image"]
+        yield from _layer_images(layer.get("layers", ()), folder)
+
+
+def _tileset_images(tileset, folder):
+    if tileset.get("image"):
+        yield folder / tileset["image"]
+    for tile in tileset.get("tiles", ()):
+        if tile.get("image"):
+            yield folder / tile["image"]
+
+
+def level_inputs(map_name):
+    """The files a level is compiled from: its JSON, tilesets and images, in a fixed order."""
+    map_name = Path(map_name)
+    folder = map_name.parent
+    with open(map_name, encoding="utf-8") as file:
+        tiled_map = json.load(file)
+
+    inputs = [map_name]
+    for tileset in tiled_map.get("tilesets", ()):
+        if "source" not in tileset:
+            inputs.extend(_tileset_images(tileset, folder))
+            continue
+        source = folder / tileset["source"]
+        inputs.append(source)
+        if source.suffix == ".json":
+            with open(source, encoding="utf-8") as file:
+                inputs.extend(_tileset_images(json.load(file), source.parent))
+        else:
+            root = ElementTree.parse(source).getroot()
+            inputs.extend(source.parent / image.get("source") for image in root.iter("image"))
+    inputs.extend(_layer_images(tiled_map.get("layers", ()), folder))
+    return list(dict.fromkeys(Path(os.path.normpath(path)) for path in inputs))
+
+
+def compiler_digest(atlas):
+    """Hash of the compiler sources and options, the same for every level of a build."""
+    here = Path(__file__).resolve().parent
+    sha = hashlib.sha256(f"{MANIFEST_VERSION} atlas={atlas}".encode())
+    for name in COMPILER_FILES:
+        sha.update((here / name).read_bytes())
+    return sha.hexdigest()
+
+
+def _load_manifest(path):
+    try:
+        with open(path, encoding="utf-8") as file:
+            manifest = json.load(file)
+    except (OSError, ValueError):
+        return {"version": MANIFEST_VERSION, "files": {}, "levels": {}}
+    if manifest.get("version") != MANIFEST_VERSION:
+        return {"version": MANIFEST_VERSION, "files": {}, "levels": {}}
+    return manifest
+
+
+def _save_manifest(path, manifest):
+    temp = Path(f"{path}.tmp")
+    with open(temp, "w", encoding="utf-8") as file:
+        json.dump(manifest, file, indent=1, sort_keys=True)
+    os.replace(temp, path)
+
+
+def _is_fresh(entry, hashes, compiler):
+    if entry is None or entry["compiler"] != compiler:
+        return False
+    if not all(os.path.exists(path) for path in entry["outputs"]):
+        return False
+    return all(hashes.digest(path) == digest for path, digest in entry["inputs"].items())
+
+
+def _build(map_name, atlas):
+    """Compile one level. Runs in a worker process; returns (outputs, report, seconds)."""
+    # Импорт тут: воркерам нужен arcade, а сборке без работы - нет
+    from atlas import atlas_page_path
+    from level_bundle import _compile, bundle_path
+
+    start = time.perf_counter()
+    out = bundle_path(map_name)
+    report = _compile(Path(map_name), out, atlas)
+    outputs = [out]
+    if report is not None:
+        outputs.extend(atlas_page_path(out, page) for page in range(report.pages))
+    return [str(path) for path in outputs], report and str(report), time.perf_counter() - start
+
+
+def preprocess(levels, jobs=None, atlas=True, force=False, manifest_path=None):
+    """
+    Bring the bundles of ``levels`` up to date, compiling the stale ones on
+    up to ``jobs`` processes (all cores by default). Returns the number of
+    levels that failed.
+    """
+    levels = [os.path.normpath(level) for level in levels]
+    if not levels:
+        return 0
+    manifest_path = Path(manifest_path or Path(levels[0]).parent / MANIFEST_NAME)
+    manifest = _load_manifest(manifest_path)
+    hashes = FileHashes(manifest["files"])
+    compiler = compiler_digest(atlas)
+
+    start = time.perf_counter()
+    stale = []
+    for map_name in levels:
+        if force or not _is_fresh(manifest["levels"].get(map_name), hashes, compiler):
+            stale.append(map_name)
+    # Длинные уровни вперёд, чтобы в конце ядра не ждали одного большого
+    stale.sort(key=os.path.getsize, reverse=True)
+    inputs = {map_name: {str(path): hashes.digest(path) for path in level_inputs(map_name)}
+              for map_name in stale}
+
+    failed = 0
+
+    def finished(map_name, outputs, report, seconds):
+        old = manifest["levels"].get(map_name)
+        for path in old["outputs"] if old else ():
+            if path not in outputs and os.path.exists(path):
+                os.remove(path)
+        manifest["levels"][map_name] = {
+            "compiler": compiler, "inputs": inputs[map_name], "outputs": outputs}
+        print(f"{map_name} -> {outputs[0]} ({seconds * 1000:.0f} ms)")
+        if report:
+            print(f"    {report}")
+
+    jobs = min(jobs or os.cpu_count() or 1, len(stale))
+    if jobs <= 1:
+        # Один процесс - без пула, его запуск дороже самой сборки
+        for map_name in stale:
+            try:
+                finished(map_name, *_build(map_name, atlas))
+            except Exception as error:
+                failed += 1
+                print(f"{map_name}: {error!r}")
+    else:
+        with ProcessPoolExecutor(jobs) as pool:
+            futures = {pool.submit(_build, map_name, atlas): map_name for map_name in stale}
+            for future in as_completed(futures):
+                map_name = futures[future]
+                try:
+                    finished(map_name, *future.result())
+                except Exception as error:
+                    failed += 1
+                    print(f"{map_name}: {error!r}")
+
+    # Файлы, которые поменялись или пропали, в манифесте больше не нужны
+    hashes.prune()
+    _save_manifest(manifest_path, manifest)
+    print(f"{len(stale) - failed} of {len(levels)} levels built, {len(levels) - len(stale)} up to date, "
+          f"{max(jobs, 1)} processes, {(time.perf_counter() - start) * 1000:.0f} ms")
+    return failed
+
+
+def main(argv):
+    args = argv[1:]
+    if "-h" in args or "--help" in args:
+        print(__doc__)
+        return 0
+    jobs = None
+    if "--jobs" in args:
+        at = args.index("--jobs")
+        jobs = int(args[at + 1])
+        del args[at:at + 2]
+    atlas = "--no-atlas" not in args
+    force = "--force" in args
+    levels = [arg for arg in args if arg not in ("--no-atlas", "--force")]
+    levels = levels or sorted(glob.glob("./data/level_[0-9]*.json"))
+    return 1 if preprocess(levels, jobs, atlas, force) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
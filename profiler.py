@@ -0,0 +1,191 @@
+"""
+Per-phase timing of the game loop, an overlay to show it and export to CSV/JSON
+"""
+import csv
+import json
+import time
+from collections import deque
+
+import arcade
+
+
+# How many of the latest samples each phase keeps
+PROFILER_WINDOW = 600
+
+# How often the overlay text is rebuilt, in seconds
+OVERLAY_REFRESH = 0.25
+
+OVERLAY_X = 10
+OVERLAY_Y = 560
+OVERLAY_LINE_HEIGHT = 16
+OVERLAY_FONT_SIZE = 10
+# Left edge of the phase name, right edges of the numbers
+OVERLAY_COLUMNS = (0, 210, 270, 330, 400)
+
+PERCENTILES = (50, 95, 99)
+
+
+class _Phase:
+    """Context manager that times one phase and keeps its latest samples."""
+
+    __slots__ = ("samples", "count", "start")
+
+    def __init__(self, window):
+        self.samples = deque(maxlen=window)
+        self.count = 0
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *_exc):
+        self.samples.append(time.perf_counter() - self.start)
+        self.count += 1
+
+
+class _NoPhase:
+    """Stands in for _Phase while the profiler is off."""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_exc):
+        pass
+
+
+_NO_PHASE = _NoPhase()
+
+
+def _percentile(ordered, percent):
+    index = min(len(ordered) - 1, int(len(ordered) * percent / 100))
+    return ordered[index]
+
+
+class FrameProfiler:
+    """
+    Times named phases of the game loop:
+
+        with profiler.phase("physics"):
+            physics_engine.update()
+
+    Each phase keeps a rolling window of its last samples, from which
+    percentiles are computed. Switched off, ``phase()`` costs one call.
+    """
+
+    def __init__(self, enabled=False, window=PROFILER_WINDOW):
+        self.enabled = enabled
+        self.window = window
+        # Фазы в порядке первого появления - так их удобнее читать
+        self.phases = {}
+
+    def phase(self, name):
+        if not self.enabled:
+            return _NO_PHASE
+        phase = self.phases.get(name)
+        if phase is None:
+            phase = _Phase(self.window)
+            self.phases[name] = phase
+        return phase
+
+    def reset(self):
+        self.phases.clear()
+
+    def stats(self):
+        """Per phase: total count and mean, p50, p95, p99 and max of the window, in ms."""
+        result = {}
+        for name, phase in self.phases.items():
+            if not phase.samples:
+                continue
+            ordered = sorted(phase.samples)
+            row = {"count": phase.count, "mean_ms": sum(ordered) / len(ordered) * 1000}
+            for percent in PERCENTILES:
+                row[f"p{percent}_ms"] = _percentile(ordered, percent) * 1000
+            row["max_ms"] = ordered[-1] * 1000
+            result[name] = row
+        return result
+
+    def export(self, path, **info):
+        """
+        Write the stats to a .csv or .json file (by extension). ``info``
+        (level, ticks...) goes into the JSON as is, or into every CSV row.
+        """
+        stats = self.stats()
+        path = str(path)
+        if path.endswith(".json"):
+            with open(path, "w", encoding="utf-8") as file:
+                json.dump(dict(info, phases=stats), file, indent=2)
+            return
+        columns = list(info) + ["phase", "count", "mean_ms"]
+        columns += [f"p{percent}_ms" for percent in PERCENTILES] + ["max_ms"]
+        with open(path, "w", newline="", encoding="utf-8") as file:
+            writer = csv.DictWriter(file, fieldnames=columns)
+            writer.writeheader()
+            for name, row in stats.items():
+                row = {key: round(value, 4) for key, value in row.items()}
+                writer.writerow(dict(info, phase=name, **row))
+
+    def table(self):
+        """The stats as aligned text lines."""
+        lines = [f"{'phase':20} {'p50':>7} {'p95':>7} {'p99':>7} {'max':>7}  ms"]
+        for name, row in self.stats().items():
+            lines.append(f"{name:20} {row['p50_ms']:7.3f} {row['p95_ms']:7.3f} "
+                         f"{row['p99_ms']:7.3f} {row['max_ms']:7.3f}")
+        return lines
+
+
+class ProfilerOverlay:
+    """Profiler table drawn over the game, rebuilt a few times per second."""
+
+    def __init__(self, profiler):
+        self.profiler = profiler
+        self.visible = False
+        self.texts = []
+        self._cells = {}
+        self._rows = 0
+        self._last_refresh = 0.0
+
+    def toggle(self):
+        self.visible = not self.visible
+        if self.visible:
+            self.profiler.enabled = True
+
+    def _text(self, row, column):
+        """The Text object for a cell, created on first use."""
+        key = (row, column)
+        text = self._cells.get(key)
+        if text is None:
+            x = OVERLAY_X + OVERLAY_COLUMNS[column]
+            text = arcade.Text("",
+                               start_x=x,
+                               start_y=OVERLAY_Y - row * OVERLAY_LINE_HEIGHT,
+                               color=arcade.csscolor.YELLOW,
+                               font_size=OVERLAY_FONT_SIZE,
+                               anchor_x="left" if column == 0 else "right")
+            self._cells[key] = text
+            self.texts.append(text)
+        return text
+
+    def update(self):
+        now = time.perf_counter()
+        if not self.visible or now - self._last_refresh < OVERLAY_REFRESH:
+            return
+        self._last_refresh = now
+        rows = [["phase", "p50", "p95", "p99", "max ms"]]
+        for name, row in self.profiler.stats().items():
+            rows.append([name] + [f"{row[key]:.3f}" for key in ("p50_ms", "p95_ms", "p99_ms", "max_ms")])
+        for row_index, row in enumerate(rows):
+            for column, value in enumerate(row):
+                self._text(row_index, column).text = value
+        self._rows = len(rows)
+
+    def draw(self):
+        if not self.visible or not self.texts:
+            return
+        top = OVERLAY_Y + OVERLAY_LINE_HEIGHT
+        bottom = OVERLAY_Y - self._rows * OVERLAY_LINE_HEIGHT
+        arcade.draw_lrtb_rectangle_filled(OVERLAY_X - 5, OVERLAY_X + 420, top, bottom, (0, 0, 0, 160))
+        for line in self.texts:
+            line.draw()
@@ -0,0 +1,739 @@
+"""
+Scene drawing: static tile layers are baked into offscreen chunks once
+(or drawn from their tile grid on the GPU), the rest are split into column
+chunks so off-screen columns are skipped. Streamed levels are drawn from
+the chunks that are built
+"""
+from array import array
+
+import arcade
+from arcade.gl import geometry
+
+from assets import asset_manager
+from level_bundle import TILE_FLIPPED_DIAGONALLY
+
+
+# Rasterizers put the edges of triangles on a grid of 1/256 pixel, the tile
+# grid shader snaps the camera the same way so tile edges cover the same pixels
+SUBPIXEL_STEPS = 256
+
+# Size of one baked chunk in pixels
+STATIC_CHUNK_SIZE = 1024
+
+# Width of a column chunk of a live layer, in pixels
+CULL_CHUNK_WIDTH = 512
+
+# Extra distance around the camera that is still drawn, in pixels
+CULL_MARGIN = 64
+
+
+CHUNK_VERTEX_SHADER = """
+#version 330
+
+uniform Projection {
+    uniform mat4 matrix;
+} proj;
+
+// x, y, width, height of the chunk in world coordinates
+uniform vec4 rect;
+
+in vec2 in_vert;
+in vec2 in_uv;
+out vec2 v_uv;
+
+void main() {
+    gl_Position = proj.matrix * vec4(rect.xy + in_vert * rect.zw, 0.0, 1.0);
+    v_uv = in_uv;
+}
+"""
+
+CHUNK_FRAGMENT_SHADER = """
+#version 330
+
+uniform sampler2D chunk_texture;
+
+in vec2 v_uv;
+out vec4 f_color;
+
+void main() {
+    f_color = texture(chunk_texture, v_uv);
+}
+"""
+
+COMBINE_VERTEX_SHADER = """
+#version 330
+
+in vec2 in_vert;
+in vec2 in_uv;
+out vec2 v_uv;
+
+void main() {
+    gl_Position = vec4(in_vert, 0.0, 1.0);
+    v_uv = in_uv;
+}
+"""
+
+COMBINE_FRAGMENT_SHADER = """
+#version 330
+
+uniform sampler2D color_texture;
+uniform sampler2D alpha_texture;
+
+in vec2 v_uv;
+out vec4 f_color;
+
+void main() {
+    f_color = vec4(texture(color_texture, v_uv).rgb, texture(alpha_texture, v_uv).a);
+}
+"""
+
+
+TILE_GRID_FRAGMENT_SHADER = """
+#version 330
+
+// Tile index of every cell, row 0 is the top row of the map, 0 is empty
+uniform usampler2D grid;
+// Per tile: (x, y, width, height) in the atlas, (flags, first frame, frames, cycle ms)
+uniform usampler2D tiles;
+// Per animation frame: (tile, duration ms)
+uniform usampler2D frames;
+uniform sampler2D atlas;
+
+// World position of window pixel (0, 0) and world units per window pixel.
+// Which tile covers a pixel is decided with the origin snapped like vertices,
+// where in the tile it samples with the exact one
+uniform vec2 origin;
+uniform vec2 edge_origin;
+uniform float pixel_size;
+// Size of a cell in tile pixels and how many world units one tile pixel is
+uniform vec2 cell_size;
+uniform float scaling;
+uniform float time_ms;
+uniform vec4 color;
+
+out vec4 f_color;
+
+const uint FLIPPED_HORIZONTALLY = 1u;
+const uint FLIPPED_VERTICALLY = 2u;
+const int MAX_FRAMES = 64;
+
+void main() {
+    // Position in tile pixels from the bottom left corner of the map
+    vec2 position = (origin + gl_FragCoord.xy * pixel_size) / scaling;
+    vec2 edge_position = (edge_origin + gl_FragCoord.xy * pixel_size) / scaling;
+    ivec2 grid_size = textureSize(grid, 0);
+    ivec2 cell = ivec2(floor(edge_position / cell_size));
+    if (cell.x < 0 || cell.y < 0 || cell.x >= grid_size.x || cell.y >= grid_size.y) {
+        discard;
+    }
+    uint index = texelFetch(grid, ivec2(cell.x, grid_size.y - 1 - cell.y), 0).r;
+    if (index == 0u) {
+        discard;
+    }
+
+    // Animated tile: the frame for the time, as TileClock counts it
+    uvec4 info = texelFetch(tiles, ivec2(index, 1), 0);
+    if (info.z > 0u) {
+        float t = mod(time_ms, float(info.w));
+        int frame = int(info.y);
+        for (int i = 0; i < MAX_FRAMES && i < int(info.z) - 1; i++) {
+            float duration = float(texelFetch(frames, ivec2(frame, 0), 0).g);
+            if (t <= duration) {
+                break;
+            }
+            t -= duration;
+            frame++;
+        }
+        index = texelFetch(frames, ivec2(frame, 0), 0).r;
+        info = texelFetch(tiles, ivec2(index, 1), 0);
+    }
+    uvec4 rect = texelFetch(tiles, ivec2(index, 0), 0);
+    uint flags = info.x;
+
+    // The tile sits in the bottom left corner of its cell
+    vec2 size = vec2(rect.zw);
+    vec2 edge_local = edge_position - vec2(cell) * cell_size;
+    if (edge_local.x >= size.x || edge_local.y >= size.y) {
+        discard;
+    }
+    vec2 local = position - vec2(cell) * cell_size;
+
+    // Into the image of the tile (y down), undoing the flips
+    vec2 uv = vec2(local.x, size.y - local.y);
+    if ((flags & FLIPPED_VERTICALLY) != 0u) {
+        uv.y = size.y - uv.y;
+    }
+    if ((flags & FLIPPED_HORIZONTALLY) != 0u) {
+        uv.x = size.x - uv.x;
+    }
+    // Не выходим за край тайла: так же, как повторённая рамка в атласе arcade
+    vec2 texel = clamp(vec2(rect.xy) + uv, vec2(rect.xy) + 0.5, vec2(rect.xy + rect.zw) - 0.5);
+
+    vec4 result = texture(atlas, texel / vec2(textureSize(atlas, 0))) * color;
+    if (result.a == 0.0) {
+        discard;
+    }
+    f_color = result;
+}
+"""
+
+
+def _is_animated(sprite_list):
+    for sprite in sprite_list:
+        if getattr(sprite, "frames", None):
+            return True
+    return False
+
+
+class BakedChunk:
+    """One baked texture covering a rectangle of the map."""
+
+    def __init__(self, x, y, width, height, texture, sprite_count):
+        self.x = x
+        self.y = y
+        self.width = width
+        self.height = height
+        self.texture = texture
+        # Сколько спрайтов (по центру) попало в этот кусок - для статистики
+        self.sprite_count = sprite_count
+
+    def overlaps(self, left, bottom, right, top):
+        return (self.x < right and self.x + self.width > left
+                and self.y < top and self.y + self.height > bottom)
+
+
+class BakedBand:
+    """
+    A run of consecutive static layers drawn into fixed-size textures
+    by ``bake_steps()``.
+
+    Sprites are drawn with normal blending, which leaves a premultiplied
+    colour in the target but squares the alpha of half-transparent pixels.
+    A second pass with (ONE, ONE_MINUS_SRC_ALPHA) gives the right alpha, and
+    the two are merged, so the band composites exactly like the live layers.
+    """
+
+    def __init__(self, ctx, names, sprite_lists, width, height, chunk_size, programs):
+        self.ctx = ctx
+        self.names = names
+        self.sprite_lists = sprite_lists
+        self.width = width
+        self.height = height
+        self.chunk_size = chunk_size
+        self.chunks = []
+        # Куски по номеру колонки, чтобы не перебирать всю карту на широких уровнях
+        self.columns = {}
+
+        self._program, self._combine_program = programs
+        self._quad = geometry.quad_2d(size=(1.0, 1.0), pos=(0.5, 0.5))
+
+        # Где вообще есть тайлы - пустые куски не запекаем
+        self.occupied = set()
+        self._counts = {}
+        for sprite_list in sprite_lists:
+            for sprite in sprite_list:
+                center = (int(sprite.center_x // chunk_size), int(sprite.center_y // chunk_size))
+                self._counts[center] = self._counts.get(center, 0) + 1
+                for cx in range(int(max(sprite.left, 0) // chunk_size),
+                                int(max(sprite.right - 1, 0) // chunk_size) + 1):
+                    for cy in range(int(max(sprite.bottom, 0) // chunk_size),
+                                    int(max(sprite.top - 1, 0) // chunk_size) + 1):
+                        self.occupied.add((cx, cy))
+
+        self.sprite_count = sum(len(sprite_list) for sprite_list in sprite_lists)
+
+    def bake_steps(self):
+        """Bake the chunks one by one, yielding after each."""
+        ctx = self.ctx
+        chunk_size = self.chunk_size
+        combine_program = self._combine_program
+
+        color = ctx.texture((chunk_size, chunk_size))
+        alpha = ctx.texture((chunk_size, chunk_size))
+        color_fbo = ctx.framebuffer(color_attachments=[color])
+        alpha_fbo = ctx.framebuffer(color_attachments=[alpha])
+        full_screen = geometry.quad_2d_fs()
+        combine_program["color_texture"] = 0
+        combine_program["alpha_texture"] = 1
+
+        for cx, cy in sorted(self.occupied):
+            x = cx * chunk_size
+            y = cy * chunk_size
+            if x >= self.width or y >= self.height:
+                continue
+            chunk_width = min(chunk_size, self.width - x)
+            chunk_height = min(chunk_size, self.height - y)
+
+            # Между шагами может рисоваться что-то другое, поэтому состояние
+            # контекста восстанавливается после каждого куска
+            old_projection = ctx.projection_2d_matrix
+            try:
+                ctx.projection_2d = (x, x + chunk_size, y, y + chunk_size)
+
+                for fbo, blend in ((color_fbo, ctx.BLEND_DEFAULT),
+                                   (alpha_fbo, (ctx.ONE, ctx.ONE_MINUS_SRC_ALPHA))):
+                    with fbo.activate():
+                        fbo.clear()
+                        for sprite_list in self.sprite_lists:
+                            sprite_list.draw(blend_function=blend)
+
+                texture = ctx.texture((chunk_width, chunk_height),
+                                      filter=(ctx.NEAREST, ctx.NEAREST))
+                target = ctx.framebuffer(color_attachments=[texture])
+                with target.activate():
+                    ctx.disable(ctx.BLEND)
+                    # Кусок может быть меньше буфера у правого и верхнего края карты
+                    ctx.viewport = (0, 0, chunk_size, chunk_size)
+                    color.use(0)
+                    alpha.use(1)
+                    full_screen.render(combine_program)
+                    ctx.enable(ctx.BLEND)
+            finally:
+                ctx.projection_2d_matrix = old_projection
+                ctx.blend_func = ctx.BLEND_DEFAULT
+
+            chunk = BakedChunk(x, y, chunk_width, chunk_height, texture,
+                               self._counts.get((cx, cy), 0))
+            self.chunks.append(chunk)
+            self.columns.setdefault(chunk.x // chunk_size, []).append(chunk)
+            yield chunk
+
+    def draw(self, ctx, left, bottom, right, top):
+        """
+        Draw the chunks that overlap the given rectangle.
+        Returns the number of chunks drawn and the number of sprites in them.
+        """
+        drawn = 0
+        visible = 0
+        ctx.blend_func = ctx.ONE, ctx.ONE_MINUS_SRC_ALPHA
+        for index in range(int(left // self.chunk_size), int(right // self.chunk_size) + 1):
+            for chunk in self.columns.get(index, ()):
+                if not chunk.overlaps(left, bottom, right, top):
+                    continue
+                chunk.texture.use(0)
+                self._program["rect"] = chunk.x, chunk.y, chunk.width, chunk.height
+                self._quad.render(self._program)
+                drawn += 1
+                visible += chunk.sprite_count
+        ctx.blend_func = ctx.BLEND_DEFAULT
+        return drawn, visible
+
+
+class ChunkedLayer:
+    """
+    A SpriteList split into column chunks by sprite center.
+
+    The chunks are extra draw-only SpriteLists holding the same sprites, so
+    collisions still use the original list, and ``remove_from_sprite_lists``
+    takes a sprite out of its chunk too. Sprites must not move between
+    columns; moving layers are drawn whole.
+    """
+
+    def __init__(self, sprite_list, chunk_width=CULL_CHUNK_WIDTH, margin=CULL_MARGIN):
+        self.sprite_list = sprite_list
+        self.chunk_width = chunk_width
+        self.columns = {}
+
+        # Широкий спрайт может торчать из своей колонки на половину ширины
+        widest = max((sprite.width for sprite in sprite_list), default=0)
+        self.margin = margin + widest / 2
+
+        for sprite in sprite_list:
+            self.add(sprite)
+
+    def add(self, sprite):
+        """Put a sprite into its column chunk (it must already be in the layer)."""
+        index = int(sprite.center_x // self.chunk_width)
+        column = self.columns.get(index)
+        if column is None:
+            column = arcade.SpriteList()
+            self.columns[index] = column
+        column.append(sprite)
+
+    def draw(self, left, right):
+        """
+        Draw the columns in view.
+        Returns the number of columns drawn, visible and culled sprite counts.
+        """
+        if not self.sprite_list.visible:
+            return 0, 0, 0
+        drawn = 0
+        visible = 0
+        first = int((left - self.margin) // self.chunk_width)
+        last = int((right + self.margin) // self.chunk_width)
+        for index in range(first, last + 1):
+            column = self.columns.get(index)
+            if column:
+                column.draw()
+                drawn += 1
+                visible += len(column)
+        return drawn, visible, len(self.sprite_list) - visible
+
+
+def _tile_size(tile):
+    width, height, flags = tile[3], tile[4], tile[5]
+    if flags & TILE_FLIPPED_DIAGONALLY:
+        return height, width
+    return width, height
+
+
+class TileGridLayer:
+    """
+    A tile layer drawn from its tile grid: the tile indices, the tile table
+    and the atlas page are textures, and one quad over the part of the map
+    that has tiles draws the whole layer, a fragment shader finds the tile
+    and the texel of every pixel. Animations are picked by the time, scrolling comes from the
+    camera, nothing is baked.
+
+    Tiles bigger than a cell and rotated tiles are kept as sprites and
+    drawn after the grid (a rotated tile samples differently enough to be
+    off by one in a colour channel).
+    Use ``tile_grid_layer()`` to build one, it says when a layer can't be
+    drawn this way. The sprite list is only read for the layer style.
+    """
+
+    def __init__(self, ctx, sprite_list, tile_map, grid, overflow, atlas_path, program):
+        self.ctx = ctx
+        self.sprite_list = sprite_list
+        self.overflow = overflow
+        self._program = program
+        self._quad = geometry.quad_2d(size=(1.0, 1.0), pos=(0.5, 0.5))
+        self.width = tile_map.width
+        self.height = tile_map.height
+        self.tile_width = tile_map.tile_width
+        self.tile_height = tile_map.tile_height
+        self.scaling = tile_map.scaling
+
+        self.grid_texture = ctx.texture((self.width, self.height), components=1, dtype="u4",
+                                        data=array("I", grid).tobytes())
+
+        # Строка 0 - прямоугольник в атласе, строка 1 - флаги и анимация
+        tiles = tile_map.tiles
+        frames = tile_map.frames
+        rects = array("I", [0, 0, 0, 0])
+        infos = array("I", [0, 0, 0, 0])
+        for tile in tiles:
+            _path, x, y, width, height, flags, _first, _count, first_frame, frame_count = tile
+            cycle = sum(duration for _index, duration in frames[first_frame:first_frame + frame_count])
+            rects.extend((x, y, width, height))
+            infos.extend((flags, first_frame, frame_count if cycle else 0, cycle))
+        self.tile_texture = ctx.texture((len(tiles) + 1, 2), components=4, dtype="u4",
+                                        data=(rects + infos).tobytes())
+        frame_data = array("I")
+        for index, duration in frames:
+            frame_data.extend((index, duration))
+        self.frame_texture = ctx.texture((max(len(frames), 1), 1), components=2, dtype="u4",
+                                         data=(frame_data or array("I", [0, 0])).tobytes())
+        for texture in (self.grid_texture, self.tile_texture, self.frame_texture):
+            texture.filter = ctx.NEAREST, ctx.NEAREST
+
+        image = asset_manager.image(atlas_path)
+        self.atlas_texture = ctx.texture(image.size, components=4, data=image.tobytes())
+        self.atlas_texture.filter = ctx.LINEAR, ctx.LINEAR
+
+        # Сколько тайлов в каждой колонке - для статистики видимых спрайтов
+        self.column_counts = [0] * self.width
+        rows = []
+        for position, index in enumerate(grid):
+            if index:
+                self.column_counts[position % self.width] += 1
+                rows.append(position // self.width)
+        self.sprite_count = sum(self.column_counts) + len(overflow)
+
+        # Квад только над клетками с тайлами: пустые края карты шейдер не считает
+        cell_width = self.tile_width * self.scaling
+        cell_height = self.tile_height * self.scaling
+        columns = [column for column, count in enumerate(self.column_counts) if count]
+        if columns:
+            self.rect = (columns[0] * cell_width, (self.height - 1 - max(rows)) * cell_height,
+                         (columns[-1] + 1 - columns[0]) * cell_width,
+                         (max(rows) + 1 - min(rows)) * cell_height)
+        else:
+            self.rect = None
+
+    def draw(self, left, bottom, scale, time):
+        """
+        Draw the layer for a camera at (``left``, ``bottom``), ``time`` in
+        seconds drives the animations. Returns the number of draw calls,
+        visible and culled tile counts.
+        """
+        if not self.sprite_list.visible:
+            return 0, 0, 0
+        sprite = self.sprite_list[0]
+        program = self._program
+        program["rect"] = self.rect or (0.0, 0.0, 0.0, 0.0)
+        program["origin"] = left, bottom
+        program["edge_origin"] = (round(left / scale * SUBPIXEL_STEPS) / SUBPIXEL_STEPS * scale,
+                                  round(bottom / scale * SUBPIXEL_STEPS) / SUBPIXEL_STEPS * scale)
+        program["pixel_size"] = scale
+        program["cell_size"] = self.tile_width, self.tile_height
+        program["scaling"] = self.scaling
+        program["time_ms"] = time * 1000.0
+        program["color"] = (*(channel / 255 for channel in sprite.color[:3]), sprite.alpha / 255)
+        self.grid_texture.use(0)
+        self.tile_texture.use(1)
+        self.frame_texture.use(2)
+        self.atlas_texture.use(3)
+        self.ctx.blend_func = self.ctx.BLEND_DEFAULT
+        self._quad.render(program)
+        draw_calls = 1
+        if self.overflow:
+            self.overflow.draw()
+            draw_calls += 1
+
+        cell = self.tile_width * self.scaling
+        first = max(int(left // cell), 0)
+        last = min(int((left + self.ctx.viewport[2] * scale) // cell), self.width - 1)
+        visible = sum(self.column_counts[first:last + 1]) + len(self.overflow)
+        return draw_calls, visible, self.sprite_count - visible
+
+
+def tile_grid_layer(ctx, name, sprite_list, tile_map, program):
+    """
+    A TileGridLayer for the tile layer ``name`` of a BundleTileMap, or None
+    when it has to stay sprites: the map has no tile grids, the tiles are
+    on several atlas pages, or a big tile would end up under a neighbour
+    that the sprites draw before it.
+    """
+    grids = getattr(tile_map, "tile_grids", None)
+    if not grids or name not in grids:
+        return None
+    grid = array("I", grids[name])
+    width = tile_map.width
+    tiles = tile_map.tiles
+    frames = tile_map.frames
+    if len(grid) != width * tile_map.height or sum(1 for index in grid if index) != len(sprite_list):
+        return None
+
+    def fits(index):
+        tile_width, tile_height = _tile_size(tiles[index - 1])
+        return tile_width <= tile_map.tile_width and tile_height <= tile_map.tile_height
+
+    pages = set()
+    big = {}
+    # Сколько клеток вправо занимает большой тайл (с кадрами анимации)
+    spans = {}
+    for index in set(grid):
+        if not index:
+            continue
+        tile = tiles[index - 1]
+        used = [index] + [frame for frame, _duration in frames[tile[8]:tile[8] + tile[9]]]
+        pages.update(tiles[other - 1][0] for other in used)
+        # Кадры разного размера спрайт растягивает вокруг центра, а не от угла клетки
+        big[index] = (not all(fits(other) for other in used)
+                      or any(tiles[other - 1][5] & TILE_FLIPPED_DIAGONALLY for other in used)
+                      or len({_tile_size(tiles[other - 1]) for other in used}) > 1)
+        widest = max(_tile_size(tiles[other - 1])[0] for other in used)
+        spans[index] = -(-widest // tile_map.tile_width)
+    if len(pages) != 1:
+        return None
+
+    # Большие тайлы рисуются спрайтами поверх сетки, в том же порядке, что и раньше.
+    # Спрайты идут строками сверху вниз, так что позже большого тайла рисуются
+    # только клетки справа от него в той же строке - там сетка должна быть пустой
+    overflow = arcade.SpriteList()
+    sprites = iter(sprite_list)
+    for position, index in enumerate(grid):
+        if not index:
+            continue
+        sprite = next(sprites)
+        if not big[index]:
+            continue
+        row, column = divmod(position, width)
+        for other in grid[position + 1:row * width + min(column + spans[index], width)]:
+            if other and not big[other]:
+                return None
+        overflow.append(sprite)
+        grid[position] = 0
+
+    return TileGridLayer(ctx, sprite_list, tile_map, grid, overflow, pages.pop(), program)
+
+
+class SceneRenderer:
+    """
+    Draws a Scene in layer order. Runs of static layers are baked once,
+    layers listed in ``live_layers``, animated and hidden layers are drawn
+    live, in column chunks near the camera. Layers listed in
+    ``moving_layers`` are drawn whole.
+
+    With a ``tile_map`` that has tile grids (a BundleTileMap), the static
+    and animated tile layers that TileGridLayer can draw are drawn from
+    their grids instead of being baked or drawn as sprites.
+    """
+
+    def __init__(self, scene, width, height, live_layers=(), moving_layers=(),
+                 chunk_size=STATIC_CHUNK_SIZE, defer_bake=False, tile_map=None):
+        self.scene = scene
+        self.ctx = arcade.get_window().ctx
+
+        self._programs = (
+            self.ctx.program(vertex_shader=CHUNK_VERTEX_SHADER,
+                             fragment_shader=CHUNK_FRAGMENT_SHADER),
+            self.ctx.program(vertex_shader=COMBINE_VERTEX_SHADER,
+                             fragment_shader=COMBINE_FRAGMENT_SHADER),
+        )
+        grid_program = None
+        if tile_map is not None:
+            grid_program = self.ctx.program(vertex_shader=CHUNK_VERTEX_SHADER,
+                                            fragment_shader=TILE_GRID_FRAGMENT_SHADER)
+            grid_program["grid"] = 0
+            grid_program["tiles"] = 1
+            grid_program["frames"] = 2
+            grid_program["atlas"] = 3
+
+        # План отрисовки: либо запечённая пачка слоёв, либо живой SpriteList
+        self.plan = []
+        run_names = []
+        run_lists = []
+
+        def close_run():
+            if run_lists:
+                self.plan.append(BakedBand(self.ctx, list(run_names), list(run_lists),
+                                           width, height, chunk_size, self._programs))
+                run_names.clear()
+                run_lists.clear()
+
+        names = {id(sprite_list): name for name, sprite_list in scene.name_mapping.items()}
+        for sprite_list in scene.sprite_lists:
+            name = names.get(id(sprite_list))
+            grid_layer = None
+            if (grid_program is not None and name not in moving_layers
+                    and name not in live_layers and sprite_list.visible and len(sprite_list)):
+                grid_layer = tile_grid_layer(self.ctx, name, sprite_list, tile_map, grid_program)
+            if grid_layer is not None:
+                close_run()
+                self.plan.append(grid_layer)
+            elif name in moving_layers:
+                close_run()
+                self.plan.append(sprite_list)
+            elif (name in live_layers or not sprite_list.visible
+                    or _is_animated(sprite_list)):
+                close_run()
+                self.plan.append(ChunkedLayer(sprite_list))
+            elif len(sprite_list):
+                run_names.append(name)
+                run_lists.append(sprite_list)
+        close_run()
+
+        # Статистика последнего кадра
+        self.draw_calls = 0
+        self.visible_sprites = 0
+        self.culled_sprites = 0
+
+        if not defer_bake:
+            for _chunk in self.bake_steps():
+                pass
+
+    def bake_steps(self):
+        """
+        Bake the static layers one chunk at a time, yielding after each.
+        Only needed with ``defer_bake=True``, chunks not yet baked are not drawn.
+        """
+        for item in self.plan:
+            if isinstance(item, BakedBand):
+                yield from item.bake_steps()
+
+    @property
+    def baked_layers(self):
+        return [name for item in self.plan if isinstance(item, BakedBand)
+                for name in item.names]
+
+    def chunked_layer(self, sprite_list):
+        """The ChunkedLayer drawing ``sprite_list``, if there is one."""
+        for item in self.plan:
+            if isinstance(item, ChunkedLayer) and item.sprite_list is sprite_list:
+                return item
+        return None
+
+    @property
+    def grid_layers(self):
+        return [item for item in self.plan if isinstance(item, TileGridLayer)]
+
+    def draw(self, camera, time=0.0):
+        """
+        Draw the scene as seen by ``camera`` (after ``camera.use()``).
+        ``time`` in seconds drives the animations of tile grid layers.
+        """
+        left, bottom = camera.position
+        right = left + camera.viewport_width * camera.scale
+        top = bottom + camera.viewport_height * camera.scale
+
+        draw_calls = 0
+        visible = 0
+        culled = 0
+        for item in self.plan:
+            if isinstance(item, BakedBand):
+                chunks, sprites = item.draw(self.ctx, left, bottom, right, top)
+                draw_calls += chunks
+                visible += sprites
+                culled += item.sprite_count - sprites
+            elif isinstance(item, TileGridLayer):
+                calls, sprites, hidden = item.draw(left, bottom, camera.scale, time)
+                draw_calls += calls
+                visible += sprites
+                culled += hidden
+            elif isinstance(item, ChunkedLayer):
+                columns, sprites, hidden = item.draw(left, right)
+                draw_calls += columns
+                visible += sprites
+                culled += hidden
+            elif item.visible and len(item):
+                item.draw()
+                draw_calls += 1
+                visible += len(item)
+
+        self.draw_calls = draw_calls
+        self.visible_sprites = visible
+        self.culled_sprites = culled
+
+
+class StreamRenderer:
+    """
+    Draws a streamed level (streaming.LevelStream) in the order of
+    ``layer_names``: tile layers from the SpriteLists of the built chunks
+    near the camera, the other layers of ``scene`` (moving platforms, the
+    player) whole. Nothing is baked, chunks come and go too often.
+    """
+
+    def __init__(self, stream, scene, layer_names, margin=CULL_MARGIN):
+        self.stream = stream
+        self.scene = scene
+        self.layer_names = layer_names
+        self.margin = margin
+        self._tile_layers = set(stream.layer_names)
+
+        # Статистика последнего кадра
+        self.draw_calls = 0
+        self.visible_sprites = 0
+        self.culled_sprites = 0
+
+    def chunked_layer(self, sprite_list):
+        """Chunk SpriteLists are drawn as they are, there is nothing to update."""
+        return None
+
+    def draw(self, camera, time=0.0):
+        """Draw the level as seen by ``camera`` (after ``camera.use()``)."""
+        stream = self.stream
+        left, _bottom = camera.position
+        right = left + camera.viewport_width * camera.scale
+        # Тайлы торчат из своего куска вправо, поэтому слева берём запас шире
+        first = int((left - self.margin - stream.widest) // stream.chunk_width)
+        last = int((right + self.margin) // stream.chunk_width)
+        chunks = [stream.chunks[index] for index in range(first, last + 1) if index in stream.chunks]
+
+        draw_calls = 0
+        visible = 0
+        for name in self.layer_names:
+            if name in self._tile_layers:
+                sprite_lists = [chunk.sprite_lists[name] for chunk in chunks]
+            else:
+                sprite_lists = [self.scene[name]] if name in self.scene.name_mapping else []
+            for sprite_list in sprite_lists:
+                if sprite_list.visible and len(sprite_list):
+                    sprite_list.draw()
+                    draw_calls += 1
+                    visible += len(sprite_list)
+
+        self.draw_calls = draw_calls
+        self.visible_sprites = visible
+        self.culled_sprites = stream.sprite_count - sum(chunk.sprite_count for chunk in chunks)
@@ -0,0 +1,196 @@
+"""
+Recording and replaying player input.
+
+Every key and joystick event is stored with the number of the simulation
+tick it arrived before. Fed back into a GameSession at the same ticks it
+gives the same player path and score, since the game logic runs in fixed
+ticks (timestep.py).
+
+    python replay.py replays/level_3_20261018_120000.rpl   # replay headless and check the result
+"""
+import argparse
+import struct
+import sys
+
+# magic, version, level, heals, tick rate, event count
+HEADER = struct.Struct("<4sHHHHI")
+# tick, kind
+EVENT = struct.Struct("<IB")
+
+REPLAY_MAGIC = b"RPLY"
+REPLAY_VERSION = 2
+REPLAY_SUFFIX = ".rpl"
+
+KEY_PRESS = 0
+KEY_RELEASE = 1
+JOYBUTTON_PRESS = 2
+JOYBUTTON_RELEASE = 3
+JOYAXIS_MOTION = 4
+# Последняя запись: чем закончилась сессия, для проверки повтора
+END = 5
+
+# Payload of each kind of event. The axis of JOYAXIS_MOTION is a name
+# ("x", "rx", "hat_x"), its length here is followed by the name itself.
+PAYLOAD = {
+    KEY_PRESS: struct.Struct("<I"),
+    KEY_RELEASE: struct.Struct("<I"),
+    JOYBUTTON_PRESS: struct.Struct("<B"),
+    JOYBUTTON_RELEASE: struct.Struct("<B"),
+    JOYAXIS_MOTION: struct.Struct("<dB"),
+    # score, heals, player x, player y
+    END: struct.Struct("<hhdd"),
+}
+
+
+class InputRecorder:
+    """
+    Passes input on to a GameSession and remembers it. Has the same input
+    methods as the session, so GameView can send input to either.
+    """
+
+    def __init__(self, session, tick_rate):
+        self.session = session
+        self.tick_rate = tick_rate
+        self.level = session.level
+        self.heals = session.heals
+        self.events = []
+
+    def _add(self, kind, *payload):
+        self.events.append((self.session.ticks, kind, payload))
+
+    def key_press(self, key):
+        self._add(KEY_PRESS, key)
+        self.session.key_press(key)
+
+    def key_release(self, key):
+        self._add(KEY_RELEASE, key)
+        self.session.key_release(key)
+
+    def joybutton_press(self, button):
+        self._add(JOYBUTTON_PRESS, button)
+        self.session.joybutton_press(button)
+
+    def joybutton_release(self, button):
+        self._add(JOYBUTTON_RELEASE, button)
+        self.session.joybutton_release(button)
+
+    def joyaxis_motion(self, axis, value):
+        self._add(JOYAXIS_MOTION, value, axis)
+        self.session.joyaxis_motion(axis, value)
+
+    def save(self, path):
+        """Write the recording, ending with the current state of the session."""
+        session = self.session
+        x, y = session.player_sprite.position
+        events = self.events + [(session.ticks, END, (session.score, session.heals, x, y))]
+        # Сначала весь файл в памяти: ошибка не должна оставить обрезанный повтор
+        data = bytearray(HEADER.pack(REPLAY_MAGIC, REPLAY_VERSION, self.level, self.heals,
+                                     self.tick_rate, len(events)))
+        for tick, kind, payload in events:
+            data += EVENT.pack(tick, kind)
+            if kind == JOYAXIS_MOTION:
+                value, axis = payload
+                name = axis.encode("utf-8")
+                data += PAYLOAD[kind].pack(value, len(name)) + name
+            else:
+                data += PAYLOAD[kind].pack(*payload)
+        with open(path, "wb") as file:
+            file.write(data)
+
+
+class InputReplay:
+    """
+    A recording loaded from a file. Call it before every tick, as
+    ``replay(session, tick)``, to apply the events of that tick.
+    """
+
+    def __init__(self, path):
+        with open(path, "rb") as file:
+            data = file.read()
+
+        magic, version, self.level, self.heals, self.tick_rate, count = HEADER.unpack_from(data, 0)
+        if magic != REPLAY_MAGIC or version != REPLAY_VERSION:
+            raise ValueError(f"'{path}' is not a replay of version {REPLAY_VERSION}")
+
+        self.events = []
+        self.end = None
+        self.end_tick = 0
+        offset = HEADER.size
+        for _ in range(count):
+            tick, kind = EVENT.unpack_from(data, offset)
+            offset += EVENT.size
+            payload = PAYLOAD[kind].unpack_from(data, offset)
+            offset += PAYLOAD[kind].size
+            if kind == JOYAXIS_MOTION:
+                value, length = payload
+                payload = (data[offset:offset + length].decode("utf-8"), value)
+                offset += length
+            if kind == END:
+                self.end = payload
+                self.end_tick = tick
+            else:
+                self.events.append((tick, kind, payload))
+        self._next = 0
+
+    @property
+    def finished(self):
+        """True when every event was applied."""
+        return self._next >= len(self.events)
+
+    def __call__(self, session, _tick=None):
+        while not self.finished and self.events[self._next][0] <= session.ticks:
+            _tick, kind, payload = self.events[self._next]
+            self._next += 1
+            if kind == KEY_PRESS:
+                session.key_press(*payload)
+            elif kind == KEY_RELEASE:
+                session.key_release(*payload)
+            elif kind == JOYBUTTON_PRESS:
+                session.joybutton_press(*payload)
+            elif kind == JOYBUTTON_RELEASE:
+                session.joybutton_release(*payload)
+            elif kind == JOYAXIS_MOTION:
+                session.joyaxis_motion(*payload)
+
+    def mismatches(self, session):
+        """Differences between how the recorded session ended and ``session``, empty if none."""
+        if self.end is None:
+            return []
+        score, heals, x, y = self.end
+        expected = {"ticks": self.end_tick, "score": score, "heals": heals, "position": (x, y)}
+        actual = {"ticks": session.ticks, "score": session.score, "heals": session.heals,
+                  "position": tuple(session.player_sprite.position)}
+        return [f"{key}: recorded {expected[key]}, replayed {actual[key]}"
+                for key in expected if expected[key] != actual[key]]
+
+
+def replay_headless(path):
+    """Run a recording without a window. Returns the replay and the session."""
+    from game import GameSession
+    from headless import run
+
+    replay = InputReplay(path)
+    session = GameSession.load(replay.level, replay.heals)
+    run(session, replay.end_tick, bot=replay, tick_rate=replay.tick_rate)
+    return replay, session
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded input without a window")
+    parser.add_argument("replays", nargs="+", help="recorded .rpl files")
+    args = parser.parse_args()
+
+    failed = 0
+    for path in args.replays:
+        replay, session = replay_headless(path)
+        problems = replay.mismatches(session)
+        print(f"{path}: level {replay.level}, {len(replay.events)} events, "
+              f"{session.ticks} ticks - {'OK' if not problems else 'MISMATCH'}")
+        for problem in problems:
+            print(f"    {problem}")
+        failed += bool(problems)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,134 @@
+"""
+Rewind: the last seconds of a level kept as compressed state frames
+"""
+import sys
+import time
+import zlib
+from collections import deque
+
+
+# How far back the game can be rewound, in seconds
+REWIND_SECONDS = 30
+
+# Memory the frames may take, in bytes. The oldest frames are dropped first
+REWIND_BUDGET = 2 * 1024 * 1024
+
+# Every this many frames one is stored whole, the rest as a difference to it
+KEYFRAME_INTERVAL = 60
+
+# zlib level: frames are tiny and encoded every tick, speed matters more
+COMPRESS_LEVEL = 1
+
+
+def _xor(frame, key):
+    """Byte-wise XOR of two frames of the same length."""
+    size = len(frame)
+    return (int.from_bytes(frame, "little") ^ int.from_bytes(key, "little")).to_bytes(size, "little")
+
+
+def pack_bits(flags):
+    """A sequence of 0/1 as a bitset, 8 flags per byte."""
+    bits = bytearray((len(flags) + 7) // 8)
+    for index, flag in enumerate(flags):
+        if flag:
+            bits[index >> 3] |= 1 << (index & 7)
+    return bytes(bits)
+
+
+def unpack_bits(bits, count):
+    return bytes((bits[index >> 3] >> (index & 7)) & 1 for index in range(count))
+
+
+class RewindBuffer:
+    """
+    Ring buffer of per-tick state frames (bytes, mostly of the same length).
+
+    Frames are grouped: the first of a group is a keyframe, compressed as
+    is, the others are XORed with the keyframe before compressing. Between
+    two ticks little changes, so a delta is mostly zero bytes and packs
+    into a few dozen. A frame of another length than its keyframe starts a
+    new group. When the buffer holds more than ``max_frames`` frames
+    or ``budget`` bytes, whole groups are dropped from the old end.
+    """
+
+    def __init__(self, max_frames, budget=REWIND_BUDGET, keyframe_interval=KEYFRAME_INTERVAL):
+        self.max_frames = max_frames
+        self.budget = budget
+        self.keyframe_interval = keyframe_interval
+
+        # [keyframe, [delta, ...]], compressed, the newest group last
+        self.groups = deque()
+        self.frames = 0
+        # Compressed frames with their Python object headers
+        self.bytes_used = 0
+
+        # Несжатый ключевой кадр последней группы, от него считаются разницы
+        self._key = None
+
+        # Encoding cost, for the reports
+        self.encode_time = 0.0
+        self.encoded = 0
+
+    @staticmethod
+    def _size(blob):
+        return sys.getsizeof(blob)
+
+    def push(self, frame):
+        """Add the newest frame."""
+        start = time.perf_counter()
+        group = self.groups[-1] if self.groups else None
+        if (group is None or len(group[1]) + 1 >= self.keyframe_interval
+                or len(frame) != len(self._key)):
+            blob = zlib.compress(frame, COMPRESS_LEVEL)
+            self.groups.append([blob, []])
+            self._key = frame
+        else:
+            blob = zlib.compress(_xor(frame, self._key), COMPRESS_LEVEL)
+            group[1].append(blob)
+        self.frames += 1
+        self.bytes_used += self._size(blob)
+
+        # Старые группы уходят целиком: без ключевого кадра разницы не прочесть
+        while len(self.groups) > 1 and (self.frames > self.max_frames
+                                        or self.bytes_used > self.budget):
+            key, deltas = self.groups.popleft()
+            self.frames -= 1 + len(deltas)
+            self.bytes_used -= self._size(key) + sum(self._size(delta) for delta in deltas)
+
+        self.encode_time += time.perf_counter() - start
+        self.encoded += 1
+
+    def _drop_newest(self):
+        key, deltas = self.groups[-1]
+        if deltas:
+            self.bytes_used -= self._size(deltas.pop())
+        else:
+            self.groups.pop()
+            self.bytes_used -= self._size(key)
+            self._key = zlib.decompress(self.groups[-1][0]) if self.groups else None
+        self.frames -= 1
+
+    def newest(self):
+        """The newest frame, decoded, or None if the buffer is empty."""
+        if not self.groups:
+            return None
+        _key, deltas = self.groups[-1]
+        if not deltas:
+            return self._key
+        return _xor(zlib.decompress(deltas[-1]), self._key)
+
+    def step_back(self):
+        """
+        Forget the newest frame (the state the game is in now) and return
+        the one before it, which stays in the buffer. None when there is
+        nothing older.
+        """
+        if self.frames < 2:
+            return None
+        self._drop_newest()
+        return self.newest()
+
+    @property
+    def encode_us(self):
+        """Mean time to encode one frame, in microseconds."""
+        return self.encode_time / self.encoded * 1e6 if self.encoded else 0.0
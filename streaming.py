@@ -0,0 +1,454 @@
+"""
+Streamed levels: the map is cut into chunks of columns that are built
+from the level bundle when the camera comes near and dropped when they
+are far behind, so the memory a level takes depends on the view distance,
+not on the width of the map. A level can also go on past its own width
+(its columns repeat) or have no end at all.
+
+    python streaming.py bench                         # level 1 repeated to 10000 columns
+    python streaming.py bench --level 3 --columns 2000
+"""
+import argparse
+import math
+import sys
+import time
+import tracemalloc
+from collections import OrderedDict
+
+from collision import TRIGGER_ALL, TRIGGER_DAMAGE, TileGrid, TriggerMap, polygons_intersect
+
+
+# Width of a chunk in map columns
+STREAM_CHUNK_COLUMNS = 16
+
+# Chunks this far beyond the edges of the view, in pixels, are built ahead of time
+STREAM_DISTANCE = 1024
+
+# Chunks built ahead of the camera per update; the ones in view are built at once
+STREAM_LOADS_PER_UPDATE = 1
+
+# Built chunks kept out of range in case the player turns back
+STREAM_CACHE_CHUNKS = 4
+
+
+class LevelChunk:
+    """The tiles of ``columns`` columns from ``first_column`` on: a SpriteList per tile layer."""
+
+    def __init__(self, index, first_column, columns, sprite_lists):
+        self.index = index
+        self.first_column = first_column
+        self.columns = columns
+        self.sprite_lists = sprite_lists
+
+    @property
+    def sprite_count(self):
+        return sum(len(sprite_list) for sprite_list in self.sprite_lists.values())
+
+
+class LevelStream:
+    """
+    The chunks of a level that are built now, in ``chunks`` by index, the
+    least recently needed first.
+
+    ``update(left, right)`` builds the chunks in view at once and the ones
+    within ``distance`` of it ``loads_per_update`` at a time, nearest
+    first, then drops the chunks out of range beyond ``cache`` of them.
+    Whatever indexes the tiles (collision grids, triggers, animation)
+    follows through the ``on_load`` and ``on_unload`` callbacks, which get
+    the chunk.
+
+    ``tile_map`` is a BundleTileMap after build_objects(). Column c of the
+    level is column ``source_column(c)`` of the bundle (None for an empty
+    column), by default the bundle repeats. ``width`` is the width of the
+    level in columns, None for no end.
+    """
+
+    def __init__(self, tile_map, width=None, source_column=None,
+                 chunk_columns=STREAM_CHUNK_COLUMNS, distance=STREAM_DISTANCE,
+                 cache=STREAM_CACHE_CHUNKS, loads_per_update=STREAM_LOADS_PER_UPDATE):
+        self.tile_map = tile_map
+        self.width = width
+        self.height = tile_map.height
+        self.source_column = source_column or (lambda column: column % tile_map.width)
+        self.chunk_columns = chunk_columns
+        self.cell_size = tile_map.tile_width * tile_map.scaling
+        self.chunk_width = chunk_columns * self.cell_size
+        self.distance = distance
+        self.cache = cache
+        self.loads_per_update = loads_per_update
+        self.layer_names = tile_map.tile_layer_names
+        self.chunks = OrderedDict()
+        # Диапазоны прошлого update() и всё ли в них построено
+        self._ranges = None
+        self._complete = False
+        self.on_load = []
+        self.on_unload = []
+
+        # Тайл торчит из своей колонки вправо и вверх не больше, чем на свой размер
+        self.widest = max((tile[3] for tile in tile_map.tiles), default=0) * tile_map.scaling
+
+        # For the reports
+        self.loads = 0
+        self.unloads = 0
+        self.build_time = 0.0
+        self.peak_chunks = 0
+
+    @property
+    def pixel_width(self):
+        """Width of the level in pixels, infinite for a level with no end."""
+        return math.inf if self.width is None else self.width * self.cell_size
+
+    @property
+    def sprite_count(self):
+        return sum(chunk.sprite_count for chunk in self.chunks.values())
+
+    def _range(self, left, right):
+        first = max(math.floor(left / self.chunk_width), 0)
+        last = math.floor(right / self.chunk_width)
+        if self.width is not None:
+            last = min(last, (self.width - 1) // self.chunk_columns)
+        return range(first, last + 1)
+
+    def update(self, left, right):
+        """Build and drop chunks for a view from ``left`` to ``right``. Returns the number built."""
+        chunks = self.chunks
+        built = 0
+        # Слева тайлы соседнего куска могут заходить в вид
+        needed = self._range(left - self.widest, right)
+        ahead = self._range(left - self.widest - self.distance, right + self.distance)
+        if self._complete and self._ranges == (needed, ahead):
+            return 0
+        for index in needed:
+            if index in chunks:
+                chunks.move_to_end(index)
+            else:
+                self._load(index)
+                built += 1
+
+        budget = self.loads_per_update
+        # Сначала ближайшие к виду
+        for index in sorted(ahead, key=lambda index: max(needed.start - index, index - needed.stop + 1)):
+            if index in chunks:
+                chunks.move_to_end(index)
+            elif budget:
+                self._load(index)
+                built += 1
+                budget -= 1
+
+        # Нужные куски стоят в конце, впереди - те, что давно вышли из вида
+        keep = sum(1 for index in ahead if index in chunks) + self.cache
+        while len(chunks) > keep:
+            self._unload(next(iter(chunks)))
+        self.peak_chunks = max(self.peak_chunks, len(chunks))
+        self._ranges = needed, ahead
+        self._complete = all(index in chunks for index in ahead)
+        return built
+
+    def _load(self, index):
+        start = time.perf_counter()
+        first = index * self.chunk_columns
+        count = self.chunk_columns
+        if self.width is not None:
+            count = min(count, self.width - first)
+        columns = []
+        for column in range(first, first + count):
+            source = self.source_column(column)
+            if source is not None:
+                columns.append((column, source))
+        sprite_lists = OrderedDict((name, self.tile_map.tile_columns(name, columns))
+                                   for name in self.layer_names)
+        chunk = LevelChunk(index, first, count, sprite_lists)
+        self.chunks[index] = chunk
+        for callback in self.on_load:
+            callback(chunk)
+        self.loads += 1
+        self.build_time += time.perf_counter() - start
+
+    def _unload(self, index):
+        chunk = self.chunks.pop(index)
+        for callback in self.on_unload:
+            callback(chunk)
+        self.unloads += 1
+
+    def listen(self, on_load, on_unload):
+        """Add a pair of callbacks and call ``on_load`` for the chunks already built."""
+        self.on_load.append(on_load)
+        self.on_unload.append(on_unload)
+        for chunk in self.chunks.values():
+            on_load(chunk)
+
+
+def _horizontal_bounds(points):
+    left = right = points[0][0]
+    for x, _y in points:
+        if x < left:
+            left = x
+        elif x > right:
+            right = x
+    return left, right
+
+
+class StreamedGrid:
+    """
+    A TileGrid per built chunk of the layers ``names``, asked like one
+    TileGrid. A query looks at the grids whose tiles reach the columns
+    under the sprite: the chunks there and neighbours with tiles sticking
+    out of them.
+    """
+
+    def __init__(self, stream, names, merge=False):
+        self.stream = stream
+        self.names = names
+        self.merge = merge
+        self.grids = {}
+        # chunk index -> first and last column its tiles cover
+        self.reach = {}
+        stream.listen(self.chunk_loaded, self.chunk_unloaded)
+
+    def chunk_loaded(self, chunk):
+        sprite_lists = [chunk.sprite_lists[name] for name in self.names if name in chunk.sprite_lists]
+        grid = TileGrid(sprite_lists, chunk.columns, self.stream.height,
+                        self.stream.cell_size, self.merge, chunk.first_column)
+        columns = [column for column, _row in grid.overflow]
+        columns += [chunk.first_column, chunk.first_column + chunk.columns - 1]
+        self.grids[chunk.index] = grid
+        self.reach[chunk.index] = min(columns), max(columns)
+
+    def chunk_unloaded(self, chunk):
+        del self.grids[chunk.index]
+        del self.reach[chunk.index]
+
+    @property
+    def tile_count(self):
+        return sum(grid.tile_count for grid in self.grids.values())
+
+    @property
+    def body_count(self):
+        return sum(grid.body_count for grid in self.grids.values())
+
+    def _grids(self, sprite):
+        left, right = _horizontal_bounds(sprite.get_adjusted_hit_box())
+        size = self.stream.cell_size
+        first = math.floor(left / size)
+        last = math.floor(right / size)
+        chunk_columns = self.stream.chunk_columns
+        grids = []
+        reach = self.reach
+        for index in range(first // chunk_columns - 1, last // chunk_columns + 2):
+            columns = reach.get(index)
+            if columns is not None and columns[0] <= last and first <= columns[1]:
+                grids.append(self.grids[index])
+        return grids
+
+    def hits(self, sprite):
+        """Sprites of the grids the sprite collides with."""
+        hits = []
+        for grid in self._grids(sprite):
+            hits += grid.hits(sprite)
+        return hits
+
+    def collides(self, sprite):
+        """True if the sprite collides with anything in the built chunks."""
+        for grid in self._grids(sprite):
+            if grid.collides(sprite):
+                return True
+        return False
+
+
+class StreamedTriggers:
+    """
+    The TriggerMap of a streamed level: a TriggerMap per built chunk for
+    the tile layers in ``layers`` (name -> TRIGGER_* kind), plus the
+    triggers given to ``add()`` (checkpoints), which are always there.
+
+    A trigger gets its handle the first time its chunk is built and keeps
+    it, so ``kinds``, ``active`` and ``sprites`` work as in TriggerMap, and
+    what was picked up stays picked up when the chunk is built again.
+    ``sprites[handle]`` is None while the chunk is not built. Hazards are
+    only asked about by kind and get no handle (None), so walking a long
+    level does not pile them up.
+    """
+
+    def __init__(self, stream, layers):
+        self.stream = stream
+        self.layers = layers
+        self.kinds = []
+        self.active = bytearray()
+        self.sprites = []
+        # (layer, x, y) -> handle
+        self._handles = {}
+        # handle -> (chunk index, handle in its map, SpriteList)
+        self._placed = {}
+        # chunk index -> (TriggerMap, handle of each trigger of the map)
+        self.maps = {}
+        # Handles of the triggers given to add()
+        self._fixed = []
+        stream.listen(self.chunk_loaded, self.chunk_unloaded)
+
+    def _new_handle(self, sprite, kind):
+        handle = len(self.sprites)
+        self.sprites.append(sprite)
+        self.kinds.append(kind)
+        self.active.append(1)
+        return handle
+
+    def add(self, sprite, kind):
+        """Add a trigger that does not belong to a chunk. Returns its handle."""
+        handle = self._new_handle(sprite, kind)
+        self._fixed.append(handle)
+        return handle
+
+    def chunk_loaded(self, chunk):
+        stream = self.stream
+        trigger_map = TriggerMap(chunk.columns, stream.height, stream.cell_size, chunk.first_column)
+        handles = []
+        for name, kind in self.layers.items():
+            sprite_list = chunk.sprite_lists.get(name)
+            if sprite_list is None:
+                continue
+            for sprite in list(sprite_list):
+                local = trigger_map.add(sprite, kind)
+                if kind == TRIGGER_DAMAGE:
+                    handles.append(None)
+                    continue
+                key = (name, sprite.center_x, sprite.center_y)
+                handle = self._handles.get(key)
+                if handle is None:
+                    handle = self._handles[key] = self._new_handle(sprite, kind)
+                self.sprites[handle] = sprite
+                self._placed[handle] = (chunk.index, local, sprite_list)
+                handles.append(handle)
+                # Подобранное раньше не возвращается
+                if not self.active[handle]:
+                    trigger_map.remove(local)
+                    sprite.remove_from_sprite_lists()
+        self.maps[chunk.index] = trigger_map, handles
+
+    def chunk_unloaded(self, chunk):
+        _trigger_map, handles = self.maps.pop(chunk.index)
+        for handle in handles:
+            if handle is not None:
+                self.sprites[handle] = None
+                del self._placed[handle]
+
+    def sprite_list(self, handle):
+        """The chunk SpriteList of a trigger, None while its chunk is not built."""
+        placed = self._placed.get(handle)
+        return None if placed is None else placed[2]
+
+    def remove(self, handle):
+        """Take a trigger out (a pet or a heart that was picked up)."""
+        if not self.active[handle]:
+            return
+        self.active[handle] = 0
+        placed = self._placed.get(handle)
+        if placed is not None:
+            self.maps[placed[0]][0].remove(placed[1])
+
+    def restore(self, handle):
+        """Put a removed trigger back."""
+        if self.active[handle]:
+            return
+        self.active[handle] = 1
+        placed = self._placed.get(handle)
+        if placed is not None:
+            self.maps[placed[0]][0].restore(placed[1])
+
+    def query(self, sprite, kinds=TRIGGER_ALL):
+        """Handles of the triggers the sprite touches, as {kind: [handle, ...]}."""
+        points = sprite.get_adjusted_hit_box()
+        left, right = _horizontal_bounds(points)
+        width = self.stream.chunk_width
+        contacts = {}
+        # Соседние куски тоже: их тайлы могут заходить в наш
+        for index in range(math.floor(left / width) - 1, math.floor(right / width) + 2):
+            entry = self.maps.get(index)
+            if entry is None:
+                continue
+            trigger_map, handles = entry
+            for kind, found in trigger_map.query(sprite, kinds).items():
+                contacts.setdefault(kind, []).extend(handles[local] for local in found)
+        for handle in self._fixed:
+            kind = self.kinds[handle]
+            if (kind & kinds and self.active[handle]
+                    and polygons_intersect(points, self.sprites[handle].get_adjusted_hit_box())):
+                contacts.setdefault(kind, []).append(handle)
+        return contacts
+
+
+# --- Command line
+
+
+def _sweep(stream, step, view_width):
+    """Move a view over the whole level by ``step`` pixels. Returns the update times in ms."""
+    samples = []
+    peak_sprites = 0
+    x = 0.0
+    while x + view_width <= stream.pixel_width:
+        start = time.perf_counter()
+        if stream.update(x, x + view_width):
+            peak_sprites = max(peak_sprites, stream.sprite_count)
+        samples.append((time.perf_counter() - start) * 1000)
+        x += step
+    return samples, peak_sprites
+
+
+def _bench(level, columns, step):
+    from game import SCREEN_WIDTH, GameSession, load_stream
+    from headless import run
+
+    print(f"level {level} streamed as {columns} columns, view {SCREEN_WIDTH} px, step {step} px")
+
+    # Время: камера проходит весь уровень
+    _tile_map, _scene, stream, _names = load_stream(level, columns)
+    samples, peak_sprites = _sweep(stream, step, SCREEN_WIDTH)
+    samples.sort()
+    print(f"  stream updates: {len(samples)}, mean {sum(samples) / len(samples):.3f} ms, "
+          f"p99 {samples[int(len(samples) * 0.99)]:.2f} ms, max {samples[-1]:.2f} ms")
+    print(f"  chunks built {stream.loads}, dropped {stream.unloads}, "
+          f"{stream.build_time / stream.loads * 1000:.2f} ms per chunk; "
+          f"at most {stream.peak_chunks} chunks, {peak_sprites} sprites resident")
+
+    # Память: то же с tracemalloc, и весь уровень, собранный сразу
+    _tile_map, _scene, stream, _names = load_stream(level, columns)
+    tracemalloc.start()
+    _sweep(stream, stream.chunk_width / 2, SCREEN_WIDTH)
+    streamed_peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print(f"  streamed peak memory {streamed_peak / 1024 / 1024:.1f} MB")
+
+    tile_map = stream.tile_map
+    whole = [(column, stream.source_column(column)) for column in range(columns)]
+    tracemalloc.start()
+    start = time.perf_counter()
+    layers = [tile_map.tile_columns(name, whole) for name in stream.layer_names]
+    whole_time = time.perf_counter() - start
+    whole_peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print(f"  whole level built at once: {sum(len(layer) for layer in layers)} sprites, "
+          f"{whole_time * 1000:.0f} ms (with tracemalloc), peak memory {whole_peak / 1024 / 1024:.1f} MB")
+    del layers
+
+    # Логика уровня: бот из headless.py на обычном и на потоковом уровне
+    for streamed in (False, True):
+        session = GameSession.load(level, heals=2, streamed=streamed, stream_width=columns)
+        start = time.perf_counter()
+        ticks = run(session, 3600)
+        elapsed = time.perf_counter() - start
+        print(f"  {'streamed' if streamed else 'whole   '} session: {ticks / elapsed:.0f} ticks/s, "
+              f"player at x {session.player_sprite.center_x:.0f}")
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Streamed levels")
+    parser.add_argument("command", choices=["bench"])
+    parser.add_argument("--level", type=int, default=1, help="level to stream")
+    parser.add_argument("--columns", type=int, default=10000, help="width of the streamed level")
+    parser.add_argument("--step", type=float, default=3.0, help="camera move per update, pixels")
+    args = parser.parse_args(argv[1:])
+    _bench(args.level, args.columns, args.step)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
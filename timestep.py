@@ -0,0 +1,75 @@
+"""
+Fixed-timestep simulation: the game logic runs in ticks of constant length,
+drawing happens whenever the window is ready and interpolates between ticks
+"""
+from contextlib import contextmanager
+
+
+# Simulation ticks per second. Movement constants are in pixels per tick
+SIMULATION_RATE = 60
+
+# At most this many ticks are run per frame; beyond that the game slows down
+# instead of freezing while trying to catch up
+MAX_CATCH_UP_STEPS = 5
+
+# A sprite that moved further than this in one tick was teleported
+# (respawn) and is not interpolated, in pixels
+TELEPORT_DISTANCE = 100
+
+
+class FixedTimestep:
+    """Accumulates frame time and says how many ticks to run."""
+
+    def __init__(self, rate=SIMULATION_RATE, max_steps=MAX_CATCH_UP_STEPS):
+        self.step = 1 / rate
+        self.max_steps = max_steps
+        self.accumulator = 0.0
+        self.ticks = 0
+        # Время, которое пришлось выбросить из-за ограничения на догон
+        self.dropped_time = 0.0
+
+    def advance(self, delta_time):
+        """Add a frame's time. Returns the number of ticks to run now."""
+        self.accumulator += delta_time
+        steps = int(self.accumulator / self.step)
+        if steps > self.max_steps:
+            self.dropped_time += (steps - self.max_steps) * self.step
+            self.accumulator -= (steps - self.max_steps) * self.step
+            steps = self.max_steps
+        self.accumulator -= steps * self.step
+        self.ticks += steps
+        return steps
+
+    @property
+    def alpha(self):
+        """How far the current frame is between the last tick and the next one, 0..1."""
+        return min(self.accumulator / self.step, 1.0)
+
+
+class Interpolation:
+    """
+    Previous and current positions of the sprites that move, so they can be
+    drawn between two ticks.
+    """
+
+    def __init__(self, sprites=()):
+        self.sprites = list(sprites)
+        self.previous = [sprite.position for sprite in self.sprites]
+
+    def save(self):
+        """Remember positions before a tick."""
+        self.previous = [sprite.position for sprite in self.sprites]
+
+    @contextmanager
+    def blend(self, alpha):
+        """Move the sprites to the in-between positions for drawing, then put them back."""
+        current = [sprite.position for sprite in self.sprites]
+        for sprite, (x0, y0), (x1, y1) in zip(self.sprites, self.previous, current):
+            if abs(x1 - x0) > TELEPORT_DISTANCE or abs(y1 - y0) > TELEPORT_DISTANCE:
+                continue
+            sprite.position = (x0 + (x1 - x0) * alpha, y0 + (y1 - y0) * alpha)
+        try:
+            yield
+        finally:
+            for sprite, position in zip(self.sprites, current):
+                sprite.position = position